@@ -0,0 +1,95 @@
+import os
+import threading
+
+import metrics
+import ndjson_codec
+from file_locks import file_lock, bump_version, write_atomic
+
+
+# Username-keyed view of app_data/user_accounts.json.
+#
+# The file is parsed once into a dict and only reloaded when its
+# inode/size/mtime change (e.g. another server process saved a profile), so
+# login and token auto-login are a dict lookup instead of a list scan.
+
+class AccountStore:
+    def __init__(self, path):
+        self.path = path
+        self._users = {}  # username -> account dict, in file order
+        self._source = None
+        self._lock = threading.Lock()
+
+    # Account for a username (a copy, so callers can't mutate the index)
+    def get(self, username):
+        with self._lock:
+            self._refresh()
+            user = self._users.get(username)
+            return dict(user) if user else None
+
+    def authenticate(self, username, password):
+        with self._lock:
+            self._refresh()
+            user = self._users.get(username)
+            return user is not None and user.get("password") == password
+
+    def all_users(self):
+        with self._lock:
+            self._refresh()
+            return [dict(user) for user in self._users.values()]
+
+    # Update one account's fields and atomically rewrite the file. The change is made to a
+    # copy that only replaces the cached accounts once it is on disk, so a failed write
+    # leaves the cache matching the file, and logins aren't held up by the write.
+    def update(self, username, fields):
+        with file_lock(self.path):
+            with self._lock:
+                self._refresh()
+                user = self._users.get(username)
+                if user is None:
+                    return False
+                users = dict(self._users)
+            users[username] = {**user, **fields}
+            write_atomic(self.path, self._serialize(users))
+            bump_version(self.path)
+            with self._lock:
+                self._users, self._source = users, self._stat()
+            return True
+
+    # One account per line: still a plain JSON array, but cheaper than indent=2
+    def _serialize(self, users):
+        return "[\n" + ",\n".join(ndjson_codec.dumps(user) for user in users.values()) + "\n]\n"
+
+    def _stat(self):
+        stat = os.stat(self.path)
+        return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def _refresh(self):
+        try:
+            source = self._stat()
+        except OSError as e:
+            print(f"❌ Failed to load user accounts: {e}")
+            self._users, self._source = {}, None
+            return
+        metrics.cache_lookups.inc(cache="user_accounts", result="hit" if source == self._source else "miss")
+        if source == self._source:
+            return
+        try:
+            with open(self.path, "r") as f:
+                users = ndjson_codec.loads(f.read())
+        except Exception as e:
+            print(f"❌ Failed to load user accounts: {e}")
+            return
+        self._users = {user.get("username"): user for user in users if user.get("username")}
+        self._source = source
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+# One shared store per file for the whole process (Streamlit sessions and the reminder thread)
+def get_store(path):
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = AccountStore(path)
+        return _stores[path]
@@ -0,0 +1,228 @@
+from datetime import date, timedelta
+
+import adherence_rollup
+
+
+# Adherence analytics shared by the dashboard, the weekly digest and the
+# benchmarks. Kept free of Streamlit so they can be imported and timed on
+# their own. Administrations are AdminEvent tuples (see admin_events.py);
+# medications are the view dicts from medication_index.py.
+
+def get_date_range(period: str):
+    today = date.today()
+    
+    if period == "daily":
+        # Start & end are the same
+        return today, today
+    
+    elif period == "weekly":
+        start = today - timedelta(days=6)  # last 7 days (today included)
+        return start, today
+    
+    elif period == "monthly":
+        start = today.replace(day=1)  # first day of the current month
+        return start, today
+
+    else:
+        return today, today  # default fallback
+
+
+# Check if medication was taken today
+def was_medication_taken_today(med_id, administrations):
+    today = date.today().toordinal()
+    for admin in administrations:
+        # Check if this is the medication we're looking for
+        if admin.med_code != med_id:
+            continue
+            
+        # Check if the administration was today (day ordinals are pre-computed at load)
+        if admin.day == today:
+            return True
+            
+    return False
+
+
+def calculate_adherence_rate(active_meds, med_administrations, period="daily"):
+    start_date, end_date = get_date_range(period)
+    today = date.today()
+    
+    # If there are no active medications, return 100% adherence
+    if not active_meds:
+        return 1.0
+    
+    # All distinct medication IDs (we'll compare by RXnormCode if present)
+    active_codes = [
+        med["RXnormCode"] if med["RXnormCode"] else med["Medication"]
+        for med in active_meds
+    ]
+    
+    # Days are compared as date ordinals (pre-computed on each AdminEvent at load)
+    start_day, end_day, today_day = start_date.toordinal(), end_date.toordinal(), today.toordinal()
+    
+    # Build a dict: day -> set of meds taken that day
+    daily_taken_map = {}
+    
+    for admin in med_administrations:
+        admin_day = admin.day
+        if admin_day is None:
+            continue
+        
+        if start_day <= admin_day <= end_day:
+            # Record this medication in the daily map
+            if admin_day not in daily_taken_map:
+                daily_taken_map[admin_day] = set()
+            daily_taken_map[admin_day].add(admin.med_code)
+    
+    # IMPORTANT: Check if today is the first day of the month/week
+    # If yes, and if all medications are taken today, return 100%
+    if period == "monthly" and today.day == 1:
+        # First day of month
+        all_taken_today = True
+        for code in active_codes:
+            if code not in daily_taken_map.get(today_day, set()):
+                all_taken_today = False
+                break
+        if all_taken_today:
+            return 1.0  # 100% adherence
+    
+    if period == "weekly" and today.weekday() == 0:  # Monday is 0
+        # First day of week
+        all_taken_today = True
+        for code in active_codes:
+            if code not in daily_taken_map.get(today_day, set()):
+                all_taken_today = False
+                break
+        if all_taken_today:
+            return 1.0  # 100% adherence
+    
+    # For any period where all medications taken today = 100% adherence for that period
+    # This applies even if it's not the first day of the period
+    # If we're just starting to track (no historical data), and everything is taken today,
+    # then adherence should be 100%
+    if len(daily_taken_map) <= 1 and today_day in daily_taken_map:
+        # We only have data for today
+        all_taken_today = True
+        for code in active_codes:
+            if code not in daily_taken_map.get(today_day, set()):
+                all_taken_today = False
+                break
+        if all_taken_today:
+            return 1.0  # 100% adherence
+    
+    # For new tracking periods with sparse data, use only days with actual data
+    days_with_data = [day for day in daily_taken_map.keys() if start_day <= day <= end_day]
+    if days_with_data:
+        # Adjust dates to only include days when medications were tracked
+        adjusted_start = max(start_day, min(days_with_data))
+        adjusted_end = min(end_day, max(days_with_data))
+    else:
+        adjusted_start = start_day
+        adjusted_end = end_day
+    
+    # Now walk through each day in the chosen period
+    total_days = adjusted_end - adjusted_start + 1
+    
+    # We only expect medications on days that have already occurred
+    total_medications_expected = total_days * len(active_codes)
+    
+    medications_taken_count = 0
+    
+    for current_day in range(adjusted_start, adjusted_end + 1):
+        # For each day, see which meds were taken
+        meds_taken_today = daily_taken_map.get(current_day, set())
+        
+        # Count how many of the active meds are in meds_taken_today
+        for code in active_codes:
+            if code in meds_taken_today:
+                medications_taken_count += 1
+    
+    if total_medications_expected == 0:
+        return 1.0  # If no medications are expected, adherence is perfect
+    
+    return medications_taken_count / total_medications_expected
+
+
+def calculate_missed_doses(active_medications, med_administrations, days=7):
+    """Calculate missed doses for each medication over the specified period."""
+    missed_doses = {}
+    
+    # End date is today, start date is 'days' ago
+    end_date = date.today()
+    start_date = end_date - timedelta(days=days-1)
+    
+    # For each active medication
+    for med in active_medications:
+        med_id = med["RXnormCode"] or med["Medication"]
+        med_name = med["Medication"]
+        missed_count = 0
+        
+        # Check each day in the period
+        current_date = start_date
+        while current_date <= end_date:
+            # Skip future dates
+            if current_date > date.today():
+                current_date += timedelta(days=1)
+                continue
+                
+            # Check if medication was taken on this day
+            was_taken = False
+            for admin in med_administrations:
+                admin_med_id = admin.med_code
+                
+                if admin_med_id != med_id:
+                    continue
+                
+                if admin.day == current_date.toordinal():
+                    was_taken = True
+                    break
+            
+            if not was_taken:
+                missed_count += 1
+            
+            current_date += timedelta(days=1)
+        
+        missed_doses[med_name] = missed_count
+    
+    return missed_doses
+
+
+# Weekly digest for one patient, answered from the daily adherence rollup of admin_path
+def generate_weekly_summary(patient_id, user_meds, admin_path):
+    today = date.today()
+    summary = {
+        "total_taken": 0,
+        "total_expected": 0,
+        "missed_by_day": {},
+        "most_missed": {},
+    }
+
+    # Medications this patient took on each of the last 7 days, from the daily rollup
+    taken_by_day = adherence_rollup.meds_taken_by_day(
+        admin_path, patient_id, (today - timedelta(days=6)).toordinal(), today.toordinal()
+    )
+
+    for day_offset in range(7):
+        check_date = today - timedelta(days=day_offset)
+        check_day = check_date.toordinal()
+        daily_taken = 0
+        for med in user_meds:
+            med_code = med["RXnormCode"] or med["Medication"]
+            if med_code in taken_by_day.get(check_day, ()):
+                daily_taken += 1
+        summary["missed_by_day"][check_date.isoformat()] = len(user_meds) - daily_taken
+        summary["total_taken"] += daily_taken
+        summary["total_expected"] += len(user_meds)
+
+    # Most missed meds
+    med_miss_count = {}
+    for med in user_meds:
+        med_code = med["RXnormCode"] or med["Medication"]
+        misses = 0
+        for day_offset in range(7):
+            check_day = (today - timedelta(days=day_offset)).toordinal()
+            if med_code not in taken_by_day.get(check_day, ()):
+                misses += 1
+        med_miss_count[med["Medication"]] = misses
+
+    summary["most_missed"] = sorted(med_miss_count.items(), key=lambda x: x[1], reverse=True)
+    return summary
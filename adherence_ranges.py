@@ -0,0 +1,81 @@
+import numpy as np
+
+import adherence_rollup
+
+
+# Arbitrary date-range adherence for one patient.
+#
+# From the daily rollup we build cumulative (prefix-sum) arrays over day
+# ordinals, so the taken/expected totals of any range, overall or per
+# medication, are two array lookups instead of a walk over the days.
+# Expected doses follow the app's usual rule: every active medication, every
+# day from the first tracked day on.
+
+class AdherencePrefixSums:
+    def __init__(self, med_codes, first_day, last_day, taken_rows):
+        self.med_codes = list(med_codes)
+        self.first_day = first_day
+        self.last_day = last_day
+        days = last_day - first_day + 1
+        # taken[m, i]: doses of med m taken on days first_day .. first_day + i - 1
+        self.taken = np.zeros((len(self.med_codes), days + 1), dtype=np.int64)
+        np.cumsum(taken_rows, axis=1, out=self.taken[:, 1:])
+        # expected[i]: doses expected per medication over the same days
+        self.expected = np.arange(days + 1, dtype=np.int64)
+
+    # (taken, expected) doses over start_day..end_day (inclusive day ordinals), all medications
+    def totals(self, start_day, end_day):
+        lo, hi = self._bounds(start_day, end_day)
+        if lo >= hi:
+            return 0, 0
+        taken = int(self.taken[:, hi].sum() - self.taken[:, lo].sum())
+        return taken, int(self.expected[hi] - self.expected[lo]) * len(self.med_codes)
+
+    # {med code: (taken, expected)} over start_day..end_day
+    def by_medication(self, start_day, end_day):
+        lo, hi = self._bounds(start_day, end_day)
+        if lo >= hi:
+            return {code: (0, 0) for code in self.med_codes}
+        taken = self.taken[:, hi] - self.taken[:, lo]
+        expected = int(self.expected[hi] - self.expected[lo])
+        return {code: (int(taken[m]), expected) for m, code in enumerate(self.med_codes)}
+
+    # (day ordinals, rolling adherence %) for every tracked day: each point covers the
+    # window_days ending that day (fewer at the start of the history). med_code=None is all meds.
+    def rolling_adherence(self, window_days, med_code=None):
+        if med_code is None:
+            taken_prefix, meds = self.taken.sum(axis=0), len(self.med_codes)
+        else:
+            taken_prefix, meds = self.taken[self.med_codes.index(med_code)], 1
+        hi = np.arange(1, len(self.expected))
+        lo = np.maximum(hi - window_days, 0)
+        taken = taken_prefix[hi] - taken_prefix[lo]
+        expected = (self.expected[hi] - self.expected[lo]) * meds
+        rate = np.divide(taken * 100.0, expected, out=np.zeros(len(hi)), where=expected > 0)
+        return self.first_day + hi - 1, rate
+
+    # Clip an inclusive day range to prefix indexes [lo, hi)
+    def _bounds(self, start_day, end_day):
+        lo = min(max(start_day, self.first_day), self.last_day + 1) - self.first_day
+        hi = min(max(end_day + 1, self.first_day), self.last_day + 1) - self.first_day
+        return lo, hi
+
+
+# Prefix sums for a patient's medications (keys as in AdminEvent.med_code) up to last_day
+def build_prefix_sums(path, patient_id, med_codes, last_day):
+    rollup_meds, day_masks = adherence_rollup.patient_day_masks(path, patient_id)
+    tracked = [day for day in day_masks if day <= last_day]
+    first_day = min(tracked) if tracked else last_day
+
+    days = np.fromiter(tracked, dtype=np.int64, count=len(tracked)) - first_day
+    masks = [day_masks[day] for day in tracked]
+    bits = {code: bit for bit, code in enumerate(rollup_meds)}
+
+    taken_rows = np.zeros((len(med_codes), last_day - first_day + 1), dtype=np.int64)
+    for m, code in enumerate(med_codes):
+        bit = bits.get(code)
+        if bit is None:
+            continue
+        hits = np.fromiter((mask >> bit & 1 for mask in masks), dtype=np.int64, count=len(masks))
+        taken_rows[m, days] = hits
+    return AdherencePrefixSums(med_codes, first_day, last_day, taken_rows)
@@ -0,0 +1,314 @@
+import hashlib
+import os
+import pickle
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import admin_events
+import metrics
+from file_locks import file_lock
+from medication_index import patient_id_of
+
+
+# Materialized per-patient, per-day adherence rollup of MedicationAdministration.ndjson.
+#
+# For every patient the rollup assigns each medication (AdminEvent.med_code)
+# a bit and keeps, per local day ordinal, an entry
+#   [mask of medications taken, administration records, {bit: records}]
+# so "which meds did this patient take on day D" is a dict lookup instead of
+# a scan of the log. Each patient also counts the changes to their part, so
+# caches derived from it can be keyed per patient (patient_revision). It lives in a "<file>.rollup" sidecar (a pickle behind a
+# magic and a sha256 of the payload, so a torn or foreign file is ignored and
+# rebuilt), saved on a background thread off the request path.
+#
+# The administration writer keeps it current: appends are folded in from the
+# bytes just written, and a tombstone (a deleted record, see
+# admin_events.tombstone) subtracts its record again. Appends made elsewhere
+# are caught up from the log tail on the next read. When the writer compacts
+# the log the rollup moves over to the new file; a log rewritten any other way
+# (new inode, or the bytes before the indexed offset changed) is rebuilt.
+#
+#   python helper_scripts/rebuild_adherence_rollup.py   regenerates it from scratch
+
+ROLLUP_MAGIC = b"MEDROLL2"
+FINGERPRINT_BYTES = 64
+SAVE_INTERVAL = 30  # seconds between sidecar writes for append-only changes
+
+_rollups = {}  # path -> in-process rollup
+_rollups_lock = threading.Lock()
+_saves = set()  # paths with a sidecar save in flight
+_saves_lock = threading.Lock()
+
+
+# Set of medication keys the patient took on a day (date ordinal)
+def meds_taken(path, patient_id, day):
+    return meds_taken_by_day(path, patient_id, day, day).get(day, set())
+
+
+# {day ordinal: set of medication keys taken} for start_day..end_day, days without records omitted
+def meds_taken_by_day(path, patient_id, start_day, end_day):
+    with _reading(path) as rollup:
+        patient = rollup["patients"].get(patient_id)
+        if patient is None:
+            return {}
+        if end_day - start_day < len(patient["days"]):
+            days = ((day, patient["days"].get(day)) for day in range(start_day, end_day + 1))
+        else:
+            days = ((day, entry) for day, entry in patient["days"].items() if start_day <= day <= end_day)
+        return {day: _keys(patient, entry[0]) for day, entry in days if entry}
+
+
+# (medication keys by bit, {day ordinal: taken mask}) for one patient, copied out of the rollup
+def patient_day_masks(path, patient_id):
+    with _reading(path) as rollup:
+        patient = rollup["patients"].get(patient_id)
+        if patient is None:
+            return [], {}
+        return list(patient["meds"]), {day: entry[0] for day, entry in patient["days"].items()}
+
+
+# Cache key for one patient's part of the rollup: changes whenever a record of theirs is
+# folded in or removed, and whenever the rollup is rebuilt (other patients' writes don't)
+def patient_revision(path, patient_id):
+    with _reading(path) as rollup:
+        patient = rollup["patients"].get(patient_id)
+        return rollup["generation"], patient["revision"] if patient else 0
+
+
+# Regenerate the rollup from the whole log; returns (patients, days) counts
+def rebuild(path):
+    with file_lock(path, shared=True), _rollups_lock:
+        rollup = _catch_up(path, _empty_rollup())
+        _rollups[path] = rollup
+        _write(path, rollup)
+        return len(rollup["patients"]), sum(len(p["days"]) for p in rollup["patients"].values())
+
+
+# Called by the administration writer after appending, while it holds file_lock(path)
+def note_appended(path):
+    with _rollups_lock, _updating(path):
+        _rollups[path] = _catch_up(path, _load(path))
+        _maybe_save(path)
+
+
+# Called by the log compactor before swapping in the compacted log, while it holds file_lock(path)
+def prepare_compact(path):
+    with _rollups_lock, _updating(path):
+        _rollups[path] = _catch_up(path, _load(path))
+
+
+# Called by the log compactor after swapping in the compacted log. Compaction only drops
+# records together with their tombstones, all before the indexed offset, so the rollup
+# itself is unchanged: it just moves to the new file, removed_bytes earlier.
+def note_compacted(path, removed_bytes):
+    with _rollups_lock, _updating(path):
+        rollup = _rollups[path]
+        offset = rollup["source"]["offset"] - removed_bytes
+        rollup["source"] = _source_at(path, offset)
+        _save_in_background(path)
+
+
+# A failed rollup update must not fail the log write itself: drop the in-process
+# copy so the next read re-validates against the log (and rebuilds if needed)
+@contextmanager
+def _updating(path):
+    try:
+        yield
+    except Exception as e:
+        print(f"❌ Failed to update adherence rollup for {path}: {e}")
+        _rollups.pop(path, None)
+
+
+# Up-to-date rollup, held under the lock so the writer can't mutate it mid-query.
+# The file lock is taken before _rollups_lock, in the same order as the writer.
+@contextmanager
+def _reading(path):
+    with file_lock(path, shared=True), _rollups_lock:
+        cached = _rollups.get(path)
+        cached_source = cached and cached["source"]
+        try:
+            rollup = _catch_up(path, _load(path))
+        except FileNotFoundError:
+            yield _empty_rollup()
+            return
+        # A hit is the in-process rollup with nothing new to fold in (_catch_up replaces "source" when it reads)
+        metrics.cache_lookups.inc(
+            cache="adherence_rollup", result="hit" if rollup is cached and rollup["source"] is cached_source else "miss"
+        )
+        _rollups[path] = rollup
+        _maybe_save(path)
+        yield rollup
+
+
+def _empty_rollup():
+    return {
+        "source": {"inode": None, "offset": 0, "fingerprint": b""},
+        "generation": uuid.uuid4().hex,  # new for every rollup built from scratch
+        # patient id -> {"meds": [key, ...], "bits": {key: bit}, "days": {...}, "revision": changes}
+        "patients": {},
+        "saved_at": 0,
+    }
+
+
+# In-process rollup, else the sidecar, else an empty one to be built
+def _load(path):
+    rollup = _rollups.get(path)
+    if rollup is None:
+        rollup = _read_sidecar(path) or _empty_rollup()
+    return rollup
+
+
+# Fold log bytes past the indexed offset into the rollup (all of them after a rewrite)
+def _catch_up(path, rollup):
+    stat = os.stat(path)
+    with open(path, "rb") as f:
+        if not _still_valid(f, stat, rollup["source"]):
+            # Rewritten log: another process may already have saved a matching rollup
+            rollup = _read_sidecar(path)
+            if rollup is None or rollup["source"]["inode"] is None or not _still_valid(f, stat, rollup["source"]):
+                rollup = _empty_rollup()
+        offset = rollup["source"]["offset"]
+        if stat.st_size == offset and rollup["source"]["inode"] == stat.st_ino:
+            return rollup
+        f.seek(offset)
+        tail = f.read()
+
+    # Only consume complete lines; a partial trailing line waits for the next read
+    consumed = tail.rfind(b"\n") + 1
+    for line in tail[:consumed].splitlines():
+        if not line.strip():
+            continue
+        try:
+            event = admin_events.decode_event(line)
+        except ValueError:
+            continue
+        if event is None:
+            continue
+        if event.status == admin_events.DELETED_STATUS:
+            _remove(rollup, event)
+        else:
+            _add(rollup, event)
+    rollup["source"] = _source_at(path, offset + consumed)
+    return rollup
+
+
+def _add(rollup, event):
+    if event.day is None:
+        return
+    patient = rollup["patients"].setdefault(
+        patient_id_of(event.patient_ref), {"meds": [], "bits": {}, "days": {}, "revision": 0}
+    )
+    patient["revision"] += 1
+    bit = patient["bits"].get(event.med_code)
+    if bit is None:
+        bit = patient["bits"][event.med_code] = len(patient["meds"])
+        patient["meds"].append(event.med_code)
+    entry = patient["days"].setdefault(event.day, [0, 0, {}])
+    entry[0] |= 1 << bit
+    entry[1] += 1
+    entry[2][bit] = entry[2].get(bit, 0) + 1
+
+
+def _remove(rollup, event):
+    patient = rollup["patients"].get(patient_id_of(event.patient_ref))
+    bit = patient["bits"].get(event.med_code) if patient else None
+    entry = patient["days"].get(event.day) if bit is not None else None
+    if entry is None or not entry[2].get(bit):
+        return
+    patient["revision"] += 1
+    entry[1] -= 1
+    entry[2][bit] -= 1
+    if not entry[2][bit]:
+        del entry[2][bit]
+        entry[0] &= ~(1 << bit)
+    if not entry[1]:
+        del patient["days"][event.day]
+
+
+def _keys(patient, mask):
+    return {key for bit, key in enumerate(patient["meds"]) if mask >> bit & 1}
+
+
+def _still_valid(f, stat, source):
+    if source["inode"] is None:
+        return True  # nothing indexed yet
+    if source["inode"] != stat.st_ino or stat.st_size < source["offset"]:
+        return False
+    start = max(0, source["offset"] - FINGERPRINT_BYTES)
+    f.seek(start)
+    return f.read(source["offset"] - start) == source["fingerprint"]
+
+
+def _source_at(path, offset):
+    start = max(0, offset - FINGERPRINT_BYTES)
+    with open(path, "rb") as f:
+        f.seek(start)
+        return {"inode": os.fstat(f.fileno()).st_ino, "offset": offset, "fingerprint": f.read(offset - start)}
+
+
+def _maybe_save(path):
+    if time.time() - _rollups[path]["saved_at"] >= SAVE_INTERVAL:
+        _save_in_background(path)
+
+
+# Save the sidecar off the request path, at most one save per file at a time. The
+# saver holds the shared file lock, under which nobody appends to or rewrites the
+# log, so once it has caught the rollup up nothing changes it and it can be pickled
+# without _rollups_lock (readers' catch-ups find nothing new). Writers wait for it.
+def _save_in_background(path):
+    with _saves_lock:
+        if path in _saves:
+            return
+        _saves.add(path)
+
+    def save():
+        try:
+            with file_lock(path, shared=True):
+                with _rollups_lock, _updating(path):
+                    _rollups[path] = _catch_up(path, _load(path))
+                rollup = _rollups.get(path)
+                if rollup is not None:
+                    _write(path, rollup)
+        finally:
+            with _saves_lock:
+                _saves.discard(path)
+
+    threading.Thread(target=save, name="adherence-rollup-saver", daemon=True).start()
+
+
+def _read_sidecar(path):
+    try:
+        with open(path + ".rollup", "rb") as f:
+            blob = f.read()
+    except OSError:
+        return None
+
+    header_len = len(ROLLUP_MAGIC) + 32
+    if blob[:len(ROLLUP_MAGIC)] != ROLLUP_MAGIC:
+        print(f"⚠️ Ignoring adherence rollup with unknown format: {path}.rollup")
+        return None
+    payload = blob[header_len:]
+    if hashlib.sha256(payload).digest() != blob[len(ROLLUP_MAGIC):header_len]:
+        print(f"⚠️ Ignoring corrupt adherence rollup: {path}.rollup")
+        return None
+
+    try:
+        return pickle.loads(payload)
+    except Exception as e:
+        print(f"⚠️ Failed to read adherence rollup {path}.rollup: {e}")
+        return None
+
+
+def _write(path, rollup):
+    saved_at = time.time()
+    payload = pickle.dumps(dict(rollup, saved_at=saved_at), protocol=pickle.HIGHEST_PROTOCOL)
+    tmp_path = f"{path}.rollup.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(ROLLUP_MAGIC + hashlib.sha256(payload).digest() + payload)
+        os.replace(tmp_path, path + ".rollup")
+        rollup["saved_at"] = saved_at
+    except Exception as e:
+        print(f"❌ Failed to write adherence rollup for {path}: {e}")
@@ -0,0 +1,149 @@
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+import ndjson_codec
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+# Compact MedicationAdministration events.
+#
+# The analytics only need a handful of fields, so instead of decoding every
+# record into nested dicts (reasonCode, performer, context, ...) each line is
+# projected straight into an AdminEvent tuple. With msgspec installed this is
+# a typed schema decode that skips unused fields; otherwise each line is fully
+# parsed with ndjson_codec (orjson when available) and projected from the dict.
+#
+# effectiveDateTime is parsed exactly once, here: every event carries a
+# timezone-aware epoch and the local calendar day as a date ordinal, so the
+# analytics compare integers instead of re-parsing strings in their loops.
+
+RXNORM_SYSTEM = "http://www.nlm.nih.gov/research/umls/rxnorm"
+DELETED_STATUS = "entered-in-error"  # status of a tombstone, see tombstone()
+
+
+class AdminEvent(NamedTuple):
+    id: str
+    patient_ref: str  # subject.reference, e.g. "Patient/<id>"
+    med_code: str     # RxNorm code, or medicationCodeableConcept.text if there is none
+    med_text: str     # medicationCodeableConcept.text
+    effective: str    # effectiveDateTime as written
+    status: str
+    epoch: Optional[float]  # effectiveDateTime as a POSIX timestamp (None if unparseable)
+    day: Optional[int]      # local calendar day, date.toordinal() (None if unparseable)
+
+
+# Naive timestamps (datetime.now().isoformat(), as the checklist writes them) are
+# server-local wall time; aware ones are converted to the server's local day
+def normalize_time(effective):
+    try:
+        moment = datetime.fromisoformat(effective)
+    except (TypeError, ValueError):
+        try:
+            moment = datetime.strptime(effective.split("T")[0], "%Y-%m-%d")
+        except (AttributeError, ValueError):
+            return None, None
+    if moment.tzinfo is None:
+        local_day = moment.date()
+        moment = moment.astimezone()
+    else:
+        local_day = moment.astimezone().date()
+    return moment.timestamp(), local_day.toordinal()
+
+
+def _event(record_id, patient_ref, med_code, med_text, effective, status):
+    return AdminEvent(record_id, patient_ref, med_code, med_text, effective, status, *normalize_time(effective))
+
+
+# Project an already-decoded record (e.g. one the checklist just created)
+def from_record(record):
+    if record.get("resourceType") != "MedicationAdministration":
+        return None
+    concept = record.get("medicationCodeableConcept", {})
+    text = concept.get("text", "")
+    code = next((c.get("code") for c in concept.get("coding", []) if c.get("system") == RXNORM_SYSTEM), None)
+    return _event(
+        record.get("id", ""),
+        record.get("subject", {}).get("reference", ""),
+        code or text,
+        text,
+        record.get("effectiveDateTime", ""),
+        record.get("status", ""),
+    )
+
+
+# Deleting an administration appends a tombstone instead of rewriting the log: the same
+# record (id, patient, medication, time) with status entered-in-error, which projects to
+# the same event apart from its status
+def tombstone(event):
+    return {
+        "resourceType": "MedicationAdministration",
+        "id": event.id,
+        "status": DELETED_STATUS,
+        "medicationCodeableConcept": {
+            "coding": [{"system": RXNORM_SYSTEM, "code": event.med_code}],
+            "text": event.med_text,
+        },
+        "subject": {"reference": event.patient_ref},
+        "effectiveDateTime": event.effective,
+    }
+
+
+# Lines that aren't a record of the expected shape raise ValueError, like invalid JSON,
+# so callers skip them with a single except clause
+def _full_parse(line):
+    record = ndjson_codec.loads(line)
+    if not isinstance(record, dict):
+        raise ValueError(f"Expected a JSON object, got {type(record).__name__}")
+    try:
+        return from_record(record)
+    except (AttributeError, TypeError) as e:
+        raise ValueError(f"Malformed MedicationAdministration record: {e}") from e
+
+
+# --- msgspec typed schema -------------------------------------------------------------------
+
+if msgspec is not None:
+    class _Coding(msgspec.Struct):
+        system: str = ""
+        code: str = ""
+
+    class _Concept(msgspec.Struct):
+        coding: list[_Coding] = []
+        text: str = ""
+
+    class _Reference(msgspec.Struct):
+        reference: str = ""
+
+    class _AdminRecord(msgspec.Struct):
+        resourceType: str = ""
+        id: str = ""
+        status: str = ""
+        medicationCodeableConcept: _Concept = msgspec.field(default_factory=_Concept)
+        subject: _Reference = msgspec.field(default_factory=_Reference)
+        effectiveDateTime: str = ""
+
+    _schema_decoder = msgspec.json.Decoder(_AdminRecord)
+
+    def _decode_typed(line):
+        try:
+            record = _schema_decoder.decode(line)
+        except msgspec.DecodeError:
+            # Unexpected types somewhere in the projected fields
+            return _full_parse(line)
+        if record.resourceType != "MedicationAdministration":
+            return None
+        concept = record.medicationCodeableConcept
+        code = next((c.code for c in concept.coding if c.system == RXNORM_SYSTEM), None)
+        return _event(
+            record.id, record.subject.reference, code or concept.text,
+            concept.text, record.effectiveDateTime, record.status,
+        )
+
+
+# Decode one NDJSON line into an AdminEvent (None for other resource types); raises
+# ValueError for lines that aren't a JSON object of the expected shape
+decode_event = _decode_typed if msgspec is not None else _full_parse
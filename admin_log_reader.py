@@ -0,0 +1,228 @@
+import mmap
+import os
+import pickle
+import re
+import threading
+from datetime import date, timedelta
+
+import admin_events
+import medication_index
+import metrics
+import ndjson_codec
+from file_locks import file_lock
+
+
+# Date-range reads over MedicationAdministration.ndjson.
+#
+# The analytics only look at the last few weeks, so instead of decoding the
+# whole history we memory-map the log and keep a sparse index of ~64 KB
+# blocks, each with the earliest and latest effectiveDateTime day it holds.
+# A query only walks the blocks whose [min_day, max_day] overlaps the window
+# and only json-decodes lines whose day falls inside it. Records are appended
+# roughly in date order, so few blocks overlap a recent window; out-of-order
+# lines just widen their block's range and are still found.
+#
+# The index and the line pre-filter go by the date as written in
+# effectiveDateTime, but the window is in server-local days (AdminEvent.day):
+# a timezone-aware timestamp near midnight can fall on another local day. So
+# the raw dates are matched with a margin and the decoded records are then
+# kept by their normalized local day.
+#
+# Reads for one patient (the app's) work the same way: a line is only decoded
+# if the patient id occurs in it, and the decoded record is then kept only if
+# its subject.reference is that patient's.
+#
+# Deleted records stay in the log until it is compacted, followed by a
+# tombstone (see admin_events.tombstone) with the same id and time, so a read
+# drops every record that has a tombstone in its window.
+#
+# The index lives in a "<file>.dateidx" sidecar, is extended incrementally
+# when the log grows and is rebuilt when it is rewritten.
+
+BLOCK_BYTES = 64 * 1024
+# Most days a written date can be from its server-local day (UTC offsets span -12:00..+14:00)
+RAW_DAY_MARGIN = timedelta(days=2)
+_DAY_RE = re.compile(rb'"effectiveDateTime"\s*:\s*"(\d{4}-\d{2}-\d{2})')
+
+_indexes = {}  # path -> in-process block index
+_indexes_lock = threading.Lock()
+
+
+# Administration records whose server-local effectiveDateTime day is in
+# [start_date, end_date], optionally only those of one patient (subject.reference
+# "Patient/<patient_id>"). decode turns one raw line into a record (full FHIR dict
+# by default, or e.g. admin_events.decode_event); lines it maps to None are dropped.
+# Deleted records are left out, and so are their tombstones.
+def read_range(path, start_date, end_date, decode=ndjson_codec.loads, patient_id=None):
+    try:
+        with metrics.ndjson_load_seconds.time(file=os.path.basename(path), loader="date_range"), \
+                file_lock(path, shared=True):
+            records = _live(_scan(path, start_date, end_date, decode, patient_id))
+    except FileNotFoundError:
+        records = []
+    metrics.ndjson_records_parsed.inc(len(records), file=os.path.basename(path), loader="date_range")
+    return records
+
+
+# Ids of the records on server-local days start_day..end_day (date ordinals) that
+# haven't been deleted. For the administration writer, which holds file_lock(path).
+def live_ids(path, start_day, end_day):
+    try:
+        events = _scan(path, date.fromordinal(start_day), date.fromordinal(end_day), admin_events.decode_event, None)
+    except FileNotFoundError:
+        return set()
+    return {event.id for event in _live(events)}
+
+
+# Bring the date index up to date now (e.g. right after the log was compacted)
+# rather than on the next read
+def refresh_index(path):
+    try:
+        _get_index(path)
+    except FileNotFoundError:
+        pass
+
+
+def _scan(path, start_date, end_date, decode, patient_id):
+    start_day = (start_date - RAW_DAY_MARGIN).isoformat().encode()
+    end_day = (end_date + RAW_DAY_MARGIN).isoformat().encode()
+    window = (start_date.toordinal(), end_date.toordinal())
+    patient = None if patient_id is None else (patient_id.encode(), patient_id)
+    records = []
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return records
+        index = _get_index(path)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for block_start, block_end, min_day, max_day in index["blocks"]:
+                if max_day < start_day or min_day > end_day:
+                    continue
+                _scan_block(mm, block_start, block_end, start_day, end_day, window, patient, decode, records)
+    return records
+
+
+# Records minus tombstones and the records they delete. A tombstone has its record's
+# effectiveDateTime, so both are always in the same window.
+def _live(records):
+    deleted = {_id(record) for record in records if _status(record) == admin_events.DELETED_STATUS}
+    if not deleted:
+        return records
+    return [record for record in records if _id(record) not in deleted]
+
+
+def _scan_block(mm, start, end, start_day, end_day, window, patient, decode, records):
+    pos = start
+    while pos < end:
+        line_end = mm.find(b"\n", pos, end)
+        if line_end == -1:
+            line_end = end
+        match = _DAY_RE.search(mm, pos, line_end)
+        if match and start_day <= match.group(1) <= end_day and (
+                patient is None or mm.find(patient[0], pos, line_end) != -1):
+            try:
+                record = decode(mm[pos:line_end])
+            except ValueError:
+                record = None
+            if record is not None:
+                day = _local_day(record)
+                if day is not None and window[0] <= day <= window[1] and (
+                        patient is None or _patient_id(record) == patient[1]):
+                    records.append(record)
+        pos = line_end + 1
+
+
+# Server-local day ordinal of a decoded record, as admin_events computes it
+def _local_day(record):
+    if isinstance(record, admin_events.AdminEvent):
+        return record.day
+    try:
+        return admin_events.normalize_time(record.get("effectiveDateTime"))[1]
+    except AttributeError:
+        return None
+
+
+def _id(record):
+    return record.id if isinstance(record, admin_events.AdminEvent) else record.get("id")
+
+
+def _status(record):
+    return record.status if isinstance(record, admin_events.AdminEvent) else record.get("status")
+
+
+# Patient id of a decoded record's subject.reference
+def _patient_id(record):
+    if isinstance(record, admin_events.AdminEvent):
+        reference = record.patient_ref
+    else:
+        try:
+            reference = record.get("subject", {}).get("reference", "")
+        except AttributeError:
+            return None
+    return medication_index.patient_id_of(reference)
+
+
+def _get_index(path):
+    with _indexes_lock:
+        stat = os.stat(path)
+        source = {"inode": stat.st_ino, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        index = _indexes.get(path)
+        hit = index is not None and index["source"] == source
+        metrics.cache_lookups.inc(cache="date_index", result="hit" if hit else "miss")
+        if not hit:
+            on_disk = _read_index(path)
+            if on_disk is not None and on_disk["source"] == source:
+                index = on_disk
+            else:
+                index = _extend(path, on_disk or index, stat)
+                index["source"] = source
+                _write_index(path, index)
+        _indexes[path] = index
+        return index
+
+
+# Index the part of the file past what is already indexed (or all of it after a rewrite)
+def _extend(path, index, stat):
+    if index is None or index["source"]["inode"] != stat.st_ino or stat.st_size < index["indexed_to"]:
+        index = {"source": None, "blocks": [], "indexed_to": 0}
+
+    # Build a new index rather than mutating one a concurrent reader may be walking
+    blocks = list(index["blocks"])
+    index = {"source": index["source"], "blocks": blocks, "indexed_to": index["indexed_to"]}
+    pos = index["indexed_to"]
+    # Grow a short last block rather than adding a tiny block per append
+    if blocks and blocks[-1][1] == pos and blocks[-1][1] - blocks[-1][0] < BLOCK_BYTES:
+        pos = blocks.pop()[0]
+
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        size = len(mm)
+        while pos < size:
+            # Cut blocks at line boundaries; a trailing partial line waits for the next append
+            cut = mm.rfind(b"\n", pos, min(pos + BLOCK_BYTES, size)) + 1
+            if cut <= pos:
+                cut = mm.find(b"\n", pos) + 1
+                if cut <= 0:
+                    break
+            days = _DAY_RE.findall(mm, pos, cut)
+            if days:
+                blocks.append((pos, cut, min(days), max(days)))
+            pos = cut
+        index["indexed_to"] = pos
+    return index
+
+
+def _read_index(path):
+    try:
+        with open(path + ".dateidx", "rb") as f:
+            return pickle.load(f)
+    except Exception:
+        return None
+
+
+def _write_index(path, index):
+    tmp_path = f"{path}.dateidx.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path + ".dateidx")
+    except Exception as e:
+        print(f"❌ Failed to write date index for {path}: {e}")
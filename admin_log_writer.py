@@ -0,0 +1,230 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import adherence_rollup
+import admin_events
+import admin_log_reader
+import metrics
+import ndjson_codec
+from file_locks import file_lock, bump_version
+
+_write_seconds = metrics.histogram(
+    "medtracker_checklist_write_seconds", "Time from queueing a checklist write until it is durable (or failed)", ["op"]
+)
+_write_errors = metrics.counter("medtracker_checklist_write_errors_total", "Checklist writes that failed", ["op"])
+_batch_size = metrics.histogram(
+    "medtracker_checklist_commit_batch_size", "Operations written by one group commit", [],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512),
+)
+
+
+# Tombstones appended by this process before the log is compacted in the background
+COMPACT_AFTER = 256
+# Longest a caller should wait for a write; a commit taking longer marks the writer stuck
+WRITE_TIMEOUT_SECONDS = 10
+
+
+# Background writer for MedicationAdministration.ndjson.
+# All sessions in the server process share one writer thread. Operations that
+# arrive within the same group-commit window are written together with a
+# single write + fsync, and every caller gets a Future that resolves once its
+# record is durable on disk. The log is append-only: a delete appends a
+# tombstone for each record (see admin_events.tombstone), and every
+# COMPACT_AFTER tombstones a background thread rewrites the log without the
+# deleted records. The daily adherence rollup is updated under the same lock
+# as each write; a failed rollup or version update doesn't fail the write it
+# follows.
+class AdministrationLogWriter:
+    def __init__(self, path, commit_interval=0.005, max_batch=512):
+        self.path = path
+        self.commit_interval = commit_interval  # seconds to wait for more writes to join a group
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._tombstones = 0  # appended since the last compaction
+        self._compactor = None
+        self._busy_since = None  # time.monotonic() when the commit in progress started
+        self._thread = threading.Thread(target=self._run, name="admin-log-writer", daemon=True)
+        self._thread.start()
+
+    # Queue a new administration record to be appended to the log
+    def append(self, record):
+        return self._submit("append", record)
+
+    # Queue deletion of logged administrations (AdminEvents, e.g. from admin_log_reader.read_range)
+    def delete(self, events):
+        return self._submit("delete", list(events))
+
+    # Block until every operation queued so far has been written; raises TimeoutError
+    # (concurrent.futures) if that takes longer than timeout seconds
+    def flush(self, timeout=None):
+        self._submit("flush", None).result(timeout=timeout)
+
+    # False once the writer thread died or a commit has been running for longer than
+    # WRITE_TIMEOUT_SECONDS (e.g. stuck on the file lock or a hung disk); callers should
+    # then replace it. Its queued operations are still written if it recovers.
+    def healthy(self):
+        busy_since = self._busy_since
+        stuck = busy_since is not None and time.monotonic() - busy_since > WRITE_TIMEOUT_SECONDS
+        return self._thread.is_alive() and not stuck
+
+    def _submit(self, op, payload):
+        future = Future()
+        queued_at = time.perf_counter()
+
+        def record(done):
+            _write_seconds.observe(time.perf_counter() - queued_at, op=op)
+            if done.exception() is not None:
+                _write_errors.inc(op=op)
+
+        future.add_done_callback(record)
+        self._queue.put((op, payload, future))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+
+            # Let concurrent writers join this group until the window closes
+            deadline = time.monotonic() + self.commit_interval
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            _batch_size.observe(len(batch))
+            self._busy_since = time.monotonic()
+            try:
+                self._commit(batch)
+                if self._tombstones >= COMPACT_AFTER:
+                    self._start_compaction()
+            except Exception as e:
+                # Never let the thread die: every queued caller would wait out its timeout
+                print(f"❌ Administration log writer error for {self.path}: {e}")
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            finally:
+                self._busy_since = None
+
+    # Write a group of operations, in arrival order, with one write + fsync
+    def _commit(self, batch):
+        try:
+            with file_lock(self.path):
+                lines, appended, deleted = [], set(), set()
+                for op, payload, _ in batch:
+                    if op == "append":
+                        lines.append(ndjson_codec.dumps_line(payload))
+                        appended.add(payload.get("id"))
+                    elif op == "delete":
+                        lines.extend(self._tombstone_lines(payload, appended, deleted))
+                if lines:
+                    with open(self.path, "a") as f:
+                        f.write("".join(lines))
+                        f.flush()
+                        os.fsync(f.fileno())
+                    self._note_written(adherence_rollup.note_appended, self.path)
+        except Exception as e:
+            print(f"❌ Failed to write to {self.path}: {e}")
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+        self._tombstones += len(deleted)
+        for _, _, future in batch:
+            future.set_result(True)
+
+    # Tombstones for the events that are in the log (or appended earlier in this batch) and
+    # not deleted yet. Another session may have deleted the same record first; a second
+    # tombstone would subtract it from the rollup twice.
+    def _tombstone_lines(self, events, appended, deleted):
+        days = [event.day for event in events if event.day is not None]
+        live = admin_log_reader.live_ids(self.path, min(days), max(days)) if days else set()
+        lines = []
+        for event in events:
+            if event.id in deleted or (event.id not in live and event.id not in appended):
+                continue
+            deleted.add(event.id)
+            lines.append(ndjson_codec.dumps_line(admin_events.tombstone(event)))
+        return lines
+
+    def _start_compaction(self):
+        if self._compactor is not None and self._compactor.is_alive():
+            return
+        self._tombstones = 0
+        self._compactor = threading.Thread(target=self._compact, name="admin-log-compactor", daemon=True)
+        self._compactor.start()
+
+    # Rewrite the log without deleted records and their tombstones. The bulk of it is read
+    # and rewritten to a temporary file without the lock; only copying over what was
+    # appended meanwhile and swapping the file in happen under it.
+    def _compact(self):
+        tmp_path = f"{self.path}.compact.{os.getpid()}.tmp"
+        try:
+            with open(self.path, "rb") as f:
+                inode = os.fstat(f.fileno()).st_ino
+                head = f.read()
+            head = head[:head.rfind(b"\n") + 1]  # complete lines only
+            kept, removed_bytes = _without_deleted(head.splitlines(keepends=True))
+            if not removed_bytes:
+                return
+            with open(tmp_path, "wb") as out:
+                out.writelines(kept)
+
+                with file_lock(self.path):
+                    with open(self.path, "rb") as f:
+                        stat = os.fstat(f.fileno())
+                        if stat.st_ino != inode or stat.st_size < len(head):
+                            return  # rewritten meanwhile (another process compacted it)
+                        f.seek(len(head))
+                        out.write(f.read())
+                    out.flush()
+                    os.fsync(out.fileno())
+                    adherence_rollup.prepare_compact(self.path)
+                    os.replace(tmp_path, self.path)
+                    self._note_written(adherence_rollup.note_compacted, self.path, removed_bytes)
+            admin_log_reader.refresh_index(self.path)
+        except Exception as e:
+            print(f"❌ Failed to compact {self.path}: {e}")
+        finally:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+
+    # Bump the data version and update the rollup after a durable write, before its
+    # futures resolve (so a woken caller sees the new version). Failures here are only
+    # logged: the records are on disk, so the operation succeeded; the rollup catches up
+    # from the log on its next read and the next write bumps the version again.
+    def _note_written(self, update_rollup, *args):
+        try:
+            bump_version(self.path)
+        except Exception as e:
+            print(f"❌ Failed to bump the data version of {self.path}: {e}")
+        try:
+            update_rollup(*args)
+        except Exception as e:
+            print(f"❌ Failed to update the adherence rollup for {self.path}: {e}")
+
+
+# Log lines minus deleted records and their tombstones; returns (kept lines, bytes removed)
+def _without_deleted(lines):
+    events = []
+    for line in lines:
+        try:
+            events.append(admin_events.decode_event(line))
+        except ValueError:
+            events.append(None)
+    deleted = {event.id for event in events if event is not None and event.status == admin_events.DELETED_STATUS}
+    kept, removed_bytes = [], 0
+    for line, event in zip(lines, events):
+        if event is not None and event.id in deleted:
+            removed_bytes += len(line)
+        else:
+            kept.append(line)
+    return kept, removed_bytes
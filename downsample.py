@@ -0,0 +1,36 @@
+import numpy as np
+
+
+# Largest-Triangle-Three-Buckets downsampling for line charts.
+#
+# Keeps the first and last points and, from each of n_out - 2 equal buckets
+# in between, the point forming the largest triangle with the previously
+# kept point and the average of the next bucket. Peaks and dips survive, so
+# a multi-year daily series can be drawn with a few hundred points.
+
+def lttb(x, y, n_out):
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return x, y
+
+    every = (n - 2) / (n_out - 2)
+    keep = np.empty(n_out, dtype=np.int64)
+    keep[0], keep[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+
+        # Twice the triangle area for every candidate in this bucket
+        area = np.abs(
+            (x[a] - avg_x) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (avg_y - y[a])
+        )
+        a = start + int(area.argmax())
+        keep[i + 1] = a
+    return x[keep], y[keep]
@@ -0,0 +1,252 @@
+import hashlib
+import os
+import pickle
+import threading
+
+import metrics
+import ndjson_codec
+from file_locks import file_lock
+
+
+# Binary snapshots for fast warm starts.
+#
+# Parsing a large NDJSON file line by line is the dominant
+# cost of a cold load. Each file gets a "<file>.snap" sidecar holding its
+# parsed records, an id index, the byte offset parsing stopped at and a
+# checksum. On load the snapshot is restored and only the NDJSON tail
+# appended after that offset is parsed. If the file was rewritten (new
+# inode, shrunk, or the bytes before the offset changed) the sidecar is
+# re-read in case another process already snapshotted the new file, and
+# otherwise the file is parsed in full. Writers that rewrite a file can hand
+# over the records they wrote with rebuild() so nobody has to reparse it.
+#
+# Loaded states are shared by every session, and their records and index are
+# never mutated once published (a catch-up builds a new state). So an
+# unchanged file is served without taking a lock, a catch-up only holds up
+# callers of the same file, and snapshots are pickled on a background
+# thread, off the request path. The records themselves are shared too:
+# callers must treat them as read-only and copy whatever they change.
+#
+# Snapshots are pickles, so they are only ever read from our own data dir.
+
+SNAPSHOT_MAGIC = b"MEDSNAP1"
+SNAPSHOT_MIN_NEW_RECORDS = 500  # re-snapshot once this many tail records have been replayed
+FINGERPRINT_BYTES = 64
+
+_loaded = {}  # path -> published in-process state, so reruns only parse new bytes
+_path_locks = {}  # path -> lock serializing catch-ups of that file
+_snapshot_writes = set()  # paths with a snapshot write in flight
+_registry_lock = threading.Lock()
+
+
+# Parsed records of an NDJSON file (shared and read-only: copy a record before changing it)
+def load_records(path):
+    return _load_state(path)["records"]
+
+
+# Look up a single record by its "id" field (shared and read-only, like load_records)
+def find_by_id(path, record_id):
+    state = _load_state(path)
+    position = state["index"].get(record_id)
+    return state["records"][position] if position is not None else None
+
+
+# Publish the records a writer just rewrote the file with, instead of leaving the
+# next reader to reparse it. Call while holding file_lock(path), right after the
+# rewrite; records must be exactly the file's records, in order.
+def rebuild(path, records):
+    records = tuple(records)
+    stat = os.stat(path)
+    state = {
+        "source": {"inode": stat.st_ino, "offset": stat.st_size, "fingerprint": _fingerprint_at(path, stat.st_size)},
+        "records": records,
+        "index": _index_of(records),
+        "snapshot_records": 0,
+    }
+    # Not under _path_lock: a loader holding it may be waiting for our file lock
+    _loaded[path] = state
+    _write_snapshot_in_background(path, state)
+
+
+def _load_state(path):
+    with metrics.ndjson_load_seconds.time(file=os.path.basename(path), loader="snapshot"):
+        state = _loaded.get(path)
+        if state is not None and _unchanged(path, state):
+            _maybe_snapshot(path, state)
+            return state
+
+        with _path_lock(path):
+            state = _loaded.get(path)
+            if state is None:
+                state = _read_snapshot(path)
+            try:
+                with file_lock(path, shared=True):
+                    state = _catch_up(path, state)
+            except FileNotFoundError:
+                state = _empty_state()
+            _loaded[path] = state
+        _maybe_snapshot(path, state)
+        return state
+
+
+# Snapshot after a full parse, or once enough tail records have piled up
+def _maybe_snapshot(path, state):
+    new_records = len(state["records"]) - state["snapshot_records"]
+    if state["source"]["offset"] and (
+        state["snapshot_records"] == 0 or new_records >= SNAPSHOT_MIN_NEW_RECORDS
+    ):
+        _write_snapshot_in_background(path, state)
+
+
+def _path_lock(path):
+    with _registry_lock:
+        lock = _path_locks.get(path)
+        if lock is None:
+            lock = _path_locks[path] = threading.Lock()
+        return lock
+
+
+def _empty_state():
+    return {
+        "source": {"inode": None, "offset": 0, "fingerprint": b""},
+        "records": (),
+        "index": {},
+        "snapshot_records": 0,
+    }
+
+
+def _index_of(records):
+    return {
+        record["id"]: position
+        for position, record in enumerate(records)
+        if isinstance(record, dict) and record.get("id")
+    }
+
+
+# Whether a published state still covers the whole file (nothing appended or rewritten)
+def _unchanged(path, state):
+    try:
+        stat = os.stat(path)
+        with open(path, "rb") as f:
+            return stat.st_size == state["source"]["offset"] and _still_valid(f, stat, state["source"])
+    except FileNotFoundError:
+        return state["source"]["inode"] is None
+
+
+# A state up to date with the file on disk, parsing only what is new. Returns the
+# given state if nothing changed, otherwise a new one (published states are never mutated).
+def _catch_up(path, state):
+    stat = os.stat(path)
+
+    with open(path, "rb") as f:
+        if not _still_valid(f, stat, state["source"]):
+            # Rewritten file: another process may already have snapshotted it
+            state = _read_snapshot(path)
+            if state["source"]["inode"] is None or not _still_valid(f, stat, state["source"]):
+                state = _empty_state()
+        source = state["source"]
+
+        if stat.st_size == source["offset"]:
+            return state
+
+        f.seek(source["offset"])
+        tail = f.read()
+
+    # Only consume complete lines; a partial trailing line waits for the next load
+    consumed = tail.rfind(b"\n") + 1
+    records, index = list(state["records"]), dict(state["index"])
+    parsed_before = len(records)
+    for line in tail[:consumed].splitlines():
+        if not line.strip():
+            continue
+        try:
+            record = ndjson_codec.loads(line)
+        except ValueError:
+            continue
+        if isinstance(record, dict) and record.get("id"):
+            index[record["id"]] = len(records)
+        records.append(record)
+    metrics.ndjson_records_parsed.inc(len(records) - parsed_before, file=os.path.basename(path), loader="snapshot")
+
+    offset = source["offset"] + consumed
+    return {
+        "source": {"inode": stat.st_ino, "offset": offset, "fingerprint": _fingerprint_at(path, offset)},
+        "records": tuple(records),
+        "index": index,
+        "snapshot_records": state["snapshot_records"],
+    }
+
+
+def _still_valid(f, stat, source):
+    if source["inode"] is None:
+        return True  # nothing parsed yet
+    if source["inode"] != stat.st_ino or stat.st_size < source["offset"]:
+        return False
+    start = max(0, source["offset"] - FINGERPRINT_BYTES)
+    f.seek(start)
+    return f.read(source["offset"] - start) == source["fingerprint"]
+
+
+def _fingerprint_at(path, offset):
+    start = max(0, offset - FINGERPRINT_BYTES)
+    with open(path, "rb") as f:
+        f.seek(start)
+        return f.read(offset - start)
+
+
+def _read_snapshot(path):
+    try:
+        with open(path + ".snap", "rb") as f:
+            blob = f.read()
+    except OSError:
+        return _empty_state()
+
+    header_len = len(SNAPSHOT_MAGIC) + 32
+    if blob[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+        print(f"⚠️ Ignoring snapshot with unknown format: {path}.snap")
+        return _empty_state()
+    payload = blob[header_len:]
+    if hashlib.sha256(payload).digest() != blob[len(SNAPSHOT_MAGIC):header_len]:
+        print(f"⚠️ Ignoring corrupt snapshot: {path}.snap")
+        return _empty_state()
+
+    try:
+        state = pickle.loads(payload)
+    except Exception as e:
+        print(f"⚠️ Failed to read snapshot {path}.snap: {e}")
+        return _empty_state()
+    state["records"] = tuple(state["records"])
+    state["snapshot_records"] = len(state["records"])
+    return state
+
+
+# At most one snapshot write per file at a time; a skipped one is retried by a later load
+def _write_snapshot_in_background(path, state):
+    with _registry_lock:
+        if path in _snapshot_writes:
+            return
+        _snapshot_writes.add(path)
+
+    def write():
+        try:
+            _write_snapshot(path, state)
+        finally:
+            with _registry_lock:
+                _snapshot_writes.discard(path)
+
+    threading.Thread(target=write, name="fhir-snapshot-writer", daemon=True).start()
+
+
+def _write_snapshot(path, state):
+    payload = pickle.dumps(
+        {"source": state["source"], "records": state["records"], "index": state["index"]},
+        protocol=pickle.HIGHEST_PROTOCOL,
+    )
+    tmp_path = f"{path}.snap.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(SNAPSHOT_MAGIC + hashlib.sha256(payload).digest() + payload)
+        os.replace(tmp_path, path + ".snap")
+        state["snapshot_records"] = len(state["records"])
+    except Exception as e:
+        print(f"❌ Failed to write snapshot for {path}: {e}")
@@ -0,0 +1,53 @@
+import os
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, fall back to unlocked access
+    fcntl = None
+
+
+# Cross-process helpers for the files under fhir_data/ and app_data/.
+#
+# Every writer holds an exclusive advisory lock on "<file>.lock" for the whole
+# read-modify-write, and bumps "<file>.version" afterwards. Cached loaders key
+# on data_version() so a write in one server process invalidates the caches
+# in all the others.
+
+@contextmanager
+def file_lock(path, shared=False):
+    if fcntl is None:
+        yield
+        return
+    with open(path + ".lock", "a") as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+# Current version of a data file (0 if it has never been written through here)
+def data_version(path):
+    try:
+        with open(path + ".version", "r") as f:
+            return int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        return 0
+
+
+# Signal other processes that the file changed. Call while holding file_lock(path).
+def bump_version(path):
+    version = data_version(path) + 1
+    write_atomic(path + ".version", str(version))
+    return version
+
+
+# Replace a file's contents so lock-free readers never see a half-written file
+def write_atomic(path, text):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
@@ -0,0 +1,287 @@
+# =================================================================================================
+# Adherence Analytics Benchmark Suite
+#
+# Times the dashboard analytics (adherence_analytics.py) and the rollup / prefix-sum
+# replacements against generated corpora at several sizes:
+#
+#   S   10 patients,   1 year        L    500 patients, 2 years
+#   M   100 patients,  1 year        XL  1000 patients, 5 years   (~8M administrations)
+#
+# Corpora are produced by generate_synthetic_corpus.py (fixed seed, ending today so the
+# analytics windows have data) and cached under synthetic_data/bench-<size>/.
+#
+# Every case runs in its own fresh process, which loads the first account's 90-day analytics
+# window the same way main.py does (date-range read, then filtered to that patient) and then
+# records:
+#   wall time     median and min per call over --repeat samples (after one warm-up run)
+#   allocations   peak bytes allocated during one run (tracemalloc)
+#   peak RSS      the process's peak resident set size, including the loaded window
+#
+# Results are written to --output as JSON. With --baseline, each case's median time and
+# allocation peak are compared with a previous results file and anything worse than
+# --tolerance is reported as a regression (exit status 1).
+#
+# Usage:
+#   python helper_scripts/benchmark_adherence.py --sizes S,M --save-baseline bench_baseline.json
+#   python helper_scripts/benchmark_adherence.py --sizes S,M --baseline bench_baseline.json --tolerance 0.25
+# =================================================================================================
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+import adherence_analytics
+import adherence_ranges
+import adherence_rollup
+import admin_events
+import admin_log_reader
+import medication_index
+import ndjson_codec
+
+SIZES = {
+    "S": {"patients": 10, "years": 1},
+    "M": {"patients": 100, "years": 1},
+    "L": {"patients": 500, "years": 2},
+    "XL": {"patients": 1000, "years": 5},
+}
+CORPUS_SEED = 6440
+ANALYTICS_WINDOW_DAYS = 90  # same window main.py loads
+MIN_SAMPLE_SECONDS = 0.05
+
+
+def corpus_paths(corpus_dir):
+    return {
+        "admin": os.path.join(corpus_dir, "medication_administration", "MedicationAdministration.ndjson"),
+        "requests": os.path.join(corpus_dir, "medication_request", "MedicationRequest.ndjson"),
+        "accounts": os.path.join(corpus_dir, "user_accounts.json"),
+    }
+
+
+# Generate (or reuse) the corpus for a size; regenerated when it no longer ends today
+def ensure_corpus(size, workers):
+    corpus_dir = os.path.join(REPO_ROOT, "synthetic_data", f"bench-{size}")
+    spec = dict(SIZES[size], seed=CORPUS_SEED, end_date=date.today().isoformat())
+    marker = os.path.join(corpus_dir, "corpus.json")
+    try:
+        with open(marker) as f:
+            if json.load(f) == spec:
+                return corpus_dir
+    except (OSError, ValueError):
+        pass
+
+    print(f"Generating {size} corpus in {corpus_dir} ...")
+    subprocess.run([
+        sys.executable, os.path.join(REPO_ROOT, "helper_scripts", "generate_synthetic_corpus.py"),
+        "--patients", str(spec["patients"]), "--years", str(spec["years"]),
+        "--meds-per-patient", "4-7", "--adherence", "0.7*beta:9,1.5", "--adherence", "0.3*beta:3,3",
+        "--seed", str(spec["seed"]), "--end-date", spec["end_date"],
+        "--workers", str(workers), "--output-dir", corpus_dir,
+        "--catalog", os.path.join(REPO_ROOT, "fhir_data", "medication_request", "MedicationRequest.ndjson"),
+    ], check=True)
+    for sidecar in (".rollup", ".dateidx", ".version", ".lock"):
+        try:
+            os.remove(corpus_paths(corpus_dir)["admin"] + sidecar)
+        except FileNotFoundError:
+            pass
+    with open(marker, "w") as f:
+        json.dump(spec, f)
+    return corpus_dir
+
+
+# The patient's 90-day window, loaded the way main.py does after login
+def load_window(paths, patient_id):
+    today = date.today()
+    return admin_log_reader.read_range(
+        paths["admin"], today - timedelta(days=ANALYTICS_WINDOW_DAYS - 1), today,
+        decode=admin_events.decode_event, patient_id=patient_id,
+    )
+
+
+# name -> builder(paths, events, patient_id, meds) returning the callable to time
+def _checklist(paths, events, patient_id, meds):
+    return lambda: [
+        adherence_analytics.was_medication_taken_today(med["RXnormCode"] or med["Medication"], events)
+        for med in meds
+    ]
+
+
+def _adherence_rates(paths, events, patient_id, meds):
+    return lambda: [
+        adherence_analytics.calculate_adherence_rate(meds, events, period=period)
+        for period in ("daily", "weekly", "monthly")
+    ]
+
+
+def _missed_doses(days):
+    def build(paths, events, patient_id, meds):
+        return lambda: adherence_analytics.calculate_missed_doses(meds, events, days=days)
+    return build
+
+
+def _weekly_summary(paths, events, patient_id, meds):
+    return lambda: adherence_analytics.generate_weekly_summary(patient_id, meds, paths["admin"])
+
+
+def _rollup_taken_today(paths, events, patient_id, meds):
+    today = date.today().toordinal()
+    return lambda: adherence_rollup.meds_taken(paths["admin"], patient_id, today)
+
+
+def _prefix_sums_build(paths, events, patient_id, meds):
+    codes = [med["RXnormCode"] or med["Medication"] for med in meds]
+    today = date.today().toordinal()
+    return lambda: adherence_ranges.build_prefix_sums(paths["admin"], patient_id, codes, today)
+
+
+def _prefix_sums_query(paths, events, patient_id, meds):
+    codes = [med["RXnormCode"] or med["Medication"] for med in meds]
+    today = date.today()
+    prefix_sums = adherence_ranges.build_prefix_sums(paths["admin"], patient_id, codes, today.toordinal())
+    start = today.replace(day=1).toordinal()
+    return lambda: (prefix_sums.totals(start, today.toordinal()), prefix_sums.by_medication(start, today.toordinal()))
+
+
+def _load_window(paths, events, patient_id, meds):
+    return lambda: load_window(paths, patient_id)
+
+
+CASES = {
+    # Scans over the AdminEvent window, as the dashboard runs them
+    "was_medication_taken_today": _checklist,
+    "calculate_adherence_rate": _adherence_rates,
+    "calculate_missed_doses[7]": _missed_doses(7),
+    "calculate_missed_doses[30]": _missed_doses(30),
+    # Replacements backed by the daily rollup
+    "generate_weekly_summary": _weekly_summary,
+    "rollup.meds_taken": _rollup_taken_today,
+    "prefix_sums.build": _prefix_sums_build,
+    "prefix_sums.month_query": _prefix_sums_query,
+    # Loading the window itself (mmap date index + field projection)
+    "load_window": _load_window,
+}
+
+
+# Child process: load the data like the app does, then measure one case
+def run_case(corpus_dir, case, repeat):
+    paths = corpus_paths(corpus_dir)
+    with open(paths["accounts"]) as f:
+        patient_id = json.load(f)[0]["patient_id"]
+    events = load_window(paths, patient_id)
+    meds, _ = medication_index.patient_medications(paths["requests"], patient_id)
+    func = CASES[case](paths, events, patient_id, meds)
+
+    # Warm-up (caches, rollup sidecar, index pages), then size the inner loop so
+    # each timed sample is long enough for sub-millisecond cases to be stable
+    start = time.perf_counter()
+    func()
+    loops = max(1, int(MIN_SAMPLE_SECONDS / max(time.perf_counter() - start, 1e-6)))
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        times.append((time.perf_counter() - start) / loops)
+
+    tracemalloc.start()
+    func()
+    _, alloc_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "window_records": len(events),
+        "active_meds": len(meds),
+        "repeat": repeat,
+        "loops": loops,
+        "wall_s_median": statistics.median(times),
+        "wall_s_min": min(times),
+        "alloc_peak_bytes": alloc_peak,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    print(f"\nComparison with baseline (tolerance {tolerance:.0%}):")
+    for size, cases in results["results"].items():
+        for case, current in cases.items():
+            previous = baseline.get("results", {}).get(size, {}).get(case)
+            if previous is None:
+                continue
+            for metric in ("wall_s_median", "alloc_peak_bytes"):
+                ratio = current[metric] / previous[metric] if previous[metric] else 1.0
+                flag = "REGRESSION" if ratio > 1 + tolerance else "ok"
+                print(f"  {size:3} {case:30} {metric:17} {ratio:6.2f}x  {flag}")
+                if flag != "ok":
+                    regressions.append((size, case, metric, ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the adherence analytics at several data sizes.")
+    parser.add_argument("--sizes", default="S,M", help=f"Comma-separated sizes from {','.join(SIZES)}")
+    parser.add_argument("--cases", default=",".join(CASES), help="Comma-separated cases to run")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per case")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Corpus generator workers")
+    parser.add_argument("--output", default="bench_results.json", help="Where to write the results JSON")
+    parser.add_argument("--baseline", help="Results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown/growth vs. baseline")
+    parser.add_argument("--save-baseline", help="Also write the results to this baseline file")
+    args = parser.parse_args()
+
+    sizes = [s.strip().upper() for s in args.sizes.split(",") if s.strip()]
+    cases = [c.strip() for c in args.cases.split(",") if c.strip()]
+    unknown = [s for s in sizes if s not in SIZES] + [c for c in cases if c not in CASES]
+    if unknown:
+        raise SystemExit(f"❌ Unknown size/case: {', '.join(unknown)}")
+
+    results = {
+        "meta": {
+            "date": date.today().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "json_backend": ndjson_codec.BACKEND,
+            "repeat": args.repeat,
+        },
+        "results": {},
+    }
+    spawn = multiprocessing.get_context("spawn")
+    for size in sizes:
+        corpus_dir = ensure_corpus(size, args.workers)
+        # Build the rollup once up front so no case pays for the initial rebuild
+        adherence_rollup.rebuild(corpus_paths(corpus_dir)["admin"])
+        results["results"][size] = {}
+        print(f"\n{size}:")
+        for case in cases:
+            with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as pool:
+                result = pool.submit(run_case, corpus_dir, case, args.repeat).result()
+            results["results"][size][case] = result
+            print(f"  {case:30} {result['wall_s_median'] * 1000:10.2f} ms"
+                  f"  {result['alloc_peak_bytes'] / 1024:10.0f} KiB alloc"
+                  f"  {result['peak_rss_mb']:8.0f} MiB RSS  ({result['window_records']} window records)")
+
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nWrote {path}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
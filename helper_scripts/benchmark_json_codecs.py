@@ -0,0 +1,96 @@
+# =================================================================================================
+# JSON Codec Micro-benchmark
+#
+# Compares every JSON backend available to ndjson_codec (stdlib, orjson, msgspec) on the
+# real FHIR record shapes in fhir_data/. For each resource file it times decoding every
+# line and re-encoding every record, and reports records/second per backend. For
+# MedicationAdministration it also checks that the msgspec typed-schema AdminEvent projection
+# (when msgspec is installed) agrees with a full parse on every line, then times both.
+#
+# Usage:
+#   python helper_scripts/benchmark_json_codecs.py [--repeat 200]
+# =================================================================================================
+
+import argparse
+import glob
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import ndjson_codec
+import admin_events
+
+parser = argparse.ArgumentParser(description="Benchmark the available JSON backends on FHIR NDJSON data.")
+parser.add_argument("--data-dir", default="fhir_data", help="Directory containing the FHIR NDJSON files")
+parser.add_argument("--repeat", type=int, default=200, help="Times to decode/encode each file")
+args = parser.parse_args()
+
+
+def time_backend(loads, dumps, lines, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        records = [loads(line) for line in lines]
+    decode_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for record in records:
+            dumps(record)
+    encode_s = time.perf_counter() - start
+    return decode_s, encode_s
+
+
+# Every AdminEvent projection importable here; the full parse is the reference
+projections = {"full": admin_events._full_parse}
+if admin_events.msgspec is not None:
+    projections["msgspec"] = admin_events._decode_typed
+
+
+# Lines on which some projection disagrees with the full parse
+def projection_mismatches(lines):
+    mismatches = []
+    for line in lines:
+        expected = admin_events._full_parse(line)
+        for name, decode in projections.items():
+            if decode(line) != expected:
+                mismatches.append((name, line))
+    return mismatches
+
+
+backends = ndjson_codec.available_backends()
+print(f"Available backends: {', '.join(backends)} (app uses: {ndjson_codec.BACKEND})\n")
+
+for path in sorted(glob.glob(os.path.join(args.data_dir, "*", "*.ndjson"))):
+    with open(path, "rb") as f:
+        lines = [line for line in f if line.strip()]
+    if not lines:
+        continue
+
+    total = len(lines) * args.repeat
+    print(f"{os.path.basename(path)}: {len(lines)} records, {sum(map(len, lines)) / len(lines):.0f} bytes avg")
+
+    results = {}
+    for name, (loads, dumps) in backends.items():
+        results[name] = time_backend(loads, dumps, lines, args.repeat)
+
+    stdlib_decode_s, stdlib_encode_s = results["stdlib"]
+    for name, (decode_s, encode_s) in results.items():
+        print(f"  {name:8} decode {total / decode_s:12,.0f} rec/s ({stdlib_decode_s / decode_s:4.1f}x)"
+              f"   encode {total / encode_s:12,.0f} rec/s ({stdlib_encode_s / encode_s:4.1f}x)")
+
+    if os.path.basename(path) == "MedicationAdministration.ndjson":
+        mismatches = projection_mismatches(lines)
+        for name, line in mismatches[:5]:
+            print(f"  ❌ {name} projection differs from a full parse: {line[:120]!r}")
+        if mismatches:
+            sys.exit(1)
+        app_projection = "full" if admin_events.decode_event is admin_events._full_parse else "msgspec"
+        print(f"  ✅ projections agree on all lines: {', '.join(projections)} (app uses: {app_projection})")
+        for name, decode in projections.items():
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                events = [decode(line) for line in lines]
+            project_s = time.perf_counter() - start
+            print(f"  {'project':8} {name:8} {total / project_s:12,.0f} rec/s ({stdlib_decode_s / project_s:4.1f}x)")
+    print()
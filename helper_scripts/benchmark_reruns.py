@@ -0,0 +1,298 @@
+# =================================================================================================
+# End-to-end Rerun Latency Benchmark
+#
+# Drives main.py headlessly through streamlit.testing.v1.AppTest, the way a patient uses it:
+#
+#   login          type credentials, press Login (includes the post-login rerun)
+#   tick / untick  check and uncheck the first checklist item (a durable write and a delete)
+#   analytics:*    switch between the Home analytics sections
+#   history        open the History tab
+#   filter:*       switch the History medication filter
+#   medications    open the Medications tab
+#
+# and reports per-interaction latency percentiles for each corpus size (the same seeded
+# corpora as benchmark_adherence.py). Each size runs in a scratch copy of the data under
+# synthetic_data/bench-<size>/workspace/, so ticks never touch the cached corpus. The
+# script thread of one extra session runs under cProfile; the top functions by cumulative
+# time are printed, stored in the results JSON and the raw profile is written to --profile-dir.
+#
+# Usage:
+#   python helper_scripts/benchmark_reruns.py --sizes S,M --sessions 5 --output rerun_results.json
+# =================================================================================================
+
+import argparse
+import cProfile
+import json
+import math
+import os
+import pstats
+import shutil
+import sys
+import threading
+import time
+from datetime import date
+
+HELPER_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(HELPER_DIR)
+sys.path.insert(0, HELPER_DIR)
+sys.path.insert(0, REPO_ROOT)
+from benchmark_adherence import SIZES, corpus_paths, ensure_corpus
+from streamlit import config
+from streamlit.testing.v1 import AppTest
+
+# AppTest recompiles the script on every run, and the magic AST rewrite dominates that;
+# a server compiles once. main.py has no bare expressions, so magic changes nothing.
+config.set_option("runner.magicEnabled", False)
+
+MAIN_SCRIPT = os.path.join(REPO_ROOT, "main.py")
+CORPUS_DIRS = {"medication_administration", "medication_request", "patient"}
+HOME_TAB = "\U0001F3E0 📊Home"
+MEDICATIONS_TAB = "\U0001F48A Medications"
+HISTORY_TAB = "📈 History"
+ANALYTICS_SECTIONS = ["Medication Adherence", "Adherence Patterns", "Custom Range", "Timeline"]
+HISTORY_FILTER_LABEL = "Select a medication to view missed days:"
+MAX_FILTERS = 3
+
+
+# Lay out a corpus the way main.py expects to find its files (relative to the cwd).
+# The corpus logs are copied because the checklist writes to them; the remaining
+# reference data is symlinked from the repo.
+def prepare_workspace(corpus_dir):
+    workspace = os.path.join(corpus_dir, "workspace")
+    shutil.rmtree(workspace, ignore_errors=True)
+    os.makedirs(os.path.join(workspace, "fhir_data"))
+    os.makedirs(os.path.join(workspace, "app_data"))
+
+    for name in os.listdir(os.path.join(REPO_ROOT, "fhir_data")):
+        target = os.path.join(workspace, "fhir_data", name)
+        if name in CORPUS_DIRS:
+            os.makedirs(target)
+            for filename in os.listdir(os.path.join(corpus_dir, name)):
+                if filename.endswith(".ndjson"):
+                    shutil.copyfile(os.path.join(corpus_dir, name, filename), os.path.join(target, filename))
+        else:
+            os.symlink(os.path.join(REPO_ROOT, "fhir_data", name), target)
+
+    shutil.copyfile(corpus_paths(corpus_dir)["accounts"], os.path.join(workspace, "app_data", "user_accounts.json"))
+    shutil.copyfile(
+        os.path.join(REPO_ROOT, "app_data", "medication_notes.json"),
+        os.path.join(workspace, "app_data", "medication_notes.json"),
+    )
+    return workspace
+
+
+def load_accounts(workspace):
+    with open(os.path.join(workspace, "app_data", "user_accounts.json")) as f:
+        return json.load(f)
+
+
+# Nearest-rank percentile
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def summarize(latencies):
+    return {
+        "n": len(latencies),
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p90_ms": percentile(latencies, 90) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": max(latencies) * 1000,
+    }
+
+
+# One simulated browser session. step() times a single rerun and records
+# whether it raised or rendered an exception element.
+class Session:
+    def __init__(self, timeout):
+        self.app = AppTest.from_file(MAIN_SCRIPT, default_timeout=timeout)
+        self.timings = []  # (interaction, seconds, ok)
+
+    def step(self, name, interact=None):
+        start = time.perf_counter()
+        try:
+            if interact is None:
+                self.app.run()
+            else:
+                interact(self.app).run()
+            ok = not self.app.exception
+        except Exception as e:
+            print(f"❌ {name}: {e}")
+            ok = False
+        self.timings.append((name, time.perf_counter() - start, ok))
+        return ok
+
+    def login(self, username, password):
+        self.step("load_login_page")
+        self.app.text_input[0].input(username)
+        self.app.text_input[1].input(password)
+        if not self.step("login", lambda app: app.button[0].click()):
+            return False
+        return "logged_in" in self.app.session_state and self.app.session_state["logged_in"]
+
+    def checkbox(self, key):
+        matches = [box for box in self.app.checkbox if box.key == key]
+        return matches[0] if matches else None
+
+    def select_tab(self, name, key, label):
+        return self.step(name, lambda app: app.radio(key=key).set_value(label))
+
+    def history_filter(self):
+        matches = [box for box in self.app.selectbox if box.label == HISTORY_FILTER_LABEL]
+        return matches[0] if matches else None
+
+
+# login, tick/untick, analytics sections, history filters, medications tab
+def patient_flow(session, username, password):
+    if not session.login(username, password):
+        return
+
+    box = session.checkbox("med_checkbox_0")
+    if box is not None:
+        # Already taken today in the corpus: untick first so both writes are measured
+        order = ["untick", "tick"] if box.value else ["tick", "untick"]
+        for name in order:
+            session.step(name, lambda app: session.checkbox("med_checkbox_0").set_value(name == "tick"))
+
+    for section in ANALYTICS_SECTIONS[1:] + ANALYTICS_SECTIONS[:1]:
+        session.select_tab(f"analytics:{section}", "analytics_section", section)
+
+    session.select_tab("history", "active_tab", HISTORY_TAB)
+    selectbox = session.history_filter()
+    if selectbox is not None:
+        for option in list(selectbox.options)[1:MAX_FILTERS + 1] + ["All"]:
+            session.step(f"filter:{'All' if option == 'All' else 'med'}",
+                         lambda app: session.history_filter().set_value(option))
+
+    session.select_tab("medications", "active_tab", MEDICATIONS_TAB)
+    session.select_tab("home", "active_tab", HOME_TAB)
+
+
+# AppTest runs main.py on its own script thread, so a profiler enabled on this thread
+# would only see it waiting. This installs a cProfile profiler in every thread started
+# while it is active and merges them afterwards.
+class ThreadProfiler:
+    def __init__(self):
+        self.profilers = []
+
+    def __enter__(self):
+        threading.setprofile(self._start)
+        return self
+
+    def __exit__(self, *exc):
+        threading.setprofile(None)
+
+    def _start(self, *_):
+        sys.setprofile(None)
+        profiler = cProfile.Profile()
+        self.profilers.append(profiler)
+        profiler.enable()
+
+    # Combined stats of every profiled thread (None if no thread was profiled)
+    def stats(self):
+        stats = None
+        for profiler in self.profilers:
+            profiler.disable()
+            stats = pstats.Stats(profiler) if stats is None else stats.add(profiler)
+        return stats
+
+
+def profile_top(stats, limit):
+    rows = []
+    for (filename, line, func), (_, ncalls, tottime, cumtime, _) in stats.stats.items():
+        rows.append({
+            "function": f"{os.path.relpath(filename, REPO_ROOT) if filename.startswith(REPO_ROOT) else filename}:{line}({func})",
+            "ncalls": ncalls,
+            "tottime_s": tottime,
+            "cumtime_s": cumtime,
+        })
+    rows.sort(key=lambda row: row["cumtime_s"], reverse=True)
+    return rows[:limit]
+
+
+def run_size(size, args):
+    corpus_dir = ensure_corpus(size, args.workers)
+    workspace = prepare_workspace(corpus_dir)
+    accounts = load_accounts(workspace)
+    os.chdir(workspace)
+
+    # Warm-up sessions fill the process-wide caches (indexes, rollup, snapshots) like a
+    # long-running server would have; they are not measured.
+    for i in range(args.warmup):
+        patient_flow(Session(args.timeout), accounts[i % len(accounts)]["username"], accounts[i % len(accounts)]["password"])
+
+    sessions = []
+    for i in range(args.sessions):
+        account = accounts[(args.warmup + i) % len(accounts)]
+        session = Session(args.timeout)
+        patient_flow(session, account["username"], account["password"])
+        sessions.append(session)
+
+    # Profiled separately so the profiler's overhead doesn't inflate the latencies
+    account = accounts[(args.warmup + args.sessions) % len(accounts)]
+    with ThreadProfiler() as profiler:
+        patient_flow(Session(args.timeout), account["username"], account["password"])
+    os.chdir(REPO_ROOT)
+    stats = profiler.stats()
+
+    latencies, errors = {}, {}
+    for session in sessions:
+        for name, seconds, ok in session.timings:
+            latencies.setdefault(name, []).append(seconds)
+            errors[name] = errors.get(name, 0) + (not ok)
+
+    if stats is None:
+        print("  ⚠️ No script thread was profiled; skipping the profile")
+    elif args.profile_dir:
+        os.makedirs(args.profile_dir, exist_ok=True)
+        stats.dump_stats(os.path.join(args.profile_dir, f"reruns-{size}.prof"))
+    return {
+        "sessions": args.sessions,
+        "interactions": {
+            name: dict(summarize(values), errors=errors[name]) for name, values in latencies.items()
+        },
+        "profile_top": profile_top(stats, args.top) if stats is not None else [],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark full main.py reruns through Streamlit's AppTest.")
+    parser.add_argument("--sizes", default="S,M", help=f"Comma-separated sizes from {','.join(SIZES)}")
+    parser.add_argument("--sessions", type=int, default=5, help="Measured sessions per size")
+    parser.add_argument("--warmup", type=int, default=1, help="Unmeasured sessions run first per size")
+    parser.add_argument("--timeout", type=float, default=120, help="Seconds allowed per rerun")
+    parser.add_argument("--top", type=int, default=25, help="Profiled functions to report")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Corpus generator workers")
+    parser.add_argument("--output", default="rerun_results.json", help="Where to write the results JSON")
+    parser.add_argument("--profile-dir", default="rerun_profiles", help="Where to write cProfile stats ('' to skip)")
+    args = parser.parse_args()
+
+    sizes = [s.strip().upper() for s in args.sizes.split(",") if s.strip()]
+    unknown = [s for s in sizes if s not in SIZES]
+    if unknown:
+        raise SystemExit(f"❌ Unknown size: {', '.join(unknown)}")
+    args.output = os.path.abspath(args.output)
+    args.profile_dir = os.path.abspath(args.profile_dir) if args.profile_dir else ""
+
+    results = {"meta": {"date": date.today().isoformat(), "sessions": args.sessions}, "results": {}}
+    for size in sizes:
+        print(f"\n{size}: {args.warmup} warm-up + {args.sessions} measured sessions")
+        result = results["results"][size] = run_size(size, args)
+        print(f"  {'interaction':32} {'n':>4} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}  errors")
+        for name, row in result["interactions"].items():
+            print(f"  {name:32} {row['n']:4} {row['p50_ms']:8.0f}ms {row['p95_ms']:8.0f}ms "
+                  f"{row['p99_ms']:8.0f}ms {row['max_ms']:8.0f}ms  {row['errors']}")
+        if result["profile_top"]:
+            print("\n  Top functions by cumulative time:")
+        for row in result["profile_top"]:
+            print(f"  {row['cumtime_s']:9.3f}s cum {row['tottime_s']:9.3f}s own {row['ncalls']:9}  {row['function']}")
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nWrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -29,13 +29,17 @@
 
 # Display statistics about created records, duplicates skipped, and file information
 
-import json
 import uuid
 from datetime import datetime, timedelta, date
 import random
 import os
+import sys
 import argparse
 
+# Share the app's JSON codec (orjson/msgspec when installed)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import ndjson_codec
+
 # Setup command line arguments
 parser = argparse.ArgumentParser(description='Generate medication administration records for specific time periods.')
 group = parser.add_mutually_exclusive_group()
@@ -235,7 +239,7 @@ def load_existing_records():
             with open(med_admin_path, 'r') as f:
                 for line in f:
                     if line.strip():
-                        record = json.loads(line)
+                        record = ndjson_codec.loads(line)
                         existing_records.append(record)
                         
                         # Extract medication code
@@ -458,7 +462,7 @@ print(f"{action} file: {med_admin_path}")
 try:
     with open(med_admin_path, mode) as f:
         for record in all_records:
-            f.write(json.dumps(record) + "\n")
+            f.write(ndjson_codec.dumps_line(record))
     
     print(f"Successfully wrote {len(all_records)} medication administration records")
     print(f"- {len(new_records)} new records")
@@ -0,0 +1,335 @@
+# =================================================================================================
+# Synthetic Multi-Patient Corpus Generator
+#
+# Generates a reproducible, arbitrarily large data set for benchmarking:
+#   <output-dir>/patient/Patient.ndjson
+#   <output-dir>/medication_request/MedicationRequest.ndjson
+#   <output-dir>/medication_administration/MedicationAdministration.ndjson   (sorted by time)
+#   <output-dir>/user_accounts.json
+#
+# Each patient gets a regimen drawn from the medication catalog (the distinct medications in
+# the demo MedicationRequest file) and a per-medication daily adherence probability drawn
+# from the --adherence distribution. Taken days and dose times are vectorized NumPy draws.
+#
+# Patients are split into chunks generated by worker processes; every chunk has its own
+# seed spawned from --seed, so the output depends only on the arguments, not on --workers.
+# Each worker streams its chunk to a time-sorted temp file and the chunks are k-way merged
+# into the final log, so memory stays flat no matter how many records are generated.
+#
+# The demo-patient generator (generate_med_admin_data.py) is unchanged.
+#
+# Usage (roughly 10M administrations):
+#   python helper_scripts/generate_synthetic_corpus.py --patients 1000 --years 5 \
+#       --meds-per-patient 4-7 --adherence "0.7*beta:9,1.5" --adherence "0.3*beta:3,3" \
+#       --seed 42 --end-date 2025-01-01
+# =================================================================================================
+
+import argparse
+import heapq
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import ndjson_codec
+
+RXNORM_SYSTEM = "http://www.nlm.nih.gov/research/umls/rxnorm"
+FIRST_NAMES = ["Alex", "Maria", "James", "Priya", "Chen", "Fatima", "Noah", "Olivia", "Mateo", "Aisha",
+               "Liam", "Sofia", "Ethan", "Yuki", "Lucas", "Amara", "Daniel", "Elena", "Omar", "Grace"]
+LAST_NAMES = ["Smith", "Garcia", "Nguyen", "Patel", "Kim", "Johnson", "Brown", "Lopez", "Chen", "Okafor",
+              "Miller", "Davis", "Martinez", "Wilson", "Anderson", "Taylor", "Thomas", "Moore", "Lee", "Clark"]
+DOSE_HOURS = [8, 12, 18, 21]  # usual time of day a medication is taken
+DOSE_TIME_SD = 45 * 60        # seconds of jitter around it
+MAX_CHUNKS = 256              # upper bound on temp files merged at the end
+SELF_ADMINISTERED = [{
+    "coding": [{
+        "system": "http://terminology.hl7.org/CodeSystem/reason-medication-given",
+        "code": "b",
+        "display": "Given as Ordered"
+    }],
+    "text": "Self-administered medication"
+}]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate a seeded multi-patient medication corpus.")
+    parser.add_argument("--patients", type=int, default=100, help="Number of patients")
+    parser.add_argument("--years", type=float, default=1, help="Years of history per patient")
+    parser.add_argument("--meds-per-patient", default="3-6",
+                        help="Medications per patient, a number or an inclusive MIN-MAX range")
+    parser.add_argument("--adherence", action="append",
+                        help="Daily adherence distribution, [WEIGHT*]beta:A,B | uniform:LO,HI | fixed:P. "
+                             "Repeat to mix patient cohorts (default: beta:8,2)")
+    parser.add_argument("--med-jitter", type=float, default=0.05,
+                        help="Std. dev. of per-medication adherence around the patient's level")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed")
+    parser.add_argument("--end-date", default=date.today().isoformat(),
+                        help="Last day of history, YYYY-MM-DD (fix it for reproducible corpora)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Worker processes")
+    parser.add_argument("--catalog", default="fhir_data/medication_request/MedicationRequest.ndjson",
+                        help="MedicationRequest NDJSON to draw the medication catalog from")
+    parser.add_argument("--output-dir", default="synthetic_data", help="Directory to write the corpus to")
+    return parser.parse_args()
+
+
+# "3-6" -> (3, 6), "4" -> (4, 4)
+def parse_range(text):
+    low, _, high = text.partition("-")
+    return int(low), int(high or low)
+
+
+# ["0.7*beta:9,1.5", "0.3*uniform:0.2,0.6"] -> ([weights], [(kind, params)])
+def parse_adherence(specs):
+    weights, cohorts = [], []
+    for spec in specs or ["beta:8,2"]:
+        weight, _, dist = spec.rpartition("*")
+        kind, _, params = dist.partition(":")
+        params = [float(p) for p in params.split(",") if p]
+        expected = {"beta": 2, "uniform": 2, "fixed": 1}.get(kind)
+        if expected is None or len(params) != expected:
+            raise SystemExit(f"❌ Invalid adherence distribution: {spec}")
+        weights.append(float(weight) if weight else 1.0)
+        cohorts.append((kind, params))
+    weights = np.array(weights) / sum(weights)
+    return weights, cohorts
+
+
+def draw_adherence(rng, kind, params, size):
+    if kind == "beta":
+        return rng.beta(params[0], params[1], size)
+    if kind == "uniform":
+        return rng.uniform(params[0], params[1], size)
+    return np.full(size, params[0])
+
+
+# Distinct medications (by RxNorm code) of the catalog file, with their request details
+def load_catalog(path):
+    catalog = {}
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = ndjson_codec.loads(line)
+            concept = entry.get("medicationCodeableConcept", {})
+            coding = next((c for c in concept.get("coding", []) if c.get("system") == RXNORM_SYSTEM), None)
+            if coding is None or coding.get("code") in catalog:
+                continue
+            catalog[coding["code"]] = {
+                "medicationCodeableConcept": {"coding": [coding], "text": concept.get("text", coding.get("display"))},
+                "requester": entry.get("requester", {"display": "Unknown Prescriber"}),
+                "reasonCode": entry.get("reasonCode"),
+                "dosageInstruction": entry.get("dosageInstruction", [{"text": "Take as directed."}]),
+            }
+    return list(catalog.values())
+
+
+def new_uuid(rng):
+    return str(uuid.UUID(bytes=rng.bytes(16), version=4))
+
+
+# Patient-level draws: identity, regimen and adherence level per medication
+def plan_patients(args, rng, catalog):
+    low, high = parse_range(args.meds_per_patient)
+    high = min(high, len(catalog))
+    low = min(low, high)
+    weights, cohorts = parse_adherence(args.adherence)
+
+    n = args.patients
+    cohort_of = rng.choice(len(cohorts), size=n, p=weights)
+    base = np.empty(n)
+    for c, (kind, params) in enumerate(cohorts):
+        members = cohort_of == c
+        base[members] = draw_adherence(rng, kind, params, int(members.sum()))
+    med_counts = rng.integers(low, high + 1, size=n)
+
+    patients = []
+    for i in range(n):
+        regimen = rng.choice(len(catalog), size=med_counts[i], replace=False)
+        adherence = np.clip(base[i] + rng.normal(0, args.med_jitter, len(regimen)), 0, 1)
+        patients.append({
+            "id": new_uuid(rng),
+            "first_name": FIRST_NAMES[rng.integers(len(FIRST_NAMES))],
+            "last_name": LAST_NAMES[rng.integers(len(LAST_NAMES))],
+            "gender": "female" if rng.random() < 0.5 else "male",
+            "birth_date": (date(1940, 1, 1) + timedelta(days=int(rng.integers(0, 365 * 60)))).isoformat(),
+            "meds": [
+                {
+                    "catalog": int(m),
+                    "adherence": float(p),
+                    "hour": DOSE_HOURS[rng.integers(len(DOSE_HOURS))],
+                    "request_id": new_uuid(rng),
+                    "encounter_id": new_uuid(rng),
+                }
+                for m, p in zip(regimen, adherence)
+            ],
+        })
+    return patients
+
+
+# Worker: draw one chunk of patients' administrations and stream them, time-sorted, to tmp_path.
+# Each line is prefixed with a fixed-width sort key so chunks can be merged as plain text.
+def generate_chunk(task):
+    seed, patients, catalog, first_day, n_days, tmp_path = task
+    rng = np.random.default_rng(seed)
+    day_strings = [date.fromordinal(first_day + d).isoformat() for d in range(n_days)]
+
+    # One line template per (patient, medication) slot
+    slot_templates, keys, slots = [], [], []
+    for patient in patients:
+        meds = patient["meds"]
+        taken = rng.random((len(meds), n_days)) < np.array([m["adherence"] for m in meds])[:, None]
+        med_idx, day_idx = np.nonzero(taken)
+        hours = np.array([m["hour"] for m in meds])[med_idx]
+        seconds = np.clip(rng.normal(hours * 3600, DOSE_TIME_SD), 0, 86399).astype(np.int64)
+        keys.append(day_idx.astype(np.int64) * 86400 + seconds)
+        slots.append(med_idx + len(slot_templates))
+
+        for med in meds:
+            item = catalog[med["catalog"]]
+            head = (
+                '", "status": "completed", "medicationCodeableConcept": '
+                + json.dumps(item["medicationCodeableConcept"])
+                + ', "subject": ' + json.dumps({"reference": f"Patient/{patient['id']}"})
+                + ', "context": ' + json.dumps({"reference": f"Encounter/{med['encounter_id']}"})
+                + ', "effectiveDateTime": "'
+            )
+            tail = '", "reasonCode": ' + json.dumps(SELF_ADMINISTERED) + ', "performer": [{"actor": {"display": "Patient"}}]}\n'
+            slot_templates.append((head, tail))
+
+    keys = np.concatenate(keys) if keys else np.empty(0, dtype=np.int64)
+    slots = np.concatenate(slots) if slots else np.empty(0, dtype=np.int64)
+    order = np.argsort(keys, kind="stable")
+    ids = rng.bytes(16 * len(order))
+
+    with open(tmp_path, "w", buffering=1 << 20) as f:
+        for n, i in enumerate(order.tolist()):
+            key = int(keys[i])
+            day, second = divmod(key, 86400)
+            hour, second = divmod(second, 3600)
+            minute, second = divmod(second, 60)
+            head, tail = slot_templates[slots[i]]
+            record_id = str(uuid.UUID(bytes=ids[16 * n:16 * n + 16], version=4))
+            f.write(f'{key:012d}\t{{"resourceType": "MedicationAdministration", "id": "{record_id}'
+                    f'{head}{day_strings[day]}T{hour:02d}:{minute:02d}:{second:02d}{tail}')
+    return len(order)
+
+
+def patient_resource(patient):
+    return {
+        "resourceType": "Patient",
+        "id": patient["id"],
+        "name": [{"use": "official", "family": patient["last_name"], "given": [patient["first_name"]]}],
+        "gender": patient["gender"],
+        "birthDate": patient["birth_date"],
+        "telecom": [{"system": "email", "value": f"{patient['id'][:8]}@example.com"}],
+        "address": [{"line": ["1 Main St"], "city": "Boston", "state": "Massachusetts", "country": "US"}],
+    }
+
+
+def request_resource(patient, med, catalog, authored_on):
+    item = catalog[med["catalog"]]
+    resource = {
+        "resourceType": "MedicationRequest",
+        "id": med["request_id"],
+        "status": "active",
+        "intent": "order",
+        "medicationCodeableConcept": item["medicationCodeableConcept"],
+        "subject": {"reference": f"Patient/{patient['id']}"},
+        "encounter": {"reference": f"Encounter/{med['encounter_id']}"},
+        "authoredOn": authored_on,
+        "requester": item["requester"],
+        "dosageInstruction": item["dosageInstruction"],
+    }
+    if item["reasonCode"]:
+        resource["reasonCode"] = item["reasonCode"]
+    return resource
+
+
+def write_ndjson(path, records):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        for record in records:
+            f.write(ndjson_codec.dumps_line(record))
+
+
+def main():
+    args = parse_args()
+    started = time.perf_counter()
+
+    catalog = load_catalog(args.catalog)
+    if not catalog:
+        raise SystemExit(f"❌ No RxNorm medications found in {args.catalog}")
+
+    end_day = date.fromisoformat(args.end_date).toordinal()
+    n_days = max(1, int(round(args.years * 365.25)))
+    first_day = end_day - n_days + 1
+
+    root_seed = np.random.SeedSequence(args.seed)
+    plan_seed, chunks_seed = root_seed.spawn(2)
+    patients = plan_patients(args, np.random.default_rng(plan_seed), catalog)
+
+    # Patients, prescriptions and app logins
+    authored_on = date.fromordinal(first_day).isoformat()
+    write_ndjson(os.path.join(args.output_dir, "patient", "Patient.ndjson"),
+                 (patient_resource(p) for p in patients))
+    write_ndjson(os.path.join(args.output_dir, "medication_request", "MedicationRequest.ndjson"),
+                 (request_resource(p, m, catalog, authored_on) for p in patients for m in p["meds"]))
+    accounts = [
+        {
+            "username": f"patient{i:06d}",
+            "password": "password",
+            "first_name": p["first_name"],
+            "last_name": p["last_name"],
+            "patient_id": p["id"],
+            "email": f"patient{i:06d}@example.com",
+            "birth_date": p["birth_date"],
+            "gender": p["gender"].capitalize(),
+        }
+        for i, p in enumerate(patients)
+    ]
+    with open(os.path.join(args.output_dir, "user_accounts.json"), "w") as f:
+        f.write("[\n" + ",\n".join(ndjson_codec.dumps(a) for a in accounts) + "\n]\n")
+
+    # Administrations: chunks in parallel, each sorted, then merged into one time-ordered log
+    # (the chunking must not depend on --workers, or the seeds and the output would)
+    n_chunks = min(len(patients), MAX_CHUNKS) or 1
+    bounds = np.linspace(0, len(patients), n_chunks + 1).astype(int)
+    tmp_dir = tempfile.mkdtemp(prefix="corpus-", dir=args.output_dir)
+    tasks = [
+        (seed, patients[lo:hi], catalog, first_day, n_days, os.path.join(tmp_dir, f"chunk{c:04d}.tsv"))
+        for c, (seed, lo, hi) in enumerate(zip(chunks_seed.spawn(n_chunks), bounds[:-1], bounds[1:]))
+    ]
+    try:
+        with ProcessPoolExecutor(max_workers=max(1, args.workers)) as pool:
+            total = sum(pool.map(generate_chunk, tasks))
+
+        admin_path = os.path.join(args.output_dir, "medication_administration", "MedicationAdministration.ndjson")
+        os.makedirs(os.path.dirname(admin_path), exist_ok=True)
+        chunk_files = [open(task[-1], "r", buffering=1 << 20) for task in tasks]
+        try:
+            with open(admin_path, "w", buffering=1 << 20) as out:
+                for line in heapq.merge(*chunk_files):
+                    out.write(line[13:])  # drop the "<sort key>\t" prefix
+        finally:
+            for f in chunk_files:
+                f.close()
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    elapsed = time.perf_counter() - started
+    print(f"✅ Wrote corpus to {args.output_dir} in {elapsed:.1f}s")
+    print(f"- {len(patients)} patients, {sum(len(p['meds']) for p in patients)} medication requests")
+    print(f"- {total} administrations over {n_days} days "
+          f"({date.fromordinal(first_day)} .. {date.fromordinal(end_day)}), {total / elapsed:,.0f} rec/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+# =================================================================================================
+# LLM Ledger Report
+#
+# Summarizes the OpenAI call ledger written by llm_client.py: latency percentiles per model,
+# estimated spend per day and model, and outcomes (including retries) per call site.
+#
+# Usage:
+#   python helper_scripts/llm_ledger_report.py [--ledger app_data/llm_ledger.sqlite] [--days 30] [--json]
+# =================================================================================================
+
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import llm_client
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize the OpenAI call ledger.")
+    parser.add_argument("--ledger", default=llm_client.LEDGER_PATH, help="Ledger SQLite file")
+    parser.add_argument("--days", type=int, default=30, help="How many days back to include")
+    parser.add_argument("--json", action="store_true", help="Print the summaries as JSON")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.ledger):
+        print(f"❌ Ledger not found: {args.ledger}")
+        sys.exit(1)
+
+    latency = llm_client.latency_by_model(args.days, args.ledger)
+    spend = llm_client.daily_spend(args.days, args.ledger)
+    outcomes = llm_client.outcomes(args.days, args.ledger)
+
+    if args.json:
+        print(json.dumps({
+            "latency_by_model": latency,
+            "daily_spend": [
+                dict(zip(("day", "model", "calls", "prompt_tokens", "completion_tokens", "cost_usd"), row))
+                for row in spend
+            ],
+            "outcomes": [dict(zip(("call", "model", "outcome", "calls", "retries"), row)) for row in outcomes],
+        }, indent=2))
+        return
+
+    print(f"Latency of successful calls, last {args.days} days:")
+    print(f"  {'model':20} {'calls':>7} {'p50':>9} {'p95':>9} {'max':>9}")
+    for model, row in latency.items():
+        print(f"  {model:20} {row['calls']:7} {row['p50_ms']:8.0f}ms {row['p95_ms']:8.0f}ms {row['max_ms']:8.0f}ms")
+
+    print("\nDaily spend (estimated):")
+    print(f"  {'day':10} {'model':20} {'calls':>7} {'prompt tok':>11} {'compl. tok':>11} {'USD':>9}")
+    for day, model, calls, prompt_tokens, completion_tokens, cost in spend:
+        print(f"  {day:10} {model:20} {calls:7} {prompt_tokens:11} {completion_tokens:11} {cost:9.4f}")
+    print(f"  {'total':31} {sum(row[2] for row in spend):7} {'':23} {sum(row[5] for row in spend):9.4f}")
+
+    print("\nOutcomes:")
+    print(f"  {'call':22} {'model':20} {'outcome':24} {'calls':>7} {'retries':>8}")
+    for call, model, outcome, calls, retries in outcomes:
+        print(f"  {call:22} {model:20} {outcome:24} {calls:7} {retries:8}")
+
+
+if __name__ == "__main__":
+    main()
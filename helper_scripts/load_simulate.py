@@ -0,0 +1,429 @@
+# =================================================================================================
+# Concurrent-session Load Simulator
+#
+# Starts main.py under a real local Streamlit server (on a scratch copy of a benchmark corpus)
+# and runs N simulated patients against it at once. Each user is a thread speaking the
+# browser's websocket protocol: it sends rerun requests with widget states, reads the
+# rendered page back with AppTest's element-tree parser and times each rerun until the
+# server reports the script finished. Checklist clicks are sent as fragment reruns, like
+# the browser does. Users pick flows at random until --duration runs out:
+#
+#   check     log in, tick and/or untick the first checklist item
+#   history   log in, open History, switch the medication filter
+#   browse    log in, walk the analytics sections and tabs
+#
+# At the end it reports throughput (reruns/s), p50/p95/p99 latency and error rates per
+# interaction and the server's peak RSS, then checks the data files the sessions wrote:
+#
+#   - every line of MedicationAdministration.ndjson is complete JSON, ids are unique and
+#     every tombstone deletes a record logged before it, once
+#   - for users that had an account to themselves, today's record for their first
+#     medication exists exactly when their last successful checklist action was a tick
+#   - the daily adherence rollup agrees with a scan of the log for today
+#   - user_accounts.json still parses
+#
+# The exit status is 1 if any integrity check fails.
+#
+# Usage:
+#   python helper_scripts/load_simulate.py --size S --users 8 --duration 60
+#   python helper_scripts/load_simulate.py --size M --users 16 --shared-accounts 4   # contention on shared patients
+# =================================================================================================
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from contextlib import ExitStack
+from datetime import date
+
+HELPER_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(HELPER_DIR)
+sys.path.insert(0, HELPER_DIR)
+sys.path.insert(0, REPO_ROOT)
+import adherence_rollup
+import admin_events
+import medication_index
+from benchmark_adherence import SIZES, ensure_corpus
+from benchmark_reruns import (
+    ANALYTICS_SECTIONS, HISTORY_FILTER_LABEL, HISTORY_TAB, HOME_TAB, MAIN_SCRIPT, MAX_FILTERS, MEDICATIONS_TAB,
+    load_accounts, prepare_workspace, summarize,
+)
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState, WidgetStates
+from streamlit.testing.v1.element_tree import parse_tree_from_messages
+from websockets.sync.client import connect
+
+ADMIN_PATH = os.path.join("fhir_data", "medication_administration", "MedicationAdministration.ndjson")
+REQUEST_PATH = os.path.join("fhir_data", "medication_request", "MedicationRequest.ndjson")
+ACCOUNTS_PATH = os.path.join("app_data", "user_accounts.json")
+FLOW_WEIGHTS = {"check": 0.5, "history": 0.3, "browse": 0.2}
+SERVER_START_TIMEOUT = 60
+TRIGGER_VALUES = {"trigger_value", "string_trigger_value", "chat_input_value"}
+
+
+# One browser tab connected to the server. step() sends a rerun (after changing one
+# widget on the current page, if given) and times it until the script finishes.
+class ServerSession:
+    def __init__(self, url, timeout):
+        self.url = url
+        self.timeout = timeout
+        self.query_string = ""
+        self.deltas = []
+        self.widget_states = {}  # widget id -> WidgetState this tab holds, like the browser
+        self.fragments = {}  # widget id -> id of the fragment it was rendered in
+        self.tree = None
+        self.timings = []  # (interaction, seconds, ok)
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        self.ws = self._stack.enter_context(
+            connect(self.url, subprotocols=["streamlit"], max_size=None, open_timeout=self.timeout)
+        )
+        return self
+
+    def __exit__(self, *exc):
+        self._stack.close()
+
+    # change(tree) returns WidgetStates for the widgets the user changed on the current
+    # page; None just reruns
+    def step(self, name, change=None):
+        start = time.perf_counter()
+        try:
+            msg = BackMsg()
+            msg.rerun_script.query_string = self.query_string
+            if change is not None:
+                for state in change(self.tree):
+                    self.widget_states[state.id] = state
+                    msg.rerun_script.fragment_id = self.fragments.get(state.id, "")
+            msg.rerun_script.widget_states.CopyFrom(WidgetStates(widgets=self.widget_states.values()))
+            self.ws.send(msg.SerializeToString())
+            # Button clicks and other triggers are only sent once
+            for widget_id, state in list(self.widget_states.items()):
+                if state.WhichOneof("value") in TRIGGER_VALUES:
+                    del self.widget_states[widget_id]
+            ok = self._receive_run()
+        except Exception as e:
+            print(f"❌ {name}: {e!r}")
+            ok = False
+        self.timings.append((name, time.perf_counter() - start, ok))
+        return ok
+
+    def _receive_run(self):
+        deltas = []
+        while True:
+            msg = ForwardMsg()
+            msg.ParseFromString(self.ws.recv(timeout=self.timeout))
+            kind = msg.WhichOneof("type")
+            if kind == "delta":
+                deltas.append(msg)
+                widget_id = _widget_id(msg.delta)
+                if widget_id and msg.delta.fragment_id:
+                    self.fragments[widget_id] = msg.delta.fragment_id
+            elif kind == "page_info_changed":
+                self.query_string = msg.page_info_changed.query_string
+            elif kind == "script_finished":
+                if msg.script_finished == ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                    deltas = []  # st.rerun(): the next run replaces the page
+                    continue
+                break
+
+        # A fragment run only re-sends the fragment's own elements
+        if msg.script_finished == ForwardMsg.FINISHED_FRAGMENT_RUN_SUCCESSFULLY:
+            self.deltas = self.deltas + deltas
+        else:
+            self.deltas = deltas
+        self.tree = parse_tree_from_messages(self.deltas)
+
+        # Forget widgets that are no longer on the page
+        on_page = {_widget_id(msg.delta) for msg in self.deltas}
+        self.widget_states = {k: v for k, v in self.widget_states.items() if k in on_page}
+        return msg.script_finished != ForwardMsg.FINISHED_WITH_COMPILE_ERROR and not self.tree.exception
+
+    def login(self, username, password):
+        if not self.step("load_login_page"):
+            return False
+
+        def submit(tree):
+            login_button = next(button for button in tree.button if button.label == "Login")
+            return [
+                _widget_state(tree.text_input[0], string_value=username),
+                _widget_state(tree.text_input[1], string_value=password),
+                _widget_state(login_button, trigger_value=True),
+            ]
+
+        return self.step("login", submit) and any(radio.key == "active_tab" for radio in self.tree.radio)
+
+    def checkbox(self, key):
+        return next((box for box in self.tree.checkbox if box.key == key), None)
+
+    # Value the page currently shows for a checkbox
+    def checkbox_value(self, box):
+        if box.id in self.widget_states:
+            return self.widget_states[box.id].bool_value
+        return box.proto.value if box.proto.set_value else box.proto.default
+
+    def set_checkbox(self, name, key, value):
+        return self.step(name, lambda tree: [_widget_state(self.checkbox(key), bool_value=value)])
+
+    def select_tab(self, name, key, label):
+        return self.step(name, lambda tree: [_widget_state(tree.radio(key=key), string_value=label)])
+
+    def history_filter(self):
+        return next((box for box in self.tree.selectbox if box.label == HISTORY_FILTER_LABEL), None)
+
+
+def _widget_state(widget, **value):
+    state = WidgetState(id=widget.id)
+    for field, v in value.items():
+        setattr(state, field, v)
+    return state
+
+
+def _widget_id(delta):
+    element = delta.new_element
+    return getattr(getattr(element, element.WhichOneof("type") or "", None), "id", "")
+
+
+def check_flow(session, rng):
+    box = session.checkbox("med_checkbox_0")
+    if box is None:
+        return []
+    actions = ["untick", "tick"] if session.checkbox_value(box) else ["tick", "untick"]
+    if rng.random() < 0.5:
+        actions = actions[:1]  # leave some boxes changed so the final state is checked too
+    done = []
+    for name in actions:
+        if session.set_checkbox(name, "med_checkbox_0", name == "tick"):
+            done.append(name)
+    return done
+
+
+def history_flow(session, rng):
+    session.select_tab("history", "active_tab", HISTORY_TAB)
+    selectbox = session.history_filter()
+    if selectbox is not None:
+        options = list(selectbox.options)
+        for option in rng.sample(options, min(MAX_FILTERS, len(options))):
+            session.step("filter", lambda tree: [_widget_state(session.history_filter(), string_value=option)])
+    session.select_tab("home", "active_tab", HOME_TAB)
+    return []
+
+
+def browse_flow(session, rng):
+    for section in rng.sample(ANALYTICS_SECTIONS, len(ANALYTICS_SECTIONS)):
+        session.select_tab(f"analytics:{section}", "analytics_section", section)
+    session.select_tab("medications", "active_tab", MEDICATIONS_TAB)
+    session.select_tab("home", "active_tab", HOME_TAB)
+    return []
+
+
+FLOWS = {"check": check_flow, "history": history_flow, "browse": browse_flow}
+
+
+# One simulated user: a new tab (websocket session) per flow, until the deadline
+def run_user(url, account, seed, deadline, timeout, record):
+    rng = random.Random(seed)
+    while time.monotonic() < deadline:
+        flow = rng.choices(list(FLOW_WEIGHTS), weights=list(FLOW_WEIGHTS.values()))[0]
+        session = ServerSession(url, timeout)
+        checklist_actions = []
+        try:
+            with session:
+                if session.login(account["username"], account["password"]):
+                    checklist_actions = FLOWS[flow](session, rng)
+        except Exception as e:
+            print(f"❌ {account['username']}: {e}")
+            session.timings.append(("connect", 0.0, False))
+        record(account["username"], session.timings, checklist_actions)
+
+
+def start_server(workspace, port):
+    log_path = os.path.join(workspace, "server.log")
+    with open(log_path, "w") as log:
+        server = subprocess.Popen(
+            [sys.executable, "-m", "streamlit", "run", MAIN_SCRIPT,
+             "--server.headless", "true", "--server.port", str(port),
+             "--server.fileWatcherType", "none", "--browser.gatherUsageStats", "false"],
+            cwd=workspace, stdout=log, stderr=subprocess.STDOUT,
+        )
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise SystemExit(f"❌ Server exited early, see {log_path}")
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/_stcore/health", timeout=1):
+                return server
+        except OSError:
+            time.sleep(0.5)
+    server.terminate()
+    raise SystemExit(f"❌ Server did not start within {SERVER_START_TIMEOUT}s, see {log_path}")
+
+
+# Peak resident set size of a process in MiB (Linux only), else None
+def peak_rss_mb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def check_integrity(accounts, last_actions, exclusive):
+    problems = []
+
+    # Complete lines and unique ids (a deleted record's id appears once more, on its tombstone)
+    events, ids, deleted = [], set(), set()
+    with open(ADMIN_PATH, "rb") as f:
+        data = f.read()
+    if data and not data.endswith(b"\n"):
+        problems.append("administration log ends with a partial line")
+    for number, line in enumerate(data.splitlines(), 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            problems.append(f"administration log line {number} is not valid JSON")
+            continue
+        if record.get("status") == admin_events.DELETED_STATUS:
+            if record.get("id") not in ids or record.get("id") in deleted:
+                problems.append(f"tombstone for unknown or already deleted id {record.get('id')} (line {number})")
+            deleted.add(record.get("id"))
+            continue
+        if record.get("id") in ids:
+            problems.append(f"duplicate administration id {record.get('id')} (line {number})")
+        ids.add(record.get("id"))
+        events.append(admin_events.from_record(record))
+    events = [event for event in events if event.id not in deleted]
+
+    # Today's checklist state and the rollup, per patient
+    today = date.today().toordinal()
+    taken_today = {}
+    for event in events:
+        if event.day == today:
+            taken_today.setdefault(medication_index.patient_id_of(event.patient_ref), set()).add(event.med_code)
+
+    for account in accounts:
+        patient_id = account["patient_id"]
+        if adherence_rollup.meds_taken(ADMIN_PATH, patient_id, today) != taken_today.get(patient_id, set()):
+            problems.append(f"rollup for {account['username']} disagrees with the log for today")
+
+        action = last_actions.get(account["username"])
+        if action is None or account["username"] not in exclusive:
+            continue
+        meds, _ = medication_index.patient_medications(REQUEST_PATH, patient_id)
+        med_code = meds[0]["RXnormCode"] or meds[0]["Medication"]
+        if (med_code in taken_today.get(patient_id, set())) != (action == "tick"):
+            problems.append(f"{account['username']}: last action was {action} but the log disagrees")
+
+    try:
+        with open(ACCOUNTS_PATH) as f:
+            json.load(f)
+    except ValueError:
+        problems.append("user_accounts.json is not valid JSON")
+    return len(events), problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate concurrent patient sessions against main.py.")
+    parser.add_argument("--size", default="S", help=f"Corpus size, one of {','.join(SIZES)}")
+    parser.add_argument("--users", type=int, default=8, help="Concurrent simulated users")
+    parser.add_argument("--shared-accounts", type=int, default=0,
+                        help="Spread the users over only this many accounts (0: one account per user)")
+    parser.add_argument("--duration", type=float, default=60, help="Seconds to run for")
+    parser.add_argument("--timeout", type=float, default=120, help="Seconds allowed per rerun")
+    parser.add_argument("--port", type=int, default=8599, help="Port for the local Streamlit server")
+    parser.add_argument("--seed", type=int, default=1, help="Seed for the users' flow choices")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Corpus generator workers")
+    parser.add_argument("--output", default="load_results.json", help="Where to write the results JSON")
+    args = parser.parse_args()
+
+    size = args.size.upper()
+    if size not in SIZES:
+        raise SystemExit(f"❌ Unknown size: {size}")
+    output = os.path.abspath(args.output)
+    workspace = prepare_workspace(ensure_corpus(size, args.workers))
+    pool = load_accounts(workspace)[:args.shared_accounts or args.users]
+    assignments = [pool[i % len(pool)] for i in range(args.users)]
+    exclusive = {a["username"] for a in pool if sum(b is a for b in assignments) == 1}
+
+    timings, last_actions = [], {}
+    results_lock = threading.Lock()
+
+    def record(username, session_timings, checklist_actions):
+        with results_lock:
+            timings.extend(session_timings)
+            for action in checklist_actions:
+                last_actions[username] = action
+
+    server = start_server(workspace, args.port)
+    try:
+        url = f"ws://127.0.0.1:{args.port}/_stcore/stream"
+        print(f"{size}: {args.users} users over {len(pool)} accounts for {args.duration:.0f}s ...")
+        start = time.monotonic()
+        deadline = start + args.duration
+        threads = [
+            threading.Thread(target=run_user, args=(url, account, args.seed + i, deadline, args.timeout, record))
+            for i, account in enumerate(assignments)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - start
+        server_rss = peak_rss_mb(server.pid)
+    finally:
+        server.terminate()
+        server.wait()
+
+    os.chdir(workspace)
+    latencies, errors = {}, {}
+    for name, seconds, ok in timings:
+        latencies.setdefault(name, []).append(seconds)
+        errors[name] = errors.get(name, 0) + (not ok)
+    records, problems = check_integrity(pool, last_actions, exclusive)
+
+    results = {
+        "meta": {"date": date.today().isoformat(), "size": size, "users": args.users,
+                 "accounts": len(pool), "duration_s": elapsed},
+        "throughput_rps": len(timings) / elapsed,
+        "error_rate": sum(errors.values()) / len(timings) if timings else 0.0,
+        "server_peak_rss_mb": server_rss,
+        "overall": summarize([seconds for _, seconds, _ in timings]) if timings else {},
+        "interactions": {
+            name: dict(summarize(values), errors=errors[name], error_rate=errors[name] / len(values))
+            for name, values in latencies.items()
+        },
+        "integrity": {"records": records, "problems": problems},
+    }
+
+    print(f"\n  {len(timings)} reruns in {elapsed:.1f}s: {results['throughput_rps']:.2f} reruns/s, "
+          f"error rate {results['error_rate']:.1%}, server peak RSS {server_rss or 0:.0f} MiB")
+    print(f"  {'interaction':32} {'n':>5} {'p50':>9} {'p95':>9} {'p99':>9}  errors")
+    for name, row in sorted(results["interactions"].items()):
+        print(f"  {name:32} {row['n']:5} {row['p50_ms']:8.0f}ms {row['p95_ms']:8.0f}ms {row['p99_ms']:8.0f}ms  {row['errors']}")
+    if problems:
+        print(f"\n❌ Integrity check failed ({len(problems)} problems):")
+        for problem in problems[:20]:
+            print(f"  - {problem}")
+    else:
+        print(f"\n✅ Integrity check passed ({records} administration records)")
+
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Wrote {output}")
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
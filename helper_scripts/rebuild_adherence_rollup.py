@@ -0,0 +1,31 @@
+# =================================================================================================
+# Adherence Rollup Rebuild
+#
+# Regenerates the per-patient, per-day adherence rollup ("<log>.rollup") from the full
+# MedicationAdministration log. The app keeps the rollup current on every checklist write,
+# so this is only needed after editing the log by hand or restoring it from a backup.
+#
+# Usage:
+#   python helper_scripts/rebuild_adherence_rollup.py [--log fhir_data/.../MedicationAdministration.ndjson]
+# =================================================================================================
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import adherence_rollup
+
+parser = argparse.ArgumentParser(description="Rebuild the daily adherence rollup from the administration log.")
+parser.add_argument("--log", default="fhir_data/medication_administration/MedicationAdministration.ndjson",
+                    help="MedicationAdministration NDJSON file")
+args = parser.parse_args()
+
+if not os.path.exists(args.log):
+    print(f"❌ Log not found: {args.log}")
+    sys.exit(1)
+
+start = time.perf_counter()
+patients, days = adherence_rollup.rebuild(args.log)
+print(f"✅ Rebuilt {args.log}.rollup: {patients} patient(s), {days} patient-day(s) in {time.perf_counter() - start:.2f}s")
@@ -0,0 +1,82 @@
+# =================================================================================================
+# Trace Flame View
+#
+# Renders one trace from the JSON-lines file written when MEDTRACKER_TRACE_FILE is set as a
+# flame-style timeline (HTML, open in a browser): one bar per span, positioned by its start
+# offset and nested by depth, with the span attributes on hover. Without --trace-id the most
+# recent trace whose root is --root (default "rerun") is shown; --list prints the latest traces.
+#
+# Usage:
+#   MEDTRACKER_TRACE_FILE=traces.jsonl streamlit run main.py
+#   python helper_scripts/trace_flame.py traces.jsonl --list
+#   python helper_scripts/trace_flame.py traces.jsonl [--trace-id ID] [--output trace.html]
+# =================================================================================================
+
+import argparse
+import os
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import ndjson_codec
+import tracing
+
+
+# trace id -> spans, in file order (spans of one trace are written together)
+def load_traces(path):
+    traces = {}
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                record = ndjson_codec.loads(line)
+            except ValueError:
+                continue
+            traces.setdefault(record["trace_id"], []).append(record)
+    return traces
+
+
+def root_of(spans):
+    return next((record for record in spans if record["parent_id"] is None), spans[0])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render a trace from a MEDTRACKER_TRACE_FILE as a flame timeline.")
+    parser.add_argument("trace_file", help="JSON-lines trace file")
+    parser.add_argument("--trace-id", help="Trace to render (default: the latest with the --root span)")
+    parser.add_argument("--root", default="rerun", help="Root span name used to pick the latest trace")
+    parser.add_argument("--list", type=int, nargs="?", const=20, help="List the latest N traces and exit")
+    parser.add_argument("--output", default="trace.html", help="Where to write the HTML")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.trace_file):
+        print(f"❌ Trace file not found: {args.trace_file}")
+        sys.exit(1)
+    traces = load_traces(args.trace_file)
+
+    if args.list:
+        for trace_id, spans in list(traces.items())[-args.list:]:
+            root = root_of(spans)
+            started = datetime.fromtimestamp(root["start"]).strftime("%Y-%m-%d %H:%M:%S")
+            print(f"{trace_id}  {started}  {root['duration_ms']:9.1f} ms  {len(spans):4} spans  {root['name']}"
+                  f"  {root['attributes']}")
+        return
+
+    if args.trace_id:
+        spans = traces.get(args.trace_id)
+    else:
+        spans = next((s for s in reversed(list(traces.values())) if root_of(s)["name"] == args.root), None)
+    if not spans:
+        print("❌ No matching trace")
+        sys.exit(1)
+
+    root = root_of(spans)
+    fig = tracing.flame_figure(spans)
+    fig.update_layout(title=f"{root['name']} {root['trace_id']} — {root['duration_ms']:.1f} ms")
+    fig.write_html(args.output)
+    print(f"✅ Wrote {args.output} ({len(spans)} spans, {root['duration_ms']:.1f} ms)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+import hashlib
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+import openai
+
+import metrics
+import tracing
+
+
+# Every OpenAI chat completion goes through chat_completion().
+#
+# Each attempt is bounded by REQUEST_TIMEOUT_SECONDS. Transient failures (rate
+# limits, timeouts, 5xx, connection errors) are retried with exponential
+# backoff, and each call is recorded in a local SQLite ledger
+# (MEDTRACKER_LLM_LEDGER, default app_data/llm_ledger.sqlite) with the call
+# site, model, a hash of the prompt, latency, prompt/completion tokens, retries,
+# outcome (ok or the error class) and its estimated cost. The summary queries
+# below (latency percentiles by model, daily spend, outcomes) read from the same
+# file, as does helper_scripts/llm_ledger_report.py. The call is also a
+# tracing span and is counted in the Prometheus metrics.
+
+LEDGER_PATH = os.getenv("MEDTRACKER_LLM_LEDGER", "app_data/llm_ledger.sqlite")
+MAX_RETRIES = 2
+RETRY_BACKOFF_SECONDS = 1.0  # doubled after each retry
+REQUEST_TIMEOUT_SECONDS = 60  # per attempt, unless the request sets request_timeout (openai's default is 600)
+# Longest a chat_completion() call with the default timeout can take, retries and backoff included
+MAX_CALL_SECONDS = (
+    REQUEST_TIMEOUT_SECONDS * (MAX_RETRIES + 1) + RETRY_BACKOFF_SECONDS * (2 ** MAX_RETRIES - 1)
+)
+RETRYABLE_ERRORS = (
+    openai.error.RateLimitError,
+    openai.error.Timeout,
+    openai.error.APIConnectionError,
+    openai.error.ServiceUnavailableError,
+    openai.error.TryAgain,
+    openai.error.APIError,
+)
+# USD per 1K (prompt, completion) tokens, for the spend estimates; update when pricing changes
+PRICES_PER_1K_TOKENS = {
+    "gpt-4o": (0.0025, 0.01),
+    "gpt-3.5-turbo": (0.0005, 0.0015),
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_calls (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    day TEXT NOT NULL,
+    call TEXT NOT NULL,
+    model TEXT NOT NULL,
+    prompt_hash TEXT NOT NULL,
+    latency_ms REAL NOT NULL,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    retries INTEGER NOT NULL,
+    outcome TEXT NOT NULL,
+    error TEXT,
+    cost_usd REAL
+);
+CREATE INDEX IF NOT EXISTS llm_calls_day ON llm_calls (day);
+"""
+
+_request_seconds = metrics.histogram(
+    "medtracker_openai_request_seconds", "OpenAI chat completion latency, retries included", ["call", "model"]
+)
+_requests = metrics.counter(
+    "medtracker_openai_requests_total", "OpenAI chat completions, by outcome", ["call", "model", "outcome"]
+)
+_retries = metrics.counter("medtracker_openai_retries_total", "OpenAI requests retried", ["call", "model"])
+_tokens = metrics.counter("medtracker_openai_tokens_total", "OpenAI tokens used", ["model", "kind"])
+
+_schema_lock = threading.Lock()
+_schema_ready = set()  # ledger paths whose table exists
+
+
+# openai.ChatCompletion.create(**request) with retries, tracing, metrics and a ledger entry.
+# call names the call site (e.g. "drug_interactions"). Errors are re-raised after recording.
+def chat_completion(call, **request):
+    request.setdefault("request_timeout", REQUEST_TIMEOUT_SECONDS)
+    model = request["model"]
+    prompt_hash = hashlib.sha256(
+        json.dumps(request["messages"], sort_keys=True, ensure_ascii=False).encode()
+    ).hexdigest()[:16]
+    retries = 0
+    start = time.perf_counter()
+    with tracing.span(f"openai: {call}", model=model, prompt_hash=prompt_hash) as span:
+        try:
+            while True:
+                try:
+                    response = openai.ChatCompletion.create(**request)
+                    break
+                except RETRYABLE_ERRORS:
+                    if retries >= MAX_RETRIES:
+                        raise
+                    time.sleep(RETRY_BACKOFF_SECONDS * 2 ** retries)
+                    retries += 1
+                    _retries.inc(call=call, model=model)
+        except Exception as e:
+            latency = time.perf_counter() - start
+            _request_seconds.observe(latency, call=call, model=model)
+            _requests.inc(call=call, model=model, outcome="error")
+            span.set_attributes(retries=retries)
+            _record(call, model, prompt_hash, latency, None, None, retries, type(e).__name__, str(e))
+            raise
+
+        latency = time.perf_counter() - start
+        usage = response.get("usage") or {}
+        prompt_tokens, completion_tokens = usage.get("prompt_tokens"), usage.get("completion_tokens")
+        _request_seconds.observe(latency, call=call, model=model)
+        _requests.inc(call=call, model=model, outcome="ok")
+        _tokens.inc(prompt_tokens or 0, model=model, kind="prompt")
+        _tokens.inc(completion_tokens or 0, model=model, kind="completion")
+        span.set_attributes(retries=retries, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        _record(call, model, prompt_hash, latency, prompt_tokens, completion_tokens, retries, "ok", None)
+        return response
+
+
+def estimate_cost(model, prompt_tokens, completion_tokens):
+    prices = PRICES_PER_1K_TOKENS.get(model)
+    if prices is None or prompt_tokens is None or completion_tokens is None:
+        return None
+    return (prompt_tokens * prices[0] + completion_tokens * prices[1]) / 1000
+
+
+# A failing ledger must never fail the call it records
+def _record(call, model, prompt_hash, latency, prompt_tokens, completion_tokens, retries, outcome, error):
+    now = time.time()
+    try:
+        with _connect() as db:
+            db.execute(
+                "INSERT INTO llm_calls (ts, day, call, model, prompt_hash, latency_ms, prompt_tokens,"
+                " completion_tokens, retries, outcome, error, cost_usd) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (now, date.fromtimestamp(now).isoformat(), call, model, prompt_hash, latency * 1000, prompt_tokens,
+                 completion_tokens, retries, outcome, error, estimate_cost(model, prompt_tokens, completion_tokens)),
+            )
+    except (sqlite3.Error, OSError) as e:
+        print(f"❌ Failed to record LLM call in {LEDGER_PATH}: {e}")
+
+
+# A short-lived connection per use, so any thread can write; WAL lets readers run alongside
+@contextmanager
+def _connect(path=None):
+    path = path or LEDGER_PATH
+    db = sqlite3.connect(path, timeout=10)
+    try:
+        with _schema_lock:
+            if path not in _schema_ready:
+                db.execute("PRAGMA journal_mode=WAL")
+                db.executescript(_SCHEMA)
+                _schema_ready.add(path)
+        yield db
+        db.commit()
+    finally:
+        db.close()
+
+
+# --- Summary queries ---
+
+def _since(days):
+    return (date.today() - timedelta(days=days - 1)).isoformat()
+
+
+# {model: {"calls", "p50_ms", "p95_ms", "max_ms"}} over successful calls in the last `days` days
+def latency_by_model(days=30, path=None):
+    latencies = {}
+    with _connect(path) as db:
+        rows = db.execute(
+            "SELECT model, latency_ms FROM llm_calls WHERE outcome = 'ok' AND day >= ? ORDER BY model, latency_ms",
+            (_since(days),),
+        )
+        for model, latency_ms in rows:
+            latencies.setdefault(model, []).append(latency_ms)
+    return {
+        model: {
+            "calls": len(values),
+            "p50_ms": _percentile(values, 50),
+            "p95_ms": _percentile(values, 95),
+            "max_ms": values[-1],
+        }
+        for model, values in latencies.items()
+    }
+
+
+# [(day, model, calls, prompt_tokens, completion_tokens, cost_usd)] for the last `days` days
+def daily_spend(days=30, path=None):
+    with _connect(path) as db:
+        return db.execute(
+            "SELECT day, model, COUNT(*), COALESCE(SUM(prompt_tokens), 0), COALESCE(SUM(completion_tokens), 0),"
+            " COALESCE(SUM(cost_usd), 0) FROM llm_calls WHERE day >= ? GROUP BY day, model ORDER BY day, model",
+            (_since(days),),
+        ).fetchall()
+
+
+# [(call, model, outcome, calls, retries)] for the last `days` days
+def outcomes(days=30, path=None):
+    with _connect(path) as db:
+        return db.execute(
+            "SELECT call, model, outcome, COUNT(*), SUM(retries) FROM llm_calls WHERE day >= ?"
+            " GROUP BY call, model, outcome ORDER BY call, model, outcome",
+            (_since(days),),
+        ).fetchall()
+
+
+# Nearest-rank percentile of sorted values
+def _percentile(values, pct):
+    return values[max(0, math.ceil(pct / 100 * len(values)) - 1)]
@@ -5,10 +5,30 @@ import uuid
 from datetime import datetime, date
 import plotly.graph_objects as go
 import medication_insights
+import admin_log_writer
+import medication_index
+import fhir_snapshot
+import patient_index
+import account_store
+import admin_log_reader
+import ndjson_codec
+import admin_events
+import adherence_rollup
+import adherence_ranges
+from adherence_analytics import (
+    calculate_adherence_rate, calculate_missed_doses, generate_weekly_summary, was_medication_taken_today,
+)
+import downsample
+import render_timing
+import memory_profile
+import tracing
+import metrics
+from file_locks import file_lock, data_version, bump_version, write_atomic
 import numpy as np
 from reportlab.lib.pagesizes import letter
 from reportlab.pdfgen import canvas
 import io
+import os
 import threading
 import time
 import smtplib
@@ -21,9 +41,9 @@ eastern = pytz.timezone("US/Eastern")
 
 def save_ndjson_data(file_path, data_list):
         try:
-            with open(file_path, "w") as f:
-                for entry in data_list:
-                    f.write(json.dumps(entry) + "\n")
+            with file_lock(file_path):
+                write_atomic(file_path, "".join(ndjson_codec.dumps_line(entry) for entry in data_list))
+                bump_version(file_path)
             return True
         except Exception as e:
             print(f"❌ Failed to save to {file_path}: {e}")
@@ -34,30 +54,12 @@ med_notes_path = "app_data/medication_notes.json"
 
 def update_user_account(username, updated_info):
     try:
-        with open("app_data/user_accounts.json", "r") as file:
-            users = json.load(file)
-
-        for user in users:
-            if user["username"] == username:
-                # Update all supported fields
-                user.update({
-                    "first_name": updated_info.get("first_name", user.get("first_name", "")),
-                    "last_name": updated_info.get("last_name", user.get("last_name", "")),
-                    "email": updated_info.get("email", user.get("email", "")),
-                    "phone": updated_info.get("phone", user.get("phone", "")),
-                    "address": updated_info.get("address", user.get("address", "")),
-                    "birth_date": updated_info.get("birth_date", user.get("birth_date", "")),
-                    "gender": updated_info.get("gender", user.get("gender", "")),
-                    "race": updated_info.get("race", user.get("race", "")),
-                    "ethnicity": updated_info.get("ethnicity", user.get("ethnicity", "")),
-                    "language": updated_info.get("language", user.get("language", "")),
-                    "religion": updated_info.get("religion", user.get("religion", "")),
-                })
-
-        with open("app_data/user_accounts.json", "w") as file:
-            json.dump(users, file, indent=2)
-
-        return True
+        # Update all supported fields
+        fields = ["first_name", "last_name", "email", "phone", "address", "birth_date",
+                  "gender", "race", "ethnicity", "language", "religion"]
+        return get_account_store().update(
+            username, {field: updated_info[field] for field in fields if field in updated_info}
+        )
     except Exception as e:
         print(f"❌ Error updating user_accounts.json: {e}")
         return False
@@ -72,73 +74,76 @@ def load_medication_notes():
         return {}
 
 def save_medication_notes(notes_data):
-    with open(med_notes_path, "w") as f:
-        json.dump(notes_data, f, indent=2)
+    with file_lock(med_notes_path):
+        write_atomic(med_notes_path, json.dumps(notes_data, indent=2))
+        bump_version(med_notes_path)
 
 
  # Function to delete a medication administration record
 def delete_medication_administration(med_id, med_administrations):
-    today = date.today().isoformat()
+    today = date.today().toordinal()
     records_to_keep = []
     deleted = False
     deleted_id = None
+    deleted_events = []
     
     for admin in med_administrations:
-        # Skip if not a MedicationAdministration
-        if admin.get("resourceType") != "MedicationAdministration":
-            records_to_keep.append(admin)
-            continue
-            
-        # Get the medication ID from the administration
-        admin_med_id = None
-        for coding in admin.get("medicationCodeableConcept", {}).get("coding", []):
-            if coding.get("system") == "http://www.nlm.nih.gov/research/umls/rxnorm":
-                admin_med_id = coding.get("code")
-                break
-                
-        if not admin_med_id:
-            admin_med_id = admin.get("medicationCodeableConcept", {}).get("text", "")
-            
         # Check if this is the medication we're looking for
-        if admin_med_id != med_id:
+        if admin.med_code != med_id:
             # Not the medication we're looking for, keep it
             records_to_keep.append(admin)
             continue
             
-        # Check if the administration was today
-        admin_date = None
-        try:
-            admin_datetime = admin.get("effectiveDateTime", "")
-            if admin_datetime:
-                admin_date = admin_datetime.split("T")[0]  # Extract just the date part
-        except:
-            # If we can't determine the date, keep the record
-            records_to_keep.append(admin)
-            continue
-            
         # If this is a record for our medication from today, don't keep it
-        if admin_date == today:
+        if admin.day == today:
             deleted = True
-            deleted_id = admin.get("id", "unknown")
+            deleted_id = admin.id or "unknown"
+            deleted_events.append(admin)
         else:
             # Keep records from other days
             records_to_keep.append(admin)
     
-    # Only rewrite the file if we actually deleted something
+    # Only write to the log if we actually deleted something
     if deleted:
-        try:
-            with open(med_admin_path, "w") as f:
-                for record in records_to_keep:
-                    f.write(json.dumps(record) + "\n")
-            return True, deleted_id
-        except Exception as e:
-            return False, str(e)
+        # Wait for the background writer to append the tombstones (raises if it failed), and
+        # only then update the in-memory list in place so it never disagrees with disk
+        get_admin_writer().delete(deleted_events).result(timeout=admin_log_writer.WRITE_TIMEOUT_SECONDS)
+        med_administrations[:] = records_to_keep
+        return True, deleted_id
     else:
         return False, "No matching record found for today"
 
 
 st.set_page_config(page_title="Medication Tracker", layout="centered", initial_sidebar_state="auto")
 
+# Time this rerun's sections (reported in the admin panel at the end of the page); the
+# sections are also spans of this rerun's trace
+render_timing.start_run()
+rerun_trace = tracing.start_trace("rerun")
+
+
+# Finish this rerun's timing and trace; returns (timing run, trace spans). The end of the page
+# does this, but st.stop()/st.rerun() leave the script by raising, so early exits go through
+# stop_rerun()/restart_rerun() instead
+def finish_rerun(page):
+    timing_run = render_timing.finish_run(page)
+    rerun_trace.set_attributes(page=page)
+    return timing_run, rerun_trace.end()
+
+
+def stop_rerun(page):
+    finish_rerun(page)
+    st.stop()
+
+
+def restart_rerun(page):
+    finish_rerun(page)
+    st.rerun()
+
+
+# Prometheus metrics exporter (side-port HTTP and/or textfile, see metrics.py); started once per process
+metrics.start_exporter()
+
 # File paths
 patient_file_path = "fhir_data/patient/Patient.ndjson"
 med_admin_path = "fhir_data/medication_administration/MedicationAdministration.ndjson"
@@ -150,52 +155,6 @@ user_accounts_path = "app_data/user_accounts.json"  # Added path for user accoun
 if "theme" not in st.session_state:
     st.session_state.theme = "light"
 
-def generate_weekly_summary(patient_id, user_meds, administrations):
-    today = date.today()
-    summary = {
-        "total_taken": 0,
-        "total_expected": 0,
-        "missed_by_day": {},
-        "most_missed": {},
-    }
-
-    for day_offset in range(7):
-        check_date = today - timedelta(days=day_offset)
-        daily_taken = 0
-        for med in user_meds:
-            med_code = med["RXnormCode"] or med["Medication"]
-            if any(
-                admin.get("subject", {}).get("reference", "").endswith(patient_id)
-                and (admin.get("medicationCodeableConcept", {}).get("coding", [{}])[0].get("code") == med_code or
-                     admin.get("medicationCodeableConcept", {}).get("text") == med_code)
-                and check_date.isoformat() in admin.get("effectiveDateTime", "")
-                for admin in administrations
-            ):
-                daily_taken += 1
-        summary["missed_by_day"][check_date.isoformat()] = len(user_meds) - daily_taken
-        summary["total_taken"] += daily_taken
-        summary["total_expected"] += len(user_meds)
-
-    # Most missed meds
-    med_miss_count = {}
-    for med in user_meds:
-        med_code = med["RXnormCode"] or med["Medication"]
-        misses = 0
-        for day_offset in range(7):
-            check_date = today - timedelta(days=day_offset)
-            if not any(
-                admin.get("subject", {}).get("reference", "").endswith(patient_id)
-                and (admin.get("medicationCodeableConcept", {}).get("coding", [{}])[0].get("code") == med_code or
-                     admin.get("medicationCodeableConcept", {}).get("text") == med_code)
-                and check_date.isoformat() in admin.get("effectiveDateTime", "")
-                for admin in administrations
-            ):
-                misses += 1
-        med_miss_count[med["Medication"]] = misses
-
-    summary["most_missed"] = sorted(med_miss_count.items(), key=lambda x: x[1], reverse=True)
-    return summary
-
 def toggle_theme():
     st.session_state.theme = "dark" if st.session_state.theme == "light" else "light"
 
@@ -204,7 +163,7 @@ with st.sidebar:
     theme_label = "🌙 Switch to Dark Mode" if st.session_state.theme == "light" else "☀️ Switch to Light Mode"
     if st.button(theme_label):
         toggle_theme()
-        st.rerun()
+        restart_rerun("theme")
 
 if st.session_state.theme == "dark":
     st.markdown("""
@@ -553,36 +512,43 @@ def help_section():
     st.markdown("## 📞 Contact & Support")
     st.info("For further assistance, email us at **support@medtracker.com** or call **+1-800-123-4567**.")
 
-# Load user accounts
-@st.cache_data
+# User accounts
+# One username-keyed store per process; it reloads itself when the file changes
+# (including saves from other server processes).
+def get_account_store():
+    return account_store.get_store(user_accounts_path)
+
 def load_user_accounts():
-    try:
-        with open(user_accounts_path, "r") as file:
-            return json.load(file)
-    except Exception as e:
-        st.error(f"Error loading user accounts: {e}")
-        return []
+    return get_account_store().all_users()
 
 # Load patient
-@st.cache_data
+# Patients are point-read through the Patient.ndjson byte-offset index. Each
+# cache entry is keyed on that patient's revision, so saving one profile only
+# invalidates that patient.
 def load_patient(patient_id=None):
     try:
-        with open(patient_file_path, "r") as file:
-            #st.write(f"patient_file_path, {patient_file_path}")
-            patient_data = json.loads(file.readline())
-            #st.write(f"patient_data, {patient_data['name'][0]['family']}")
-            # If a specific patient ID is provided, try to load that patient instead
-            if patient_id:
-                # Reset file pointer and search for the patient with matching ID
-                file.seek(0)
-                for line in file:
-                    try:
-                        patient = json.loads(line)
-                        if patient.get("id") == patient_id:
-                            return patient
-                    except:
-                        continue
-            return patient_data
+        revision = patient_index.patient_revision(patient_file_path, patient_id) if patient_id else None
+    except Exception as e:
+        st.error(f"Error loading patient data: {e}")
+        return {}
+    if revision is None:
+        # No (known) patient ID: fall back to the default patient, as before
+        return _load_default_patient_cached(data_version(patient_file_path))
+    return _load_patient_cached(patient_id, revision)
+
+@st.cache_data(max_entries=10000)
+def _load_patient_cached(patient_id, revision):
+    try:
+        return patient_index.read_patient(patient_file_path, patient_id) or {}
+    except Exception as e:
+        st.error(f"Error loading patient data: {e}")
+        return {}
+
+# Only the current version is ever asked for again; keep a couple in case of a race
+@st.cache_data(max_entries=2)
+def _load_default_patient_cached(version):
+    try:
+        return patient_index.read_first_patient(patient_file_path)
     except Exception as e:
         st.error(f"Error loading patient data: {e}")
         return {}
@@ -590,8 +556,8 @@ def load_patient(patient_id=None):
 # Load NDJSON
 def load_ndjson(path):
     try:
-        with open(path, "r") as f:
-            return [json.loads(line) for line in f]
+        with file_lock(path, shared=True), open(path, "r") as f:
+            return [ndjson_codec.loads(line) for line in f]
     except:
         return []
 
@@ -739,35 +705,10 @@ def save_patient_data(patient_data):
         if not patient_id:
             return False, "Invalid patient data: no patient ID found"
         
-        # Read all patients from the file
-        all_patients = []
-        try:
-            with open(patient_file_path, "r") as file:
-                for line in file:
-                    try:
-                        p = json.loads(line)
-                        all_patients.append(p)
-                    except:
-                        continue
-        except Exception as e:
-            return False, f"Error reading patient file: {e}"
-        
-        # Find and update the patient
-        updated = False
-        for i, p in enumerate(all_patients):
-            if p.get("id") == patient_id:
-                all_patients[i] = patient_data
-                updated = True
-                break
-        
-        if not updated:
-            return False, f"Patient with ID {patient_id} not found"
-        
-        # Write all patients back to the file
+        # Rewrites only this patient's line (under the file lock) using the byte-offset index
         try:
-            with open(patient_file_path, "w") as file:
-                for p in all_patients:
-                    file.write(json.dumps(p) + "\n")
+            if not patient_index.update_patient(patient_file_path, patient_data):
+                return False, f"Patient with ID {patient_id} not found"
             return True, "Patient data updated successfully"
         except Exception as e:
             return False, f"Error writing to patient file: {e}"
@@ -777,142 +718,118 @@ def save_patient_data(patient_data):
     
 from datetime import datetime, date, timedelta
 
-def get_date_range(period: str):
-    today = date.today()
-    
-    if period == "daily":
-        # Start & end are the same
-        return today, today
-    
-    elif period == "weekly":
-        start = today - timedelta(days=6)  # last 7 days (today included)
-        return start, today
-    
-    elif period == "monthly":
-        start = today.replace(day=1)  # first day of the current month
-        return start, today
-
-    else:
-        return today, today  # default fallback
-
 # Get user profile from user_accounts.json and patient resource
 def get_user_profile(username):
-    user_accounts = load_user_accounts()
-    for user in user_accounts:
-        if user.get("username") == username:
-            patient_id = user.get("patient_id", "")
-            
-            # Create a basic profile with user account info
-            profile = {
-                "first_name": user.get("first_name", ""),
-                "last_name": user.get("last_name", ""),
-                "patient_id": patient_id,
-                # Add other profile fields with default values
-                "birth_date": "N/A",
-                "gender": "unknown",
-                "race": "",
-                "ethnicity": "",
-                "language": "",
-                "religion": "",
-                "address": "N/A",
-                "email": "N/A",
-                "phone": "N/A"
-            }
-            
-            # If we have a patient_id, try to get the actual patient data
-            if patient_id:
-                patient_data = load_patient(patient_id)
-                #st.write(f"patient_data, {patient_data['name'][0]['family']}")
-                if patient_data:
-                    # Extract information from patient resource
-                    name = patient_data.get("name", [{}])[0]
-                    profile.update({
-                        "first_name": name.get("given", [""])[0] if name.get("given") else "",
-                        "last_name": name.get("family", ""),
-                        "birth_date": patient_data.get("birthDate", "N/A"),
-                        "gender": patient_data.get("gender", "unknown"),
-                        "address": patient_data.get("address", [{}])[0].get("text", 
-                                 " ".join(patient_data.get("address", [{}])[0].get("line", [""])) + 
-                                 ", " + patient_data.get("address", [{}])[0].get("city", "") +
-                                 ", " + patient_data.get("address", [{}])[0].get("state", "") +
-                                 " " + patient_data.get("address", [{}])[0].get("postalCode", "")
-                                 ) if patient_data.get("address") else "N/A",
-                        "phone": next((t.get("value", "N/A") for t in patient_data.get("telecom", []) 
-                                    if t.get("system") == "phone"), "N/A"),
-                        "email": next((t.get("value", "N/A") for t in patient_data.get("telecom", []) 
-                                    if t.get("system") == "email"), "N/A"),
-                    })
-                    
-                    # Extract race from extension
-                    for ext in patient_data.get("extension", []):
-                        if ext.get("url") == "http://hl7.org/fhir/us/core/StructureDefinition/us-core-race":
-                            for race_ext in ext.get("extension", []):
-                                if race_ext.get("url") == "text":
-                                    profile["race"] = race_ext.get("valueString", "")
-                        
-                        # Extract ethnicity from extension
-                        elif ext.get("url") == "http://hl7.org/fhir/us/core/StructureDefinition/us-core-ethnicity":
-                            for eth_ext in ext.get("extension", []):
-                                if eth_ext.get("url") == "text":
-                                    profile["ethnicity"] = eth_ext.get("valueString", "")
-                    
-                    # Extract language from communication
-                    if patient_data.get("communication"):
-                        for comm in patient_data.get("communication", []):
-                            if comm.get("language", {}).get("text"):
-                                profile["language"] = comm.get("language", {}).get("text", "")
-            
-            return profile
-    return None
-
-# Check if medication was taken today
-def was_medication_taken_today(med_id, administrations):
-    today = date.today().isoformat()
-    for admin in administrations:
-        # Skip if not a MedicationAdministration
-        if admin.get("resourceType") != "MedicationAdministration":
-            continue
+    user = get_account_store().get(username)
+    if user is None:
+        return None
+
+    patient_id = user.get("patient_id", "")
+    
+    # Create a basic profile with user account info
+    profile = {
+        "first_name": user.get("first_name", ""),
+        "last_name": user.get("last_name", ""),
+        "patient_id": patient_id,
+        # Add other profile fields with default values
+        "birth_date": user.get("birth_date") or "N/A",
+        "gender": user.get("gender") or "unknown",
+        "race": user.get("race", ""),
+        "ethnicity": user.get("ethnicity", ""),
+        "language": user.get("language", ""),
+        "religion": user.get("religion", ""),
+        "address": user.get("address") or "N/A",
+        "email": user.get("email") or "N/A",
+        "phone": user.get("phone") or "N/A"
+    }
+    
+    # If we have a patient_id, try to get the actual patient data
+    if patient_id:
+        patient_data = load_patient(patient_id)
+        #st.write(f"patient_data, {patient_data['name'][0]['family']}")
+        if patient_data:
+            # Extract information from patient resource
+            name = patient_data.get("name", [{}])[0]
+            profile.update({
+                "first_name": name.get("given", [""])[0] if name.get("given") else "",
+                "last_name": name.get("family", ""),
+                "birth_date": patient_data.get("birthDate", "N/A"),
+                "gender": patient_data.get("gender", "unknown"),
+                "address": patient_data.get("address", [{}])[0].get("text", 
+                         " ".join(patient_data.get("address", [{}])[0].get("line", [""])) + 
+                         ", " + patient_data.get("address", [{}])[0].get("city", "") +
+                         ", " + patient_data.get("address", [{}])[0].get("state", "") +
+                         " " + patient_data.get("address", [{}])[0].get("postalCode", "")
+                         ) if patient_data.get("address") else "N/A",
+                "phone": next((t.get("value", "N/A") for t in patient_data.get("telecom", []) 
+                            if t.get("system") == "phone"), "N/A"),
+                "email": next((t.get("value", "N/A") for t in patient_data.get("telecom", []) 
+                            if t.get("system") == "email"), "N/A"),
+            })
             
-        # Get the medication ID from the administration
-        admin_med_id = None
-        for coding in admin.get("medicationCodeableConcept", {}).get("coding", []):
-            if coding.get("system") == "http://www.nlm.nih.gov/research/umls/rxnorm":
-                admin_med_id = coding.get("code")
-                break
+            # Extract race from extension
+            for ext in patient_data.get("extension", []):
+                if ext.get("url") == "http://hl7.org/fhir/us/core/StructureDefinition/us-core-race":
+                    for race_ext in ext.get("extension", []):
+                        if race_ext.get("url") == "text":
+                            profile["race"] = race_ext.get("valueString", "")
                 
-        if not admin_med_id:
-            admin_med_id = admin.get("medicationCodeableConcept", {}).get("text", "")
-            
-        # Check if this is the medication we're looking for
-        if admin_med_id != med_id:
-            continue
-            
-        # Check if the administration was today
-        admin_date = None
-        try:
-            admin_datetime = admin.get("effectiveDateTime", "")
-            if admin_datetime:
-                admin_date = admin_datetime.split("T")[0]  # Extract just the date part
-        except:
-            continue
-            
-        if admin_date == today:
-            return True
+                # Extract ethnicity from extension
+                elif ext.get("url") == "http://hl7.org/fhir/us/core/StructureDefinition/us-core-ethnicity":
+                    for eth_ext in ext.get("extension", []):
+                        if eth_ext.get("url") == "text":
+                            profile["ethnicity"] = eth_ext.get("valueString", "")
             
-    return False
+            # Extract language from communication
+            if patient_data.get("communication"):
+                for comm in patient_data.get("communication", []):
+                    if comm.get("language", {}).get("text"):
+                        profile["language"] = comm.get("language", {}).get("text", "")
+    
+    return profile
 
 # Authenticate user
 def authenticate(username, password):
-    user_accounts = load_user_accounts()
-    for user in user_accounts:
-        if user.get("username") == username and user.get("password") == password:
-            return True
-    return False
+    return get_account_store().authenticate(username, password)
+
+# Shared background writer for checklist updates (one per server process)
+@st.cache_resource
+def _admin_writer():
+    return admin_log_writer.AdministrationLogWriter(med_admin_path)
+
+# The shared writer, replaced if its thread died or it got stuck on a commit
+def get_admin_writer():
+    writer = _admin_writer()
+    if not writer.healthy():
+        print(f"❌ Administration log writer for {med_admin_path} is stuck or dead; starting a new one")
+        _admin_writer.clear()
+        writer = _admin_writer()
+    return writer
+
+# Per-patient adherence prefix sums for the custom date-range view, rebuilt only when this
+# patient's administrations change (not on every other patient's checklist write)
+@st.cache_resource(max_entries=100)
+def load_adherence_prefix_sums(patient_id, med_codes, revision, today_ordinal):
+    return adherence_ranges.build_prefix_sums(med_admin_path, patient_id, list(med_codes), today_ordinal)
+
+# (medication codes, prefix sums) for the logged-in patient's active medications
+def current_adherence_prefix_sums():
+    med_codes = tuple(med["RXnormCode"] or med["Medication"] for med in active_medications)
+    patient_id = st.session_state.editable_profile.get("patient_id", "")
+    prefix_sums = load_adherence_prefix_sums(
+        patient_id,
+        med_codes,
+        adherence_rollup.patient_revision(med_admin_path, patient_id),
+        date.today().toordinal(),
+    )
+    return med_codes, prefix_sums
+
+TIMELINE_MAX_POINTS = 600  # per series; roughly one point per pixel of a full-width chart
 
 # Load data
+render_timing.start("load: default patient")
 patient = load_patient()  # Default patient data (will be replaced with specific patient after login)
-med_requests = load_ndjson(med_request_path)
-med_administrations = load_ndjson(med_admin_path)
+render_timing.stop("load: default patient")
 
 # Session state
 if "username" not in st.session_state:
@@ -988,26 +905,8 @@ if token and not st.session_state.get("logged_in"):
                     st.session_state.current_patient = patient_data
                 else:
                     st.warning("Patient data not found. Some features may be limited.")
-        st.rerun()
-
-
-def load_user_accounts():
-    with open("app_data/user_accounts.json") as f:
-        return json.load(f)
-
-def get_user_profile(username):
-    users = load_user_accounts()
-    for user in users:
-        if user["username"] == username:
-            return user
-    return None
+        restart_rerun("login")
 
-def authenticate(username, password):
-    users = load_user_accounts()
-    for user in users:
-        if user["username"] == username and user["password"] == password:
-            return True
-    return False
 # ----------------------------
 # Auto-login using query param token
 # ----------------------------
@@ -1051,10 +950,10 @@ if not st.session_state.get("logged_in"):
             if user_profile and user_profile.get("patient_id"):
                 st.session_state.current_patient = load_patient(user_profile["patient_id"])
 
-            st.rerun()
+            restart_rerun("login")
         else:
             st.error("Invalid credentials")
-    st.stop()
+    stop_rerun("login")
 
 # ----------------------------
 # Show logged-in content
@@ -1099,30 +998,38 @@ if st.query_params.get("logout") is not None:
     st.session_state.editable_profile = None
     st.session_state.current_patient = None
     st.query_params.clear()
-    st.rerun()
+    restart_rerun("logout")
 
-# Extract medications
-active_medications, stopped_medications = [], []
-for entry in med_requests:
-    if entry.get("resourceType") != "MedicationRequest":
-        continue
-    med_text = entry.get("medicationCodeableConcept", {}).get("text", "Unknown")
-    coding = next((c for c in entry.get("medicationCodeableConcept", {}).get("coding", []) if c.get("system") == "http://www.nlm.nih.gov/research/umls/rxnorm"), {})
-    dosage = entry.get("dosageInstruction", [{}])[0].get("text", "Dosage not specified")
-    prescriber = entry.get("requester", {}).get("display", "Unknown Prescriber")
-    effective_date = entry.get("authoredOn", "Unknown Date")
-    med = {
-        "Medication": med_text,
-        "Dosage": dosage,
-        "Prescriber": prescriber,
-        "Effective Date": effective_date,
-        "RequestID": entry.get("id", ""),
-        "RXnormCode": coding.get("code", ""),
-        "RXnormSystem": coding.get("system", ""),
-        "RXnormDisplay": coding.get("display", med_text),
-        "Original": entry
-    }
-    (active_medications if entry.get("status") == "active" else stopped_medications).append(med)
+# Extract medications: only this patient's prescriptions, from the shared request index
+render_timing.start("load: patient medications")
+active_medications, stopped_medications = medication_index.patient_medications(
+    med_request_path, st.session_state.editable_profile.get("patient_id", "")
+)
+
+tracing.set_attributes(active_medications=len(active_medications))
+render_timing.stop("load: patient medications")
+
+# The analytics never look further back than 90 days, so only that window of the
+# administration log is decoded (mmap + sparse date index), and each record is
+# projected into a compact AdminEvent tuple instead of a full FHIR dict. The log holds
+# every patient's administrations; the checklist, its deletes and the analytics below
+# must only ever see this patient's, so other patients' lines aren't decoded at all
+ANALYTICS_WINDOW_DAYS = 90
+render_timing.start("load: administration window")
+# Make sure queued checklist writes are on disk before reading
+try:
+    get_admin_writer().flush(timeout=admin_log_writer.WRITE_TIMEOUT_SECONDS)
+except TimeoutError:
+    st.warning("⚠️ Recent checklist changes are still being saved and may not be shown yet.")
+except Exception as e:
+    st.warning(f"⚠️ Recent checklist changes may not have been saved: {e}")
+med_administrations = admin_log_reader.read_range(
+    med_admin_path, date.today() - timedelta(days=ANALYTICS_WINDOW_DAYS - 1), date.today(),
+    decode=admin_events.decode_event, patient_id=st.session_state.editable_profile.get("patient_id", ""),
+)
+tracing.set_attributes(records=len(med_administrations))
+render_timing.stop("load: administration window")
+rerun_trace.set_attributes(patient=tracing.hash_id(st.session_state.editable_profile.get("patient_id", "")))
 
 # Custom CSS
 st.markdown("""
@@ -1164,18 +1071,27 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # Tabs
-home, medications, history, profile, help = st.tabs([
-    "\U0001F3E0 📊Home",
-    "\U0001F48A Medications",
-    "📈 History",
-    "Profile",
-    "\u2753 Help"
-])
-
-with history:
+# st.tabs runs every tab body on every rerun, so a single checkbox click would
+# recompute all the analytics and charts. Render only the selected section instead.
+def lazy_tabs(labels, key):
+    if st.session_state.get(key) not in labels:
+        st.session_state[key] = labels[0]
+    return st.radio("Section", labels, key=key, horizontal=True, label_visibility="collapsed")
+
+HOME_TAB = "\U0001F3E0 📊Home"
+MEDICATIONS_TAB = "\U0001F48A Medications"
+HISTORY_TAB = "📈 History"
+PROFILE_TAB = "Profile"
+HELP_TAB = "\u2753 Help"
+
+active_tab = lazy_tabs([HOME_TAB, MEDICATIONS_TAB, HISTORY_TAB, PROFILE_TAB, HELP_TAB], "active_tab")
+
+if active_tab == HISTORY_TAB:
     st.markdown("## 📊 Weekly Medication History & Insights")
 
-    summary = generate_weekly_summary(st.session_state.editable_profile["patient_id"], active_medications, med_administrations)
+    render_timing.start("history: weekly summary")
+    summary = generate_weekly_summary(st.session_state.editable_profile["patient_id"], active_medications, med_admin_path)
+    render_timing.stop("history: weekly summary")
     dates = list(summary["missed_by_day"].keys())[::-1]
 
     # Calculate adherence % per day
@@ -1260,8 +1176,8 @@ with history:
     selected_med = st.selectbox("Select a medication to view missed days:", ["All"] + med_names)
 
     if selected_med != "All":
-        filtered_admins = [admin for admin in med_administrations if selected_med in admin.get("medicationCodeableConcept", {}).get("text", "")]
-        filtered_dates = [admin.get("effectiveDateTime", "").split("T")[0] for admin in filtered_admins]
+        filtered_admins = [admin for admin in med_administrations if selected_med in admin.med_text]
+        filtered_dates = [date.fromordinal(admin.day).isoformat() for admin in filtered_admins if admin.day is not None]
         st.write(f"🗓 Taken on: {', '.join(filtered_dates[-7:]) if filtered_dates else 'No records found.'}")
 # --- 8. Missed vs Taken Doses --- #
     st.markdown("### 📊 Missed vs Taken Doses (Past 7 Days)")
@@ -1275,6 +1191,7 @@ with history:
         taken_counts.append(taken)
         missed_counts.append(missed)
 
+    render_timing.start("chart: taken vs missed")
     fig_stack = go.Figure()
     fig_stack.add_trace(go.Bar(
         x=dates,
@@ -1301,12 +1218,14 @@ with history:
     )
 
     st.plotly_chart(fig_stack, use_container_width=True)
+    render_timing.stop("chart: taken vs missed")
 
 
 
     # --- 9. PDF Export Button (In-Memory) --- #
     st.markdown("### 📄 Export Weekly Report")
  
+    render_timing.start("pdf: weekly report")
     pdf_buffer = io.BytesIO()
     c = canvas.Canvas(pdf_buffer, pagesize=letter)
     width, height = letter
@@ -1328,6 +1247,7 @@ with history:
     c.showPage()
     c.save()
     pdf_buffer.seek(0)
+    render_timing.stop("pdf: weekly report")
 
     st.download_button(
         label="Download Weekly PDF Report",
@@ -1337,192 +1257,8 @@ with history:
     )
 
 
-def calculate_adherence_rate(active_meds, med_administrations, period="daily"):
-    start_date, end_date = get_date_range(period)
-    today = date.today()
-    
-    # If there are no active medications, return 100% adherence
-    if not active_meds:
-        return 1.0
-    
-    # All distinct medication IDs (we'll compare by RXnormCode if present)
-    active_codes = [
-        med["RXnormCode"] if med["RXnormCode"] else med["Medication"]
-        for med in active_meds
-    ]
-    
-    # Helper: convert an ISO date string ("2023-03-05T09:00:00") to date object
-    def parse_admin_date(admin):
-        try:
-            return datetime.fromisoformat(admin["effectiveDateTime"]).date()
-        except:
-            try:
-                # Some dates might be in a different format
-                return datetime.strptime(admin["effectiveDateTime"].split('T')[0], "%Y-%m-%d").date()
-            except:
-                return None
-    
-    # Build a dict: day -> set of meds taken that day
-    daily_taken_map = {}
-    
-    for admin in med_administrations:
-        admin_date = parse_admin_date(admin)
-        if admin_date is None:
-            continue
-        
-        if start_date <= admin_date <= end_date:
-            # Determine which medication was administered
-            med_code = None
-            coding_list = admin.get("medicationCodeableConcept", {}).get("coding", [])
-            for c in coding_list:
-                if c.get("system") == "http://www.nlm.nih.gov/research/umls/rxnorm":
-                    med_code = c.get("code")
-                    break
-            if not med_code:
-                # If no RxNorm code found, try the text fallback
-                med_code = admin.get("medicationCodeableConcept", {}).get("text", "")
-            
-            # Record this medication in the daily map
-            if admin_date not in daily_taken_map:
-                daily_taken_map[admin_date] = set()
-            daily_taken_map[admin_date].add(med_code)
-    
-    # IMPORTANT: Check if today is the first day of the month/week
-    # If yes, and if all medications are taken today, return 100%
-    if period == "monthly" and today.day == 1:
-        # First day of month
-        all_taken_today = True
-        for code in active_codes:
-            if code not in daily_taken_map.get(today, set()):
-                all_taken_today = False
-                break
-        if all_taken_today:
-            return 1.0  # 100% adherence
-    
-    if period == "weekly" and today.weekday() == 0:  # Monday is 0
-        # First day of week
-        all_taken_today = True
-        for code in active_codes:
-            if code not in daily_taken_map.get(today, set()):
-                all_taken_today = False
-                break
-        if all_taken_today:
-            return 1.0  # 100% adherence
-    
-    # For any period where all medications taken today = 100% adherence for that period
-    # This applies even if it's not the first day of the period
-    # If we're just starting to track (no historical data), and everything is taken today,
-    # then adherence should be 100%
-    if len(daily_taken_map) <= 1 and today in daily_taken_map:
-        # We only have data for today
-        all_taken_today = True
-        for code in active_codes:
-            if code not in daily_taken_map.get(today, set()):
-                all_taken_today = False
-                break
-        if all_taken_today:
-            return 1.0  # 100% adherence
-    
-    # For new tracking periods with sparse data, use only days with actual data
-    days_with_data = [day for day in daily_taken_map.keys() if start_date <= day <= end_date]
-    if days_with_data:
-        # Adjust dates to only include days when medications were tracked
-        adjusted_start = max(start_date, min(days_with_data))
-        adjusted_end = min(end_date, max(days_with_data))
-    else:
-        adjusted_start = start_date
-        adjusted_end = end_date
-    
-    # Now walk through each day in the chosen period
-    total_days = (adjusted_end - adjusted_start).days + 1
-    
-    # We only expect medications on days that have already occurred
-    total_medications_expected = total_days * len(active_codes)
-    
-    medications_taken_count = 0
-    
-    current_day = adjusted_start
-    while current_day <= adjusted_end:
-        # For each day, see which meds were taken
-        meds_taken_today = daily_taken_map.get(current_day, set())
-        
-        # Count how many of the active meds are in meds_taken_today
-        for code in active_codes:
-            if code in meds_taken_today:
-                medications_taken_count += 1
-        
-        current_day += timedelta(days=1)
-    
-    if total_medications_expected == 0:
-        return 1.0  # If no medications are expected, adherence is perfect
-    
-    return medications_taken_count / total_medications_expected
-    
-
-
-def calculate_missed_doses(active_medications, med_administrations, days=7):
-    """Calculate missed doses for each medication over the specified period."""
-    missed_doses = {}
-    
-    # End date is today, start date is 'days' ago
-    end_date = date.today()
-    start_date = end_date - timedelta(days=days-1)
-    
-    # For each active medication
-    for med in active_medications:
-        med_id = med["RXnormCode"] or med["Medication"]
-        med_name = med["Medication"]
-        missed_count = 0
-        
-        # Check each day in the period
-        current_date = start_date
-        while current_date <= end_date:
-            # Skip future dates
-            if current_date > date.today():
-                current_date += timedelta(days=1)
-                continue
-                
-            # Check if medication was taken on this day
-            was_taken = False
-            for admin in med_administrations:
-                if admin.get("resourceType") != "MedicationAdministration":
-                    continue
-                
-                admin_med_id = None
-                for coding in admin.get("medicationCodeableConcept", {}).get("coding", []):
-                    if coding.get("system") == "http://www.nlm.nih.gov/research/umls/rxnorm":
-                        admin_med_id = coding.get("code")
-                        break
-                
-                if not admin_med_id:
-                    admin_med_id = admin.get("medicationCodeableConcept", {}).get("text", "")
-                
-                if admin_med_id != med_id:
-                    continue
-                
-                admin_date = None
-                try:
-                    admin_datetime = admin.get("effectiveDateTime", "")
-                    if admin_datetime:
-                        admin_date = datetime.fromisoformat(admin_datetime).date()
-                except:
-                    continue
-                
-                if admin_date == current_date:
-                    was_taken = True
-                    break
-            
-            if not was_taken:
-                missed_count += 1
-            
-            current_date += timedelta(days=1)
-        
-        missed_doses[med_name] = missed_count
-    
-    return missed_doses
-
 # Home dashboard section with the original styling from the enhanced version plus insights
-with home:
+if active_tab == HOME_TAB:
     # Enhanced styling with cards and modern layout
     st.markdown("""
     <style>
@@ -1633,26 +1369,15 @@ with home:
     """, unsafe_allow_html=True)
     
     # Dashboard statistics section
-    col1, col2, col3 = st.columns(3)
-    
-    # Calculate statistics directly from the database to avoid reset on refresh
-    def count_medications_taken_today():
-        taken_count = 0
-        for med in active_medications:
-            med_id = med["RXnormCode"] or med["Medication"]
-            if was_medication_taken_today(med_id, med_administrations):
-                taken_count += 1
-        return taken_count
-    
-    # Get counts directly from the database
-    total_active_meds = len(active_medications)
-    total_taken_today = count_medications_taken_today()
-    remaining_meds = total_active_meds - total_taken_today
+    # (the Medication Progress card lives in the checklist fragment below)
+    col1, col3 = st.columns(2)
     
     # Get adherence rates for different periods
+    render_timing.start("analytics: adherence rates")
     daily_rate = calculate_adherence_rate(active_medications, med_administrations, period="daily") * 100
     weekly_rate = calculate_adherence_rate(active_medications, med_administrations, period="weekly") * 100
     monthly_rate = calculate_adherence_rate(active_medications, med_administrations, period="monthly") * 100
+    render_timing.stop("analytics: adherence rates")
     
     # Function to determine color based on percentage
     def get_color(rate):
@@ -1673,16 +1398,6 @@ with home:
         </div>
         """, unsafe_allow_html=True)
     
-    # Medications count card
-    with col2:
-        st.markdown(f"""
-        <div class="stat-card">
-            <div class="card-header">Medication Progress</div>
-            <div class="metric-value">{total_taken_today}/{total_active_meds}</div>
-            <div class="metric-label">Medications taken/total</div>
-        </div>
-        """, unsafe_allow_html=True)
-    
     # Weekly trend card
     with col3:
         st.markdown(f"""
@@ -1708,6 +1423,7 @@ with home:
     }
     
     # Generate a Plotly bar chart
+    render_timing.start("chart: adherence by period")
     fig = go.Figure()
     
     fig.add_trace(go.Bar(
@@ -1730,6 +1446,7 @@ with home:
     )
     
     st.plotly_chart(fig, use_container_width=True)
+    render_timing.stop("chart: adherence by period")
     st.markdown("</div>", unsafe_allow_html=True)
 
     # Add this section after your existing medication tracking section in the home tab
@@ -1740,11 +1457,12 @@ with home:
         <div class="card-header">📊 Medication Analytics</div>
     """, unsafe_allow_html=True)
 
-    # Create tabs for the different analytics sections
-    analytics_tabs = st.tabs(["Medication Adherence", "Adherence Patterns"])
+    # Only the selected analytics section is computed on each rerun
+    analytics_section = lazy_tabs(["Medication Adherence", "Adherence Patterns", "Custom Range", "Timeline"], "analytics_section")
 
     # 1. Individual Medication Adherence Tab - Improved for long medication names
-    with analytics_tabs[0]:
+    if analytics_section == "Medication Adherence":
+        render_timing.start("analytics: medication adherence")
         st.subheader("Individual Medication Adherence")
         
         # Calculate adherence rate for each individual medication using real data
@@ -1772,34 +1490,14 @@ with home:
             for check_date in days_with_data:
                 was_taken = False
                 for admin in med_administrations:
-                    # Skip if not a MedicationAdministration
-                    if admin.get("resourceType") != "MedicationAdministration":
-                        continue
-                    
-                    # Get the medication ID from the administration
-                    admin_med_id = None
-                    for coding in admin.get("medicationCodeableConcept", {}).get("coding", []):
-                        if coding.get("system") == "http://www.nlm.nih.gov/research/umls/rxnorm":
-                            admin_med_id = coding.get("code")
-                            break
-                    
-                    if not admin_med_id:
-                        admin_med_id = admin.get("medicationCodeableConcept", {}).get("text", "")
+                    admin_med_id = admin.med_code
                     
                     # Skip if not the medication we're looking for
                     if admin_med_id != med_id:
                         continue
                     
                     # Check if the administration was on the check date
-                    admin_date = None
-                    try:
-                        admin_datetime = admin.get("effectiveDateTime", "")
-                        if admin_datetime:
-                            admin_date = datetime.fromisoformat(admin_datetime).date()
-                    except:
-                        continue
-                    
-                    if admin_date == check_date:
+                    if admin.day == check_date.toordinal():
                         was_taken = True
                         break
                 
@@ -1815,6 +1513,7 @@ with home:
             individual_adherence[med_name] = adherence_rate
         
         # IMPROVED: For long medication names, use a horizontal bar chart instead of vertical
+        render_timing.start("chart: medication adherence")
         fig = go.Figure()
         
         med_names = list(individual_adherence.keys())
@@ -1851,6 +1550,7 @@ with home:
         )
         
         st.plotly_chart(fig, use_container_width=True)
+        render_timing.stop("chart: medication adherence")
         
         # Medication with highest and lowest adherence
         if individual_adherence and len(individual_adherence) > 1:
@@ -1885,11 +1585,14 @@ with home:
                 <p><strong>{status}:</strong> {med_name} ({adherence_value:.1f}%)</p>
             </div>
             """, unsafe_allow_html=True)
+        render_timing.stop("analytics: medication adherence")
 
     # 2. Adherence Patterns Tab
-    with analytics_tabs[1]:
+    if analytics_section == "Adherence Patterns":
+        render_timing.start("analytics: adherence patterns")
         st.subheader("Weekly Adherence Patterns")
         
+        render_timing.start("analytics: weekday pattern")
         # Analyze adherence patterns by day of week using real data
         adherence_by_day = {
             "Monday": {"taken": 0, "total": 0},
@@ -1918,34 +1621,14 @@ with home:
                 # Check if medication was taken on this day
                 was_taken = False
                 for admin in med_administrations:
-                    # Skip if not a MedicationAdministration
-                    if admin.get("resourceType") != "MedicationAdministration":
-                        continue
-                    
-                    # Get the medication ID from the administration
-                    admin_med_id = None
-                    for coding in admin.get("medicationCodeableConcept", {}).get("coding", []):
-                        if coding.get("system") == "http://www.nlm.nih.gov/research/umls/rxnorm":
-                            admin_med_id = coding.get("code")
-                            break
-                    
-                    if not admin_med_id:
-                        admin_med_id = admin.get("medicationCodeableConcept", {}).get("text", "")
+                    admin_med_id = admin.med_code
                     
                     # Skip if not the medication we're looking for
                     if admin_med_id != med_id:
                         continue
                     
                     # Check if the administration was on the current date
-                    admin_date = None
-                    try:
-                        admin_datetime = admin.get("effectiveDateTime", "")
-                        if admin_datetime:
-                            admin_date = datetime.fromisoformat(admin_datetime).date()
-                    except:
-                        continue
-                    
-                    if admin_date == current_date:
+                    if admin.day == current_date.toordinal():
                         was_taken = True
                         break
                 
@@ -1961,12 +1644,14 @@ with home:
                 adherence_percentages[day] = (data["taken"] / data["total"]) * 100
             else:
                 adherence_percentages[day] = 0
+        render_timing.stop("analytics: weekday pattern")
         
         # Reorder days of week
         ordered_days = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
         ordered_percentages = [adherence_percentages.get(day, 0) for day in ordered_days]
         
         # Create a cleaner line chart with area fill for better visualization
+        render_timing.start("chart: weekday pattern")
         fig = go.Figure()
         
         # Add area chart under the line for visual appeal
@@ -2013,6 +1698,7 @@ with home:
         )
         
         st.plotly_chart(fig, use_container_width=True)
+        render_timing.stop("chart: weekday pattern")
         
         # Find days with highest and lowest adherence
         if adherence_percentages:
@@ -2059,15 +1745,15 @@ with home:
             <div class="card-header">⚠️ Missed Doses</div>
         """, unsafe_allow_html=True)
 
-        # Create two tabs for different time periods
-        missed_tabs = st.tabs(["Last 7 Days", "Last 30 Days"])
-
-        # Calculate missed doses for both periods
-        missed_doses_7 = calculate_missed_doses(active_medications, med_administrations, days=7)
-        missed_doses_30 = calculate_missed_doses(active_medications, med_administrations, days=30)
+        # Only the selected time period is computed
+        missed_period = lazy_tabs(["Last 7 Days", "Last 30 Days"], "missed_period")
 
         # Tab for Last 7 Days
-        with missed_tabs[0]:
+        if missed_period == "Last 7 Days":
+            render_timing.start("analytics: missed doses 7d")
+            missed_doses_7 = calculate_missed_doses(active_medications, med_administrations, days=7)
+            render_timing.stop("analytics: missed doses 7d")
+
             # Calculate total statistics
             total_missed_7 = sum(missed_doses_7.values())
             total_possible_7 = len(active_medications) * 7
@@ -2096,30 +1782,12 @@ with home:
                         was_taken = False
                         
                         for admin in med_administrations:
-                            if admin.get("resourceType") != "MedicationAdministration":
-                                continue
-                            
-                            admin_med_id = None
-                            for coding in admin.get("medicationCodeableConcept", {}).get("coding", []):
-                                if coding.get("system") == "http://www.nlm.nih.gov/research/umls/rxnorm":
-                                    admin_med_id = coding.get("code")
-                                    break
-                            
-                            if not admin_med_id:
-                                admin_med_id = admin.get("medicationCodeableConcept", {}).get("text", "")
+                            admin_med_id = admin.med_code
                             
                             if admin_med_id != med_id:
                                 continue
                             
-                            admin_date = None
-                            try:
-                                admin_datetime = admin.get("effectiveDateTime", "")
-                                if admin_datetime:
-                                    admin_date = datetime.fromisoformat(admin_datetime).date()
-                            except:
-                                continue
-                            
-                            if admin_date == check_date:
+                            if admin.day == check_date.toordinal():
                                 was_taken = True
                                 break
                         
@@ -2178,6 +1846,7 @@ with home:
                     med_names = [med[0][:15] + "..." if len(med[0]) > 15 else med[0] for med in top_meds]
                     miss_counts = [med[1] for med in top_meds]
                     
+                    render_timing.start("chart: missed doses 7d")
                     fig = go.Figure()
                     
                     # Determine colors based on missed count
@@ -2210,6 +1879,7 @@ with home:
                     )
                     
                     st.plotly_chart(fig, use_container_width=True)
+                    render_timing.stop("chart: missed doses 7d")
                     
                     # Add a simple suggestion for the most missed medication
                     if top_meds[0][1] > 2:  # If missed more than 2 days
@@ -2222,7 +1892,11 @@ with home:
                     st.success("No missed medications in the past 7 days! Keep up the good work!")
 
         # Tab for Last 30 Days
-        with missed_tabs[1]:
+        if missed_period == "Last 30 Days":
+            render_timing.start("analytics: missed doses 30d")
+            missed_doses_30 = calculate_missed_doses(active_medications, med_administrations, days=30)
+            render_timing.stop("analytics: missed doses 30d")
+
             # Calculate total statistics
             total_missed_30 = sum(missed_doses_30.values())
             total_possible_30 = len(active_medications) * 30
@@ -2251,30 +1925,12 @@ with home:
                         was_taken = False
                         
                         for admin in med_administrations:
-                            if admin.get("resourceType") != "MedicationAdministration":
-                                continue
-                            
-                            admin_med_id = None
-                            for coding in admin.get("medicationCodeableConcept", {}).get("coding", []):
-                                if coding.get("system") == "http://www.nlm.nih.gov/research/umls/rxnorm":
-                                    admin_med_id = coding.get("code")
-                                    break
-                            
-                            if not admin_med_id:
-                                admin_med_id = admin.get("medicationCodeableConcept", {}).get("text", "")
+                            admin_med_id = admin.med_code
                             
                             if admin_med_id != med_id:
                                 continue
                             
-                            admin_date = None
-                            try:
-                                admin_datetime = admin.get("effectiveDateTime", "")
-                                if admin_datetime:
-                                    admin_date = datetime.fromisoformat(admin_datetime).date()
-                            except:
-                                continue
-                            
-                            if admin_date == check_date:
+                            if admin.day == check_date.toordinal():
                                 was_taken = True
                                 break
                         
@@ -2333,6 +1989,7 @@ with home:
                     med_names = [med[0][:15] + "..." if len(med[0]) > 15 else med[0] for med in top_meds]
                     miss_counts = [med[1] for med in top_meds]
                     
+                    render_timing.start("chart: missed doses 30d")
                     fig = go.Figure()
                     
                     # Determine colors based on missed count percentage
@@ -2366,6 +2023,7 @@ with home:
                     )
                     
                     st.plotly_chart(fig, use_container_width=True)
+                    render_timing.stop("chart: missed doses 30d")
                     
                     # Weekly pattern analysis - identify days of the week with most misses
                     day_of_week_misses = {
@@ -2402,30 +2060,12 @@ with home:
                             was_taken = False
                             
                             for admin in med_administrations:
-                                if admin.get("resourceType") != "MedicationAdministration":
-                                    continue
-                                
-                                admin_med_id = None
-                                for coding in admin.get("medicationCodeableConcept", {}).get("coding", []):
-                                    if coding.get("system") == "http://www.nlm.nih.gov/research/umls/rxnorm":
-                                        admin_med_id = coding.get("code")
-                                        break
-                                
-                                if not admin_med_id:
-                                    admin_med_id = admin.get("medicationCodeableConcept", {}).get("text", "")
+                                admin_med_id = admin.med_code
                                 
                                 if admin_med_id != med_id:
                                     continue
                                 
-                                admin_date = None
-                                try:
-                                    admin_datetime = admin.get("effectiveDateTime", "")
-                                    if admin_datetime:
-                                        admin_date = datetime.fromisoformat(admin_datetime).date()
-                                except:
-                                    continue
-                                
-                                if admin_date == check_date:
+                                if admin.day == check_date.toordinal():
                                     was_taken = True
                                     break
                             
@@ -2458,6 +2098,106 @@ with home:
 
         # Close the chart container
         st.markdown("</div>", unsafe_allow_html=True)
+        render_timing.stop("analytics: adherence patterns")
+
+    # 3. Custom Range Tab - any date range, answered from prefix sums over the daily rollup
+    if analytics_section == "Custom Range":
+        render_timing.start("analytics: custom range")
+        st.subheader("Adherence for a Custom Date Range")
+
+        range_med_codes, prefix_sums = current_adherence_prefix_sums()
+        first_tracked = date.fromordinal(prefix_sums.first_day)
+
+        selected_range = st.date_input(
+            "Date range",
+            value=(max(first_tracked, date.today() - timedelta(days=29)), date.today()),
+            min_value=first_tracked,
+            max_value=date.today(),
+            key="custom_adherence_range",
+        )
+
+        if not active_medications:
+            st.info("No active medications to report on.")
+        elif len(selected_range) != 2:
+            st.info("Select an end date to see adherence for the range.")
+        else:
+            range_start, range_end = (d.toordinal() for d in selected_range)
+            range_taken, range_expected = prefix_sums.totals(range_start, range_end)
+            range_rate = range_taken / range_expected * 100 if range_expected else 0
+
+            col1, col2, col3 = st.columns(3)
+            col1.metric("Adherence", f"{range_rate:.1f}%")
+            col2.metric("Doses Taken", f"{range_taken}")
+            col3.metric("Doses Expected", f"{range_expected}")
+
+            by_medication = prefix_sums.by_medication(range_start, range_end)
+            range_df = pd.DataFrame([
+                {
+                    "Medication": med["Medication"],
+                    "Taken": by_medication[code][0],
+                    "Expected": by_medication[code][1],
+                    "Adherence (%)": round(by_medication[code][0] / by_medication[code][1] * 100, 1) if by_medication[code][1] else 0.0,
+                }
+                for med, code in zip(active_medications, range_med_codes)
+            ])
+            st.dataframe(range_df, hide_index=True, use_container_width=True)
+        render_timing.stop("analytics: custom range")
+
+    # 4. Timeline Tab - whole history as rolling adherence, downsampled before it is sent to the browser
+    if analytics_section == "Timeline":
+        render_timing.start("analytics: timeline")
+        st.subheader("Long-Range Adherence Timeline")
+
+        timeline_med_codes, prefix_sums = current_adherence_prefix_sums()
+        col1, col2 = st.columns([1, 2])
+        with col1:
+            rolling_window = st.selectbox(
+                "Rolling window", [7, 30, 90], index=1,
+                format_func=lambda days: f"{days} days", key="timeline_window",
+            )
+        with col2:
+            timeline_meds = st.multiselect(
+                "Show individual medications",
+                [med["Medication"] for med in active_medications],
+                key="timeline_meds",
+            )
+
+        timeline_series = [("All medications", None)] + [
+            (med["Medication"], code)
+            for med, code in zip(active_medications, timeline_med_codes)
+            if med["Medication"] in timeline_meds
+        ]
+        render_timing.start("chart: timeline")
+        fig_timeline = go.Figure()
+        history_days = 0
+        for series_name, series_code in timeline_series:
+            days, rates = prefix_sums.rolling_adherence(rolling_window, series_code)
+            history_days = len(days)
+            days, rates = downsample.lttb(days, rates, TIMELINE_MAX_POINTS)
+            fig_timeline.add_trace(go.Scattergl(
+                x=[date.fromordinal(int(day)) for day in days],
+                y=np.round(rates, 1),
+                mode="lines",
+                name=series_name,
+                line=dict(width=3 if series_code is None else 1.5),
+            ))
+
+        fig_timeline.update_layout(
+            yaxis=dict(title="Adherence (%)", range=[0, 105]),
+            hovermode="x unified",
+            height=400,
+            margin=dict(l=20, r=20, t=40, b=20),
+            plot_bgcolor='rgba(0,0,0,0)',
+            paper_bgcolor='rgba(0,0,0,0)',
+            legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
+        )
+        st.plotly_chart(fig_timeline, use_container_width=True)
+        render_timing.stop("chart: timeline")
+        st.caption(
+            f"{history_days} days of history, {rolling_window}-day rolling adherence, "
+            f"at most {TIMELINE_MAX_POINTS} points per line."
+        )
+        render_timing.stop("analytics: timeline")
     
     st.markdown("</div>", unsafe_allow_html=True)
     
@@ -2539,123 +2279,140 @@ with home:
     </div>
     """, unsafe_allow_html=True)
 
-    # Check for already taken medications today from database
-    for med in active_medications:
-        med_id = med["RXnormCode"] or med["Medication"]
-        if med_id not in st.session_state.taken_medications:
-            # Check if this medication was already taken today according to the database
-            if was_medication_taken_today(med_id, med_administrations):
-                st.session_state.taken_medications[med_id] = True
-
-    # Create grid layout for medications
-    med_cols = st.columns(2)
-    col_idx = 0
-
-    for i, med in enumerate(active_medications):
-        med_id = med["RXnormCode"] or med["Medication"]
-        k = f"med_checkbox_{i}"
+    # The checklist is a fragment: ticking a box reruns only this function
+    # (checkboxes + progress card) instead of the whole page.
+    @st.fragment
+    @render_timing.timed("checklist")
+    def medication_checklist():
+        # Placeholder so the progress card reflects this run's clicks
+        progress_card = st.empty()
+
+        # Check for already taken medications today from database
+        for med in active_medications:
+            med_id = med["RXnormCode"] or med["Medication"]
+            if med_id not in st.session_state.taken_medications:
+                # Check if this medication was already taken today according to the database
+                if was_medication_taken_today(med_id, med_administrations):
+                    st.session_state.taken_medications[med_id] = True
+
+        # Create grid layout for medications
+        med_cols = st.columns(2)
+        col_idx = 0
+
+        for i, med in enumerate(active_medications):
+            med_id = med["RXnormCode"] or med["Medication"]
+            k = f"med_checkbox_{i}"
         
-        # Get initial value for checkbox - True if already taken today
-        initial_value = med_id in st.session_state.taken_medications and st.session_state.taken_medications[med_id]
+            # Get initial value for checkbox - True if already taken today
+            initial_value = med_id in st.session_state.taken_medications and st.session_state.taken_medications[med_id]
         
-        # Display in alternating columns
-        with med_cols[col_idx]:
-            # Display checkbox with appropriate label
-            label = f"{med['Medication']} ({med['Dosage']})"
-            if initial_value:
-                label += " ✓"
+            # Display in alternating columns
+            with med_cols[col_idx]:
+                # Display checkbox with appropriate label
+                label = f"{med['Medication']} ({med['Dosage']})"
+                if initial_value:
+                    label += " ✓"
             
-            # Add a special class if taken today
-            extra_class = "taken-medication" if initial_value else ""
+                # Add a special class if taken today
+                extra_class = "taken-medication" if initial_value else ""
             
-            st.markdown(f"<div class='medication-item {extra_class}'>", unsafe_allow_html=True)
+                st.markdown(f"<div class='medication-item {extra_class}'>", unsafe_allow_html=True)
             
-            # Create the checkbox
-            checked = st.checkbox(label, value=initial_value, key=k)
+                # Create the checkbox
+                checked = st.checkbox(label, value=initial_value, key=k)
             
-            # If status changed from unchecked to checked
-            if checked and not initial_value:
-                # Record in session state
-                st.session_state.taken_medications[med_id] = True
+                # If status changed from unchecked to checked
+                if checked and not initial_value:
+                    # Record in session state
+                    st.session_state.taken_medications[med_id] = True
                 
-                # Create MedicationAdministration entry
-                med_admin_entry = {
-                    "resourceType": "MedicationAdministration",
-                    "id": str(uuid.uuid4()),
-                    "status": "completed",
-                    "medicationCodeableConcept": {
-                        "coding": [
+                    # Create MedicationAdministration entry
+                    med_admin_entry = {
+                        "resourceType": "MedicationAdministration",
+                        "id": str(uuid.uuid4()),
+                        "status": "completed",
+                        "medicationCodeableConcept": {
+                            "coding": [
+                                {
+                                    "system": med['RXnormSystem'] or "http://www.nlm.nih.gov/research/umls/rxnorm",
+                                    "code": med['RXnormCode'] or "Unknown",
+                                    "display": med['RXnormDisplay'] or med['Medication']
+                                }
+                            ],
+                            "text": med["Medication"]
+                        },
+                        "subject": med["Subject"] or {"reference": f"Patient/{st.session_state.editable_profile.get('patient_id', '')}"},
+                        "context": med["Encounter"] or {"reference": f"Encounter/{str(uuid.uuid4())}"},
+                        "effectiveDateTime": datetime.now().isoformat(),
+                        "reasonCode": med["ReasonCode"] or [
                             {
-                                "system": med['RXnormSystem'] or "http://www.nlm.nih.gov/research/umls/rxnorm",
-                                "code": med['RXnormCode'] or "Unknown",
-                                "display": med['RXnormDisplay'] or med['Medication']
+                                "coding": [{
+                                    "system": "http://terminology.hl7.org/CodeSystem/reason-medication-given",
+                                    "code": "b",
+                                    "display": "Given as Ordered"
+                                }],
+                                "text": "Self-administered medication"
                             }
                         ],
-                        "text": med["Medication"]
-                    },
-                    "subject": med["Original"].get("subject", {"reference": f"Patient/{st.session_state.editable_profile.get('patient_id', '')}"}),
-                    "context": med["Original"].get("encounter", {"reference": f"Encounter/{str(uuid.uuid4())}"}),
-                    "effectiveDateTime": datetime.now().isoformat(),
-                    "reasonCode": med["Original"].get("reasonCode", [
-                        {
-                            "coding": [{
-                                "system": "http://terminology.hl7.org/CodeSystem/reason-medication-given",
-                                "code": "b",
-                                "display": "Given as Ordered"
-                            }],
-                            "text": "Self-administered medication"
-                        }
-                    ]),
-                    "performer": [{"actor": {"display": "Patient"}}]
-                }
-                
-                # Write to NDJSON file
-                with open(med_admin_path, "a") as f:
-                    f.write(json.dumps(med_admin_entry) + "\n")
-                
-                # Reload administrations to update the in-memory list
-                med_administrations.append(med_admin_entry)
-                
-                st.success(f"✅ Recorded: {med['Medication']}")
+                        "performer": [{"actor": {"display": "Patient"}}]
+                    }
                 
-            # Update session state if checkbox was unchecked
-            elif not checked and initial_value:
-                # Update session state
-                st.session_state.taken_medications[med_id] = False
+                    # Hand the write to the shared group-commit writer and wait for it to be durable
+                    try:
+                        get_admin_writer().append(med_admin_entry).result(timeout=admin_log_writer.WRITE_TIMEOUT_SECONDS)
+                        med_administrations.append(admin_events.from_record(med_admin_entry))
+                        st.success(f"✅ Recorded: {med['Medication']}")
+                    except TimeoutError:
+                        st.session_state.taken_medications[med_id] = False
+                        st.error(f"❌ Saving {med['Medication']} is taking too long; it may not have been recorded. Refresh to check.")
+                    except Exception as e:
+                        st.session_state.taken_medications[med_id] = False
+                        st.error(f"❌ Failed to record {med['Medication']}: {e}")
                 
-                # Delete the medication administration record for today
-                deleted, result = delete_medication_administration(med_id, med_administrations)
+                # Update session state if checkbox was unchecked
+                elif not checked and initial_value:
+                    # Update session state
+                    st.session_state.taken_medications[med_id] = False
                 
-                if deleted:
-                    # Reload the medications to update the in-memory list
-                    med_administrations = load_ndjson(med_admin_path)
-                    st.success(f"✅ Removed: {med['Medication']} - Record deleted from database")
-                else:
-                    st.warning(f"⚠️ Unmarked: {med['Medication']} - Note: {result}")
+                    # Delete the medication administration record for today (updates the in-memory list)
+                    try:
+                        deleted, result = delete_medication_administration(med_id, med_administrations)
+                    except TimeoutError:
+                        st.session_state.taken_medications[med_id] = True
+                        st.error(f"❌ Removing {med['Medication']} is taking too long; it may not have been removed. Refresh to check.")
+                    except Exception as e:
+                        st.session_state.taken_medications[med_id] = True
+                        st.error(f"❌ Failed to remove {med['Medication']}: {e}")
+                    else:
+                        if deleted:
+                            st.success(f"✅ Removed: {med['Medication']} - Record deleted from database")
+                        else:
+                            st.warning(f"⚠️ Unmarked: {med['Medication']} - Note: {result}")
             
-            st.markdown("</div>", unsafe_allow_html=True)
+                st.markdown("</div>", unsafe_allow_html=True)
             
-        # Toggle column for next medication
-        col_idx = 1 - col_idx
-
-
-
-
-
-
-
-
-
-
-
-
-
+            # Toggle column for next medication
+            col_idx = 1 - col_idx
+
+        # Medications count card
+        total_active_meds = len(active_medications)
+        total_taken_today = sum(
+            1 for med in active_medications
+            if st.session_state.taken_medications.get(med["RXnormCode"] or med["Medication"])
+        )
+        progress_card.markdown(f"""
+        <div class="stat-card">
+            <div class="card-header">Medication Progress</div>
+            <div class="metric-value">{total_taken_today}/{total_active_meds}</div>
+            <div class="metric-label">Medications taken/total</div>
+        </div>
+        """, unsafe_allow_html=True)
 
-    
+    medication_checklist()
 
 
 #  Medications
-with medications:
+if active_tab == MEDICATIONS_TAB:
     tab1, tab2 = st.tabs(["💊 Active Medications", "❌ Inactive Medications"])
     with tab1:
         with st.expander("➕ Add New Medication"):
@@ -2707,17 +2464,21 @@ with medications:
                     }]
                 }
 
-                with open(med_request_path, "a") as f:
-                    f.write(json.dumps(new_entry) + "\n")
+                with file_lock(med_request_path):
+                    with open(med_request_path, "a") as f:
+                        f.write(ndjson_codec.dumps_line(new_entry))
+                    bump_version(med_request_path)
 
                 st.success("✅ Medication added successfully!")
-                st.rerun()
+                restart_rerun(active_tab)
         # Load persisted medication notes (by medication ID)
         med_notes = load_medication_notes()
 
         for med in active_medications:
             med_id = med["RXnormCode"] or med["Medication"]
-            taken_today = med_id in st.session_state.taken_medications and st.session_state.taken_medications[med_id]
+            # From the administration log rather than the checklist's session state: the Home
+            # checklist isn't rendered while this tab is open, so that state may be empty
+            taken_today = was_medication_taken_today(med_id, med_administrations)
             
             # Add a special class if taken today
             extra_class = "taken-medication" if taken_today else ""
@@ -2739,42 +2500,46 @@ with medications:
                     med['Medication'] = st.text_input("Medication Name", value=med["Medication"], key=f"name_{med['RequestID']}")
                     med['Dosage'] = st.text_input("Dosage", value=med["Dosage"], key=f"dosage_{med['RequestID']}")
                     med['Prescriber'] = st.text_input("Prescriber", value=med["Prescriber"], key=f"doc_{med['RequestID']}")
-                    new_status = st.selectbox("Status", ["active", "stopped"], index=0 if med["Original"]["status"] == "active" else 1, key=f"status_{med['RequestID']}")
+                    new_status = st.selectbox("Status", ["active", "stopped"], index=0 if med["Status"] == "active" else 1, key=f"status_{med['RequestID']}")
                     
                     if st.button(f"Save Changes to {med['Medication']}", key=f"save_{med['RequestID']}"):
-                        all_requests = load_ndjson(med_request_path)
-                        updated_requests = []
-                        for entry in all_requests:
-                            if entry.get("id") == med["RequestID"]:
-                                entry["medicationCodeableConcept"]["text"] = med["Medication"]
-                                entry["medicationCodeableConcept"]["coding"][0]["display"] = med["Medication"]
-                                entry["medicationCodeableConcept"]["coding"][0]["code"] = med["RXnormCode"]
-                                entry["dosageInstruction"][0]["text"] = med["Dosage"]
-                                entry["requester"]["display"] = med["Prescriber"]
-                                entry["status"] = new_status
-                            updated_requests.append(entry)
-
-                        with open(med_request_path, "w") as f:
-                            for entry in updated_requests:
-                                f.write(json.dumps(entry) + "\n")
+                        with file_lock(med_request_path):
+                            with open(med_request_path, "r") as f:
+                                all_requests = [ndjson_codec.loads(line) for line in f if line.strip()]
+                            updated_requests = []
+                            for entry in all_requests:
+                                if entry.get("id") == med["RequestID"]:
+                                    entry["medicationCodeableConcept"]["text"] = med["Medication"]
+                                    entry["medicationCodeableConcept"]["coding"][0]["display"] = med["Medication"]
+                                    entry["medicationCodeableConcept"]["coding"][0]["code"] = med["RXnormCode"]
+                                    entry["dosageInstruction"][0]["text"] = med["Dosage"]
+                                    entry["requester"]["display"] = med["Prescriber"]
+                                    entry["status"] = new_status
+                                updated_requests.append(entry)
+
+                            write_atomic(med_request_path, "".join(ndjson_codec.dumps_line(entry) for entry in updated_requests))
+                            fhir_snapshot.rebuild(med_request_path, updated_requests)
+                            bump_version(med_request_path)
 
                         st.success("✅ Medication updated!")
-                        st.rerun()
+                        restart_rerun(active_tab)
 
                     if st.button(f"🗑 Delete {med['Medication']} ", key=f"delete_{med['RequestID']}"):
-                        all_requests = load_ndjson(med_request_path)
-                        updated_requests = []
-                        for entry in all_requests:
-                            if entry.get("id") == med["RequestID"]:
-                                entry["status"] = "stopped"
-                            updated_requests.append(entry)
-
-                        with open(med_request_path, "w") as f:
-                            for entry in updated_requests:
-                                f.write(json.dumps(entry) + "\n")
+                        with file_lock(med_request_path):
+                            with open(med_request_path, "r") as f:
+                                all_requests = [ndjson_codec.loads(line) for line in f if line.strip()]
+                            updated_requests = []
+                            for entry in all_requests:
+                                if entry.get("id") == med["RequestID"]:
+                                    entry["status"] = "stopped"
+                                updated_requests.append(entry)
+
+                            write_atomic(med_request_path, "".join(ndjson_codec.dumps_line(entry) for entry in updated_requests))
+                            fhir_snapshot.rebuild(med_request_path, updated_requests)
+                            bump_version(med_request_path)
 
                         st.warning(f"❌ Marked as Inactive: {med['Medication']}")
-                        st.rerun()
+                        restart_rerun(active_tab)
                                     
             with col2:
                 with st.expander("📝 Add/View Notes"):
@@ -2794,7 +2559,7 @@ with medications:
                             save_medication_notes(med_notes)  # Save to file
 
                             st.success(f"✅ Note added for {med['Medication']}!")
-                            st.rerun()
+                            restart_rerun(active_tab)
                         else:
                             st.warning("Note cannot be empty.")
 
@@ -2822,7 +2587,7 @@ CONDITIONS_PATH = "fhir_data/condition/Condition.ndjson"
 IMMUNIZATION_PATH = "fhir_data/immunization/Immunization.ndjson"
 ALLERGIES_PATH = "fhir_data/allergy_intolerance/AllergyIntolerance.ndjson"
 
-with profile:
+if active_tab == PROFILE_TAB:
     # Maintain active tab in session state
     tab_labels = ["Personal Information", "Contact Information", "Conditions", "Immunizations", "Allergies"]
     if "active_profile_tab" not in st.session_state:
@@ -2853,10 +2618,10 @@ with profile:
                 # ✅ Also update user_accounts.json
                 update_user_account(st.session_state.username, st.session_state.editable_profile)
 
-                load_patient.clear()  # Clear cache
+                # The saved patient's revision changed, so only their cache entry is refreshed
                 st.session_state.current_patient = load_patient(updated_patient["id"])
                 st.success("✅ Patient FHIR resource updated successfully.")
-                st.rerun()  # Ensure UI reflects update immediately
+                restart_rerun(active_tab)  # Ensure UI reflects update immediately
             else:
                 st.error(f"❌ Error saving patient data: {message}")
         else:
@@ -2899,7 +2664,7 @@ with profile:
         def load_conditions():
             try:
                 with open(CONDITIONS_PATH, "r") as f:
-                    return [json.loads(line) for line in f if line.strip()]
+                    return [ndjson_codec.loads(line) for line in f if line.strip()]
             except Exception as e:
                 print(f"❌ Failed to load conditions: {e}")
                 return []
@@ -2953,7 +2718,7 @@ with profile:
         def load_immunizations():
             try:
                 with open(IMMUNIZATION_PATH, "r") as f:
-                    return [json.loads(line) for line in f if line.strip()]
+                    return [ndjson_codec.loads(line) for line in f if line.strip()]
             except Exception as e:
                 st.error(f"❌ Failed to load immunizations: {e}")
                 return []
@@ -2998,7 +2763,7 @@ with profile:
         def load_allergies():
             try:
                 with open(ALLERGIES_PATH, "r") as f:
-                    return [json.loads(line) for line in f if line.strip()]
+                    return [ndjson_codec.loads(line) for line in f if line.strip()]
             except Exception as e:
                 st.error(f"❌ Failed to load allergies: {e}")
                 return []
@@ -3058,7 +2823,7 @@ st.markdown("""<hr style="margin-top: 3rem;">
 
 
 # Help
-with help:
+if active_tab == HELP_TAB:
     help_section() 
 
 
@@ -3067,29 +2832,21 @@ with help:
 # === Configuration === #
 GMAIL_ADDRESS = "cs6440medicationtracker@gmail.com"
 GMAIL_APP_PASSWORD = "nobn kuta ecgz dkti"
-USER_ACCOUNTS_PATH = "app_data/user_accounts.json"
 MED_REQUEST_PATH = "fhir_data/medication_request/MedicationRequest.ndjson"
 
-# === Load user accounts === #
-def load_user_accounts():
-    try:
-        with open(USER_ACCOUNTS_PATH, "r") as f:
-            return json.load(f)
-    except Exception as e:
-        print(f"❌ Failed to load user accounts: {e}")
-        return []
+# Metrics (re-registering on every rerun returns the same instances)
+email_send_seconds = metrics.histogram("medtracker_email_send_seconds", "SMTP send latency", ["kind"])
+emails_sent = metrics.counter("medtracker_emails_total", "Emails attempted, by outcome", ["kind", "outcome"])
+reminder_run_seconds = metrics.histogram(
+    "medtracker_reminder_run_seconds", "Duration of one reminder pass over all users", []
+)
 
 # === Load active medications === #
-def load_active_medications():
-    try:
-        with open(MED_REQUEST_PATH, "r") as f:
-            return [json.loads(line) for line in f if line.strip() and json.loads(line).get("status") == "active"]
-    except Exception as e:
-        print(f"❌ Failed to load medications: {e}")
-        return []
+def load_active_medications(patient_id):
+    return medication_index.patient_requests(MED_REQUEST_PATH, patient_id, "active")
 
 # === Send email === #
-def send_email(to_email, subject, body):
+def send_email(to_email, subject, body, kind="reminder"):
     try:
         msg = EmailMessage()
         msg["Subject"] = subject
@@ -3097,12 +2854,15 @@ def send_email(to_email, subject, body):
         msg["To"] = to_email
         msg.set_content(body)
 
-        with smtplib.SMTP("smtp.gmail.com", 587) as smtp:
+        with tracing.span(f"email: {kind}"), email_send_seconds.time(kind=kind), \
+                smtplib.SMTP("smtp.gmail.com", 587) as smtp:
             smtp.starttls()
             smtp.login(GMAIL_ADDRESS, GMAIL_APP_PASSWORD)
             smtp.send_message(msg)
+        emails_sent.inc(kind=kind, outcome="sent")
         print(f"✅ Reminder sent to {to_email}")
     except Exception as e:
+        emails_sent.inc(kind=kind, outcome="error")
         print(f"❌ Email error: {e}")
 
 # === Scheduler === #
@@ -3110,6 +2870,7 @@ last_sent_time = None
 
 def reminder_loop():
     global last_sent_time
+    metrics.start_exporter()  # no-op when the Streamlit tier in this process already started it
     while True:
         now = datetime.now()
         current_time = now.strftime("%H:%M")
@@ -3117,17 +2878,12 @@ def reminder_loop():
 
         if current_time in send_times and current_time != last_sent_time:
             print(f"📧 Sending reminders at {current_time}")
+            run_started = time.perf_counter()
+            # One trace per pass, with each email as a child span
+            reminder_trace = tracing.start_trace("reminder: run", send_time=current_time)
             users = load_user_accounts()
-            active_meds = load_active_medications()
-
-            # Load today's medication administrations
-            try:
-                with open("fhir_data/medication_administration/MedicationAdministration.ndjson", "r") as f:
-                    administrations = [json.loads(line) for line in f if line.strip()]
-            except:
-                administrations = []
 
-            today_str = date.today().isoformat()
+            today_day = date.today().toordinal()
 
             for user in users:
                 email = user.get("email")
@@ -3138,13 +2894,11 @@ def reminder_loop():
                 if not email or not patient_id:
                     continue
 
-                # Filter active medications for this user
-                user_meds = [
-                    m for m in active_meds
-                    if patient_id in m.get("subject", {}).get("reference", "")
-                ]
+                # Active medications for this user
+                user_meds = load_active_medications(patient_id)
 
-                # Determine which medications were not taken today
+                # Determine which medications were not taken today (from the daily rollup)
+                taken_today = adherence_rollup.meds_taken(med_admin_path, patient_id, today_day)
                 unchecked_meds = []
                 for med in user_meds:
                     med_code = next(
@@ -3152,18 +2906,7 @@ def reminder_loop():
                         med.get("medicationCodeableConcept", {}).get("text", "")
                     )
 
-                    taken_today = False
-                    for admin in administrations:
-                        if admin.get("subject", {}).get("reference", "").endswith(patient_id):
-                            admin_code = next(
-                                (c.get("code") for c in admin.get("medicationCodeableConcept", {}).get("coding", [])),
-                                admin.get("medicationCodeableConcept", {}).get("text", "")
-                            )
-                            if admin_code == med_code and today_str in admin.get("effectiveDateTime", ""):
-                                taken_today = True
-                                break
-
-                    if not taken_today:
+                    if med_code not in taken_today:
                         unchecked_meds.append(med)
 
                 if not unchecked_meds:
@@ -3191,6 +2934,9 @@ Stay healthy!
 """
                 send_email(email, "💊 Medication Reminder – Meds Pending Today", body)
 
+            reminder_run_seconds.observe(time.perf_counter() - run_started)
+            reminder_trace.set_attributes(users=len(users))
+            reminder_trace.end()
             last_sent_time = current_time
 
         time.sleep(60)
@@ -3203,19 +2949,10 @@ with st.expander("📧 Test Email Service"):
         first_name = st.session_state.editable_profile.get("first_name", "Patient")
 
         # Load current user's active medications
-        user_meds = [
-            m for m in load_active_medications()
-            if patient_id in m.get("subject", {}).get("reference", "")
-        ]
+        user_meds = load_active_medications(patient_id)
 
-        # Load medication administrations
-        try:
-            with open("fhir_data/medication_administration/MedicationAdministration.ndjson", "r") as f:
-                administrations = [json.loads(line) for line in f if line.strip()]
-        except:
-            administrations = []
-
-        today_str = date.today().isoformat()
+        # Medications already logged today, from the daily rollup
+        taken_today = adherence_rollup.meds_taken(med_admin_path, patient_id, date.today().toordinal())
 
         # Filter unchecked meds
         unchecked_meds = []
@@ -3225,17 +2962,7 @@ with st.expander("📧 Test Email Service"):
                 med.get("medicationCodeableConcept", {}).get("text", "")
             )
 
-            taken_today = False
-            for admin in administrations:
-                if admin.get("subject", {}).get("reference", "").endswith(patient_id):
-                    admin_code = next(
-                        (c.get("code") for c in admin.get("medicationCodeableConcept", {}).get("coding", [])),
-                        admin.get("medicationCodeableConcept", {}).get("text", "")
-                    )
-                    if admin_code == med_code and today_str in admin.get("effectiveDateTime", ""):
-                        taken_today = True
-                        break
-            if not taken_today:
+            if med_code not in taken_today:
                 unchecked_meds.append(med)
 
         # Build med list
@@ -3264,7 +2991,7 @@ https://medication-adherence-tracker.streamlit.app/
 – Medication Tracker
 """
 
-        send_email(test_email, "✅ Medication Tracker Test Email", test_body)
+        send_email(test_email, "✅ Medication Tracker Test Email", test_body, kind="test")
 
 
 
@@ -3282,6 +3009,58 @@ if time.time() - st.session_state.last_refresh_time > REFRESH_INTERVAL_SECONDS:
     st.experimental_rerun()
 
 
+# Render timing panel, only shown to the usernames listed in MEDTRACKER_ADMIN_USERS
+ADMIN_USERS = {name.strip() for name in os.getenv("MEDTRACKER_ADMIN_USERS", "").split(",") if name.strip()}
+timing_run, rerun_spans = finish_rerun(active_tab)
+
+# Opt-in memory profiling (MEDTRACKER_MEMORY_PROFILE=1): a tracemalloc diff per rerun, written to disk
+memory_report = None
+if memory_profile.ENABLED:
+    if "memory_session_id" not in st.session_state:
+        st.session_state.memory_session_id = uuid.uuid4().hex[:8]
+    memory_report = memory_profile.record_rerun(
+        st.session_state.memory_session_id, active_tab, st.session_state.to_dict(),
+        timing_run["sections"] if timing_run else [],
+    )
+
+if timing_run and st.session_state.username in ADMIN_USERS:
+    with st.sidebar.expander("⏱ Render timing"):
+        st.caption(f"This rerun: {timing_run['total_ms']:.0f} ms ({active_tab})")
+        st.dataframe(pd.DataFrame([
+            {"Section": "\u2003" * section["depth"] + section["name"], "ms": round(section["ms"], 1),
+             **({"Net KiB": round(section["net_bytes"] / 1024, 1)} if "net_bytes" in section else {})}
+            for section in timing_run["sections"]
+        ]), hide_index=True, use_container_width=True)
+
+        timing_stats = render_timing.section_stats()
+        st.caption(f"Last {len(render_timing.history())} reruns")
+        st.dataframe(pd.DataFrame([
+            {"Section": name, "Runs": row["runs"], "p50 ms": round(row["p50_ms"], 1),
+             "p95 ms": round(row["p95_ms"], 1), "Max ms": round(row["max_ms"], 1)}
+            for name, row in timing_stats.items()
+        ]), hide_index=True, use_container_width=True)
+        st.download_button(
+            label="Export timing history (JSON)",
+            data=render_timing.history_json(),
+            file_name="render_timing.json",
+            mime="application/json",
+        )
+
+        if memory_report:
+            st.caption(
+                f"Memory: {memory_report['traced_bytes'] / 2**20:.1f} MiB traced, "
+                f"peak RSS {memory_report['peak_rss_mb']:.0f} MiB"
+            )
+            st.dataframe(pd.DataFrame([
+                {"Session": session_id, "Retained KiB": round(row["retained_bytes"] / 1024), "Reruns": row["reruns"]}
+                for session_id, row in memory_profile.session_sizes().items()
+            ]), hide_index=True, use_container_width=True)
+
+    if rerun_spans:
+        with st.expander("🔥 This rerun's trace"):
+            st.plotly_chart(tracing.flame_figure(rerun_spans), use_container_width=True)
+
+
 def send_weekly_summary_email():
     today = date.today()
     if today.weekday() != 6:  # 6 = Sunday
@@ -3292,7 +3071,7 @@ def send_weekly_summary_email():
     if not patient_id:
         return
 
-    summary = generate_weekly_summary(patient_id, active_medications, med_administrations)
+    summary = generate_weekly_summary(patient_id, active_medications, med_admin_path)
     if not summary:
         return
 
@@ -3324,11 +3103,14 @@ def send_weekly_summary_email():
     msg.set_content(email_body)
 
     try:
-        with smtplib.SMTP_SSL("smtp.gmail.com", 465) as smtp:
+        with tracing.span("email: weekly_summary"), email_send_seconds.time(kind="weekly_summary"), \
+                smtplib.SMTP_SSL("smtp.gmail.com", 465) as smtp:
             smtp.login("your_email@gmail.com", "your_app_password")  # Replace with your Gmail app password
             smtp.send_message(msg)
             print(f"Weekly summary email sent to {msg['To']}")
+        emails_sent.inc(kind="weekly_summary", outcome="sent")
     except Exception as e:
+        emails_sent.inc(kind="weekly_summary", outcome="error")
         print(f"Failed to send weekly summary email: {e}")
 
 # Schedule it to run once every day
@@ -0,0 +1,98 @@
+import copy
+import os
+import threading
+
+import fhir_snapshot
+import metrics
+from file_locks import data_version
+
+
+# MedicationRequests grouped by patient and status.
+#
+# Instead of every session turning every prescription in the file into a view
+# dict, the file is indexed once per data version into
+#   patient id -> status -> [medication view, ...]
+# and a session only copies the views of its own patient. Views hold the few
+# fields the UI needs (plus the subject/encounter/reasonCode references the
+# checklist copies into new administrations), not the whole resource. The
+# index shares its records with fhir_snapshot and every other session, so
+# callers only ever get deep copies.
+
+RXNORM_SYSTEM = "http://www.nlm.nih.gov/research/umls/rxnorm"
+
+_indexes = {}  # path -> {"source": ..., "views": {...}, "requests": {...}}
+_indexes_lock = threading.Lock()
+
+
+# (active, stopped) medication views for one patient; copies the caller may edit
+def patient_medications(path, patient_id):
+    by_status = _get_index(path)["views"].get(patient_id, {})
+    active = copy.deepcopy(by_status.get("active", []))
+    stopped = copy.deepcopy([
+        view
+        for status, views in by_status.items() if status != "active"
+        for view in views
+    ])
+    return active, stopped
+
+
+# Raw MedicationRequest resources of one patient with the given status; copies the caller may edit
+def patient_requests(path, patient_id, status="active"):
+    return copy.deepcopy(_get_index(path)["requests"].get(patient_id, {}).get(status, []))
+
+
+def patient_id_of(reference):
+    return reference.rsplit("/", 1)[-1] if reference else ""
+
+
+def _view(entry):
+    concept = entry.get("medicationCodeableConcept", {})
+    med_text = concept.get("text", "Unknown")
+    coding = next((c for c in concept.get("coding", []) if c.get("system") == RXNORM_SYSTEM), {})
+    return {
+        "Medication": med_text,
+        "Dosage": entry.get("dosageInstruction", [{}])[0].get("text", "Dosage not specified"),
+        "Prescriber": entry.get("requester", {}).get("display", "Unknown Prescriber"),
+        "Effective Date": entry.get("authoredOn", "Unknown Date"),
+        "RequestID": entry.get("id", ""),
+        "RXnormCode": coding.get("code", ""),
+        "RXnormSystem": coding.get("system", ""),
+        "RXnormDisplay": coding.get("display", med_text),
+        "Status": entry.get("status", ""),
+        "Subject": entry.get("subject"),
+        "Encounter": entry.get("encounter"),
+        "ReasonCode": entry.get("reasonCode"),
+    }
+
+
+def _source(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (data_version(path), stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+def _get_index(path):
+    with _indexes_lock:
+        source = _source(path)
+        index = _indexes.get(path)
+        hit = index is not None and index["source"] == source
+        metrics.cache_lookups.inc(cache="medication_index", result="hit" if hit else "miss")
+        if not hit:
+            index = _build(path, source)
+            _indexes[path] = index
+        return index
+
+
+def _build(path, source):
+    views, requests = {}, {}
+    records = fhir_snapshot.load_records(path) if source is not None else []
+    for entry in records:
+        if entry.get("resourceType") != "MedicationRequest":
+            continue
+        patient_id = patient_id_of(entry.get("subject", {}).get("reference", ""))
+        status = entry.get("status", "")
+        requests.setdefault(patient_id, {}).setdefault(status, []).append(entry)
+        views.setdefault(patient_id, {}).setdefault(status, []).append(_view(entry))
+    return {"source": source, "views": views, "requests": requests}
@@ -3,10 +3,33 @@ import time
 import re
 from dotenv import load_dotenv
 import os
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import CancelledError, Future
+import llm_client
+import metrics
+import render_timing
+import tracing
 
 load_dotenv()
 openai.api_key = os.getenv('OPEN_AI_KEY')
 
+# Identical requests (same model, prompt and parameters) are answered once per process.
+# While one session's call is in flight, other sessions asking the same thing wait for
+# it instead of calling the API themselves (single flight), and successful answers are
+# cached for INSIGHT_CACHE_SECONDS. Failures are shared with the waiting callers but
+# never cached, so the next request tries again. Waiters give up after the longest a
+# call can take (llm_client.MAX_CALL_SECONDS); if the leading session's script run is
+# interrupted instead (st.rerun/st.stop), a waiter makes the call itself.
+INSIGHT_CACHE_SECONDS = 24 * 60 * 60
+INSIGHT_CACHE_MAX_ENTRIES = 1024
+
+_answers = OrderedDict()  # request key -> (stored_at, answer text), least recently used first
+_in_flight = {}  # request key -> Future of the answer text
+_answers_lock = threading.Lock()
+
 def load_api_key():
     api_key = os.getenv('OPEN_AI_KEY')
     if not api_key:
@@ -14,7 +37,58 @@ def load_api_key():
         return None
     return api_key
 
+# Answer text of a chat completion, shared with identical concurrent requests and cached.
+# Returns (answer, source) with source "hit", "coalesced" or "miss" (this call went to the API).
+def _shared_completion(call, **request):
+    key = hashlib.sha256(json.dumps(request, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+    while True:
+        with _answers_lock:
+            cached = _answers.get(key)
+            if cached is not None and time.time() - cached[0] < INSIGHT_CACHE_SECONDS:
+                _answers.move_to_end(key)
+                source = "hit"
+            else:
+                future = _in_flight.get(key)
+                source = "coalesced" if future is not None else "miss"
+                if future is None:
+                    future = _in_flight[key] = Future()
+        metrics.cache_lookups.inc(cache="insights", result=source)
+
+        if source == "hit":
+            return cached[1], source
+        if source == "miss":
+            break
+        try:
+            return future.result(timeout=llm_client.MAX_CALL_SECONDS), source
+        except CancelledError:
+            continue  # the leader was interrupted; look again (and maybe lead)
+
+    try:
+        response = llm_client.chat_completion(call, **request)
+        answer = response.choices[0].message.content.strip()
+    except Exception as e:
+        with _answers_lock:
+            del _in_flight[key]
+        future.set_exception(e)
+        raise
+    except BaseException:
+        # Streamlit's script control (StopException, RerunException) or an interrupt:
+        # not a result to hand the waiters, so release them to retry
+        with _answers_lock:
+            del _in_flight[key]
+        future.cancel()
+        raise
+    with _answers_lock:
+        _answers[key] = (time.time(), answer)
+        _answers.move_to_end(key)
+        while len(_answers) > INSIGHT_CACHE_MAX_ENTRIES:
+            _answers.popitem(last=False)
+        del _in_flight[key]
+    future.set_result(answer)
+    return answer, source
+
 # Function to detect drug interactions using OpenAI API
+@render_timing.timed("insights: drug interactions")
 def detect_drug_interactions(medications, api_key):
     if not api_key:
         return "Please set up your OpenAI API key to use this feature."
@@ -24,9 +98,10 @@ def detect_drug_interactions(medications, api_key):
     
     # Set the API key
     openai.api_key = api_key
+    tracing.set_attributes(medications=len(medications))
     
-    # Prepare the list of medications
-    med_names = [med["Medication"] for med in medications]
+    # Prepare the list of medications (sorted, so the same set always makes the same prompt)
+    med_names = sorted(med["Medication"] for med in medications)
     med_list = ", ".join(med_names)
     
     # Prepare the prompt
@@ -45,7 +120,8 @@ If no interactions are found, clearly state "No drug interactions found."
     
     try:
         # Call the OpenAI API
-        response = openai.ChatCompletion.create(
+        result, _ = _shared_completion(
+            "drug_interactions",
             model="gpt-4o",
             messages=[
                 {"role": "system", "content": "You are a pharmacological expert assistant providing medication analysis and drug interaction information."},
@@ -55,9 +131,6 @@ If no interactions are found, clearly state "No drug interactions found."
             max_tokens=800
         )
         
-        # Extract the response text
-        result = response.choices[0].message.content.strip()
-        
         # Check if no interactions were found
         if "no drug interactions found" in result.lower():
             return "✅ No drug interactions found between your current medications."
@@ -68,6 +141,7 @@ If no interactions are found, clearly state "No drug interactions found."
         return f"Error analyzing drug interactions: {str(e)}"
 
 # Function to generate medication insights using OpenAI API
+@render_timing.timed("insights: medication insights")
 def generate_medication_insights(medications, api_key):
     if not api_key:
         return "Please set up your OpenAI API key to use this feature."
@@ -77,6 +151,7 @@ def generate_medication_insights(medications, api_key):
     
     # Set the API key
     openai.api_key = api_key
+    tracing.set_attributes(medications=len(medications))
     
     # Prepare the data
     insights_data = {}
@@ -96,7 +171,8 @@ Keep each point brief (1-2 sentences) and focused on essential information a pat
 """
             
             # Call the OpenAI API
-            response = openai.ChatCompletion.create(
+            result, source = _shared_completion(
+                "medication_insights",
                 model="gpt-3.5-turbo",
                 messages=[
                     {"role": "system", "content": "You are a medication expert assistant providing clear, factual information about medications in a concise format."},
@@ -106,14 +182,12 @@ Keep each point brief (1-2 sentences) and focused on essential information a pat
                 max_tokens=400
             )
             
-            # Extract the response text
-            result = response.choices[0].message.content.strip()
-            
             # Add to our insights dictionary
             insights_data[med["Medication"]] = result
             
-            # Add a small delay to avoid rate limiting
-            time.sleep(0.5)
+            # Add a small delay to avoid rate limiting (only after an actual API call)
+            if source == "miss":
+                time.sleep(0.5)
             
         except Exception as e:
             insights_data[med["Medication"]] = f"Error retrieving insights: {str(e)}"
@@ -121,6 +195,7 @@ Keep each point brief (1-2 sentences) and focused on essential information a pat
     return insights_data
 
 # Function to format insights for display
+@render_timing.timed("insights: format")
 def format_insights(insights_dict):
     if isinstance(insights_dict, str):
         return insights_dict  # Return error message if it's a string
@@ -0,0 +1,137 @@
+import gc
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+import types
+
+
+# Opt-in memory profiling (MEDTRACKER_MEMORY_PROFILE=1).
+#
+# With profiling on, tracemalloc traces every allocation in the server process
+# (this slows reruns down noticeably, so it is for sizing runs, not production).
+# Then:
+#   - every render_timing section records its net allocation (bytes still
+#     allocated when it ends minus when it started), so growth can be pinned to
+#     the load, analytics or chart that caused it;
+#   - at the end of each rerun a snapshot is taken and compared with the previous
+#     one. The top growing source lines, the section deltas and the session's
+#     retained size are written to
+#     <MEDTRACKER_MEMORY_PROFILE_DIR>/<pid>/rerun-<n>.json (default dir: memory_profiles);
+#   - a session's retained size is everything reachable from its session_state.
+#     Objects shared with other sessions or process-wide caches are counted in
+#     every session that reaches them, so it is an upper bound per session.
+#
+# Snapshots are process-wide: with several sessions active, a diff also holds
+# what the other sessions allocated in between.
+
+ENABLED = os.getenv("MEDTRACKER_MEMORY_PROFILE", "") not in ("", "0")
+PROFILE_DIR = os.getenv("MEDTRACKER_MEMORY_PROFILE_DIR", "memory_profiles")
+TRACEBACK_FRAMES = int(os.getenv("MEDTRACKER_MEMORY_FRAMES", "1"))
+TOP_STATS = 25  # growing source lines written per rerun
+
+# Allocations made by the profiler itself or the import machinery are noise
+_SNAPSHOT_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+]
+# Shared program structure rather than session data; never walked into
+_NOT_RETAINED = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.CodeType, types.FrameType)
+
+_lock = threading.Lock()
+_last_snapshot = None
+_sequence = 0
+_sessions = {}  # session id -> {"retained_bytes", "reruns", "updated_at"}
+
+if ENABLED and not tracemalloc.is_tracing():
+    tracemalloc.start(TRACEBACK_FRAMES)
+
+
+# Bytes currently traced, or None when profiling is off
+def traced_bytes():
+    return tracemalloc.get_traced_memory()[0] if ENABLED else None
+
+
+# Deep size of everything reachable from obj (each object counted once)
+def retained_size(obj):
+    seen = set()
+    pending = [obj]
+    total = 0
+    while pending:
+        current = pending.pop()
+        if id(current) in seen or isinstance(current, _NOT_RETAINED):
+            continue
+        seen.add(id(current))
+        total += sys.getsizeof(current, 0)
+        pending.extend(gc.get_referents(current))
+    return total
+
+
+# Snapshot, diff against the previous rerun and write the report; returns it (None when off)
+def record_rerun(session_id, page, session_objects, sections):
+    global _last_snapshot, _sequence
+    if not ENABLED:
+        return None
+
+    snapshot = tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+    current, peak = tracemalloc.get_traced_memory()
+    retained = retained_size(session_objects)
+    with _lock:
+        previous, _last_snapshot = _last_snapshot, snapshot
+        _sequence += 1
+        sequence = _sequence
+        session = _sessions.setdefault(session_id, {"retained_bytes": 0, "reruns": 0, "updated_at": 0})
+        session.update(retained_bytes=retained, reruns=session["reruns"] + 1, updated_at=time.time())
+
+    if previous is not None:
+        growth = [stat for stat in snapshot.compare_to(previous, "lineno") if stat.size_diff > 0]
+        growth.sort(key=lambda stat: stat.size_diff, reverse=True)
+    else:
+        growth = snapshot.statistics("lineno")
+    report = {
+        "rerun": sequence,
+        "time": time.time(),
+        "session": session_id,
+        "page": page,
+        "traced_bytes": current,
+        "traced_peak_bytes": peak,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "session_retained_bytes": retained,
+        "sections": [
+            {"name": section["name"], "depth": section["depth"], "net_bytes": section.get("net_bytes")}
+            for section in sections
+        ],
+        "compared_to_previous": previous is not None,
+        "top_growth": [_stat_row(stat) for stat in growth[:TOP_STATS]],
+    }
+
+    directory = os.path.join(PROFILE_DIR, str(os.getpid()))
+    try:
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f"rerun-{sequence:06d}.json"), "w") as f:
+            json.dump(report, f, indent=2)
+    except OSError as e:
+        print(f"❌ Failed to write memory profile to {directory}: {e}")
+    return report
+
+
+# {session id: {"retained_bytes", "reruns", "updated_at"}} for every session profiled so far
+def session_sizes():
+    with _lock:
+        return {session_id: dict(row) for session_id, row in _sessions.items()}
+
+
+def _stat_row(stat):
+    frame = stat.traceback[0]
+    return {
+        "source": f"{frame.filename}:{frame.lineno}",
+        "size_bytes": stat.size,
+        "size_diff_bytes": getattr(stat, "size_diff", stat.size),
+        "count": stat.count,
+        "count_diff": getattr(stat, "count_diff", stat.count),
+    }
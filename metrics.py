@@ -0,0 +1,229 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from file_locks import write_atomic
+
+
+# Process-wide metrics in the Prometheus text exposition format.
+#
+# Modules declare their metrics once at import time with counter() / histogram()
+# (asking again for the same name returns the same metric) and update them from
+# any thread. Nothing is pushed anywhere: start_exporter() either serves the
+# current values over HTTP on a side port, rewrites a local textfile every few
+# seconds (for node_exporter's textfile collector, or just `cat`), or both:
+#
+#   MEDTRACKER_METRICS_PORT      serve http://<host>:<port>/metrics
+#   MEDTRACKER_METRICS_HOST      interface to bind (default 127.0.0.1)
+#   MEDTRACKER_METRICS_FILE      textfile to rewrite; "{pid}" is replaced with the process id
+#   MEDTRACKER_METRICS_INTERVAL  seconds between textfile writes (default 15)
+#
+# The Streamlit server and the reminder worker both call start_exporter(); when
+# they are separate processes, give each its own port or file.
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_metrics = {}  # name -> metric, in registration order
+_metrics_lock = threading.Lock()
+_exporter_lock = threading.Lock()
+_exporter_started = False
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values = {}  # label values -> total
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(_label_key(self, labels), 0)
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, total in sorted(values.items()):
+            yield self.name, dict(zip(self.labels, key)), total
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # label values -> [per-bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(self, labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            else:
+                state[len(self.buckets)] += 1
+            state[-1] += value
+
+    # Observe the duration of a with-block (also when it raises)
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = {key: list(state) for key, state in self._values.items()}
+        for key, state in sorted(values.items()):
+            labels = dict(zip(self.labels, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state):
+                cumulative += count
+                yield self.name + "_bucket", dict(labels, le=_format_value(bound)), cumulative
+            yield self.name + "_sum", labels, state[-1]
+            yield self.name + "_count", labels, cumulative
+
+
+def counter(name, help_text, labels=()):
+    return _register(Counter, name, help_text, labels)
+
+
+def histogram(name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+    return _register(Histogram, name, help_text, labels, buckets=buckets)
+
+
+def _register(cls, name, help_text, labels, **kwargs):
+    with _metrics_lock:
+        metric = _metrics.get(name)
+        if metric is None:
+            metric = _metrics[name] = cls(name, help_text, labels, **kwargs)
+        elif not isinstance(metric, cls) or metric.labels != tuple(labels):
+            raise ValueError(f"Metric {name} is already registered as a different {metric.kind}")
+        return metric
+
+
+# Metrics several modules report into
+ndjson_load_seconds = histogram(
+    "medtracker_ndjson_load_seconds", "Time to load (or catch up with) an NDJSON file", ["file", "loader"]
+)
+ndjson_records_parsed = counter(
+    "medtracker_ndjson_records_parsed_total", "NDJSON records decoded", ["file", "loader"]
+)
+cache_lookups = counter(
+    "medtracker_cache_lookups_total", "In-process cache lookups, by whether they were served as is", ["cache", "result"]
+)
+
+
+def _label_key(metric, labels):
+    if set(labels) != set(metric.labels):
+        raise ValueError(f"{metric.name} expects labels {metric.labels}, got {tuple(labels)}")
+    return tuple(str(labels[name]) for name in metric.labels)
+
+
+# Every registered metric in the text exposition format
+def render():
+    with _metrics_lock:
+        metrics = list(_metrics.values())
+    lines = []
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {_escape(metric.help_text, help_text=True)}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for sample_name, labels, value in metric.samples():
+            label_text = ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items())
+            lines.append(f"{sample_name}{{{label_text}}} {_format_value(value)}" if label_text
+                         else f"{sample_name} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def _escape(text, help_text=False):
+    text = str(text).replace("\\", "\\\\").replace("\n", "\\n")
+    return text if help_text else text.replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return str(value) if isinstance(value, int) else repr(value)
+
+
+def write_textfile(path):
+    write_atomic(path, render())
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # scrapes would otherwise flood the app's console
+
+
+# Serve /metrics from a daemon thread; returns the server (server_address has the bound port)
+def serve(port, host="127.0.0.1"):
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+def _write_periodically(path, interval):
+    while True:
+        try:
+            write_textfile(path)
+        except OSError as e:
+            print(f"❌ Failed to write metrics to {path}: {e}")
+        time.sleep(interval)
+
+
+# Start the exporters configured in the environment, once per process
+def start_exporter():
+    global _exporter_started
+    with _exporter_lock:
+        if _exporter_started:
+            return
+        _exporter_started = True
+
+        port = os.getenv("MEDTRACKER_METRICS_PORT")
+        if port:
+            try:
+                serve(int(port), os.getenv("MEDTRACKER_METRICS_HOST", "127.0.0.1"))
+            except (OSError, ValueError) as e:
+                print(f"❌ Failed to serve metrics on port {port}: {e}")
+
+        path = os.getenv("MEDTRACKER_METRICS_FILE")
+        if path:
+            interval = float(os.getenv("MEDTRACKER_METRICS_INTERVAL", "15"))
+            threading.Thread(
+                target=_write_periodically, args=(path.replace("{pid}", str(os.getpid())), interval),
+                name="metrics-textfile", daemon=True,
+            ).start()
@@ -0,0 +1,209 @@
+import os
+import pickle
+import threading
+import zlib
+
+import metrics
+import ndjson_codec
+from file_locks import file_lock, bump_version
+
+
+# Random-access lookups into Patient.ndjson.
+#
+# A "<file>.idx" sidecar maps patient id -> (offset, length, stamp, crc32) so a
+# patient is read with one seek + read + decode instead of a scan. The
+# stamp changes only when that patient's line is rewritten, which lets the
+# app's cache be invalidated per patient. The index is validated against the
+# file's inode/size/mtime: appends are indexed incrementally, anything else
+# triggers a rebuild.
+#
+# Saving a patient appends their new line and repoints the index at it; when
+# several lines have the same id the last one wins. So a crash mid-save can
+# only leave a partial last line, which isn't indexed, and the old line
+# stays in place. Reads check the line against its crc32 and reindex if it
+# doesn't match (e.g. the file was edited outside the app). Once more than
+# half the file is superseded lines it is compacted.
+
+INDEX_VERSION = 2
+
+_indexes = {}  # path -> in-process index
+_indexes_lock = threading.Lock()
+
+
+# Load a single patient by id (None if not found)
+def read_patient(path, patient_id):
+    with file_lock(path, shared=True):
+        for rebuild in (False, True):
+            entry = _get_index(path, rebuild)["entries"].get(patient_id)
+            if entry is None:
+                return None
+            patient = _read_entry(path, entry)
+            if patient is not None:
+                return patient
+            print(f"⚠️ Patient {patient_id} doesn't match its index entry in {path}; reindexing")
+    return None
+
+
+# Load the first patient in the file (the app's default patient), as last saved
+def read_first_patient(path):
+    with file_lock(path, shared=True):
+        entry = next(iter(_get_index(path)["entries"].values()), None)
+        return (_read_entry(path, entry) or {}) if entry else {}
+
+
+# Cache key for one patient's record; changes only when that patient is saved
+def patient_revision(path, patient_id):
+    with file_lock(path, shared=True):
+        entry = _get_index(path)["entries"].get(patient_id)
+    return (entry[2], entry[3]) if entry else None
+
+
+# Save one patient by appending their new line; the line it supersedes becomes dead space
+def update_patient(path, patient):
+    patient_id = patient.get("id")
+    with file_lock(path):
+        with _indexes_lock:
+            index = _refresh(path, _indexes.get(path))
+            if patient_id not in index["entries"]:
+                return False
+
+            line = ndjson_codec.dumps(patient).encode()
+            with open(path, "ab") as f:
+                end = f.tell()
+                # Terminate a partial line left by a crash rather than gluing onto it
+                if end and not _ends_with_newline(path, end):
+                    f.write(b"\n")
+                    end += 1
+                f.write(line + b"\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+            stat = os.stat(path)
+            index["entries"][patient_id] = (end, len(line), stat.st_mtime_ns, zlib.crc32(line))
+            index["indexed_to"] = stat.st_size
+            index["source"] = _source_of(stat)
+            live_bytes = sum(length + 1 for _, length, _, _ in index["entries"].values())
+            if index["indexed_to"] > 2 * live_bytes:
+                index = _compact(path, index)
+            _write_index(path, index)
+            _indexes[path] = index
+        bump_version(path)
+    return True
+
+
+def _ends_with_newline(path, size):
+    with open(path, "rb") as f:
+        f.seek(size - 1)
+        return f.read(1) == b"\n"
+
+
+# Rewrite the file with only each patient's current line, in index order. Call while
+# holding file_lock(path); returns the new index (the old one if a line fails its check).
+def _compact(path, index):
+    with open(path, "rb") as f:
+        data = f.read()
+    lines, entries, offset = [], {}, 0
+    for patient_id, (old_offset, length, stamp, crc) in index["entries"].items():
+        line = data[old_offset:old_offset + length]
+        if zlib.crc32(line) != crc:
+            print(f"⚠️ Not compacting {path}: patient {patient_id} doesn't match its index entry")
+            return index
+        lines.append(line + b"\n")
+        entries[patient_id] = (offset, length, stamp, crc)
+        offset += length + 1
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.writelines(lines)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return {"version": INDEX_VERSION, "source": _source_of(os.stat(path)), "entries": entries, "indexed_to": offset}
+
+
+# The line an index entry points at, or None if it fails its crc32 (torn or changed)
+def _read_entry(path, entry):
+    offset, length, _, crc = entry
+    with open(path, "rb") as f:
+        f.seek(offset)
+        line = f.read(length)
+    if zlib.crc32(line) != crc:
+        return None
+    return ndjson_codec.loads(line)
+
+
+def _get_index(path, rebuild=False):
+    with _indexes_lock:
+        index = _refresh(path, _indexes.get(path), rebuild)
+        _indexes[path] = index
+        return index
+
+
+def _source_of(stat):
+    return {"inode": stat.st_ino, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+# Make sure the index matches the file on disk, doing as little work as possible
+# (or, with rebuild, reindex the whole file)
+def _refresh(path, index, rebuild=False):
+    stat = os.stat(path)
+    source = _source_of(stat)
+    hit = not rebuild and index is not None and index["source"] == source
+    metrics.cache_lookups.inc(cache="patient_index", result="hit" if hit else "miss")
+    if hit:
+        return index
+
+    # Another process may already have updated the sidecar
+    on_disk = None if rebuild else _read_index(path)
+    if on_disk is not None and on_disk["source"] == source:
+        return on_disk
+    index = None if rebuild else on_disk or index
+
+    if index is not None and index["source"]["inode"] == stat.st_ino and stat.st_size > index["source"]["size"]:
+        index["indexed_to"] = _index_lines(path, index, index["indexed_to"], stat.st_mtime_ns)
+    else:
+        index = {"version": INDEX_VERSION, "source": None, "entries": {}}
+        index["indexed_to"] = _index_lines(path, index, 0, stat.st_mtime_ns)
+    index["source"] = source
+    _write_index(path, index)
+    return index
+
+
+# Index every complete line from start_offset on; returns where indexing stopped
+def _index_lines(path, index, start_offset, stamp):
+    entries = index["entries"]
+    offset = start_offset
+    with open(path, "rb") as f:
+        f.seek(start_offset)
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            content = line.rstrip(b"\r\n")
+            if line.strip():
+                try:
+                    patient_id = ndjson_codec.loads(line).get("id")
+                except (ValueError, AttributeError):
+                    patient_id = None
+                if patient_id:
+                    entries[patient_id] = (offset, len(content), stamp, zlib.crc32(content))
+            offset += len(line)
+    return offset
+
+
+def _read_index(path):
+    try:
+        with open(path + ".idx", "rb") as f:
+            index = pickle.load(f)
+    except Exception:
+        return None
+    return index if index.get("version") == INDEX_VERSION else None
+
+
+def _write_index(path, index):
+    tmp_path = f"{path}.idx.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path + ".idx")
+    except Exception as e:
+        print(f"❌ Failed to write patient index for {path}: {e}")
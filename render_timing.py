@@ -0,0 +1,146 @@
+import json
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import memory_profile
+import tracing
+
+
+# Per-rerun timing of page sections.
+#
+# main.py starts a run at the top of every rerun and finishes it at the bottom.
+# In between, each data load, analytics block, chart, PDF build and AI call is
+# timed as a section, nested sections included: with start(name) / stop(name)
+# around a stretch of the page, or with timed(name) as a context manager or a
+# decorator. Finished runs go into a rolling process-wide history, summarized
+# by the admin timing panel and exportable as JSON.
+#
+# Streamlit runs every rerun on its own script thread, so the current run is
+# thread-local. Sections entered outside a run (a fragment-only rerun, the
+# reminder thread) are simply not recorded. Sections still open when the run
+# finishes (st.stop()/st.rerun() left them early) are closed then. Every
+# section is also a tracing span (attributes are passed through), so the same
+# names show up in traces. With memory profiling on, sections also record
+# their net allocation.
+
+HISTORY_SIZE = 500  # finished reruns kept in memory
+
+_history = deque(maxlen=HISTORY_SIZE)
+_history_lock = threading.Lock()
+_current = threading.local()  # .run being recorded and .open sections, innermost last
+
+
+def start_run():
+    _current.run = {"started_at": time.time(), "t0": time.perf_counter(), "sections": []}
+    _current.open = []
+
+
+# Open a section (and its span); close it with stop(name)
+def start(name, **attributes):
+    opened = _open_sections()
+    run = getattr(_current, "run", None)
+    section = None
+    if run is not None:
+        section = {
+            "name": name,
+            "depth": len(opened),
+            "start_ms": (time.perf_counter() - run["t0"]) * 1000,
+            "ms": None,
+        }
+        run["sections"].append(section)
+    opened.append((name, tracing.span(name, **attributes), section, time.perf_counter(), memory_profile.traced_bytes()))
+
+
+# Close the innermost open section called name, and any left open inside it
+def stop(name, error=None):
+    opened = _open_sections()
+    if not any(entry[0] == name for entry in opened):
+        return
+    while opened:
+        entry = opened.pop()
+        _close(entry, error)
+        if entry[0] == name:
+            break
+
+
+@contextmanager
+def timed(name, **attributes):
+    start(name, **attributes)
+    try:
+        yield
+    except BaseException as e:
+        # Also reached when st.rerun()/st.stop() unwind through the section
+        stop(name, e)
+        raise
+    stop(name)
+
+
+def _open_sections():
+    opened = getattr(_current, "open", None)
+    if opened is None:
+        opened = _current.open = []
+    return opened
+
+
+def _close(entry, error=None):
+    name, span, section, start_time, start_bytes = entry
+    span.end(error)
+    if section is not None:
+        section["ms"] = (time.perf_counter() - start_time) * 1000
+        if start_bytes is not None:
+            section["net_bytes"] = memory_profile.traced_bytes() - start_bytes
+
+
+# Close the current run and add it to the history; returns the finished run (or None)
+def finish_run(page=""):
+    run = getattr(_current, "run", None)
+    if run is None:
+        return None
+    opened = _open_sections()
+    while opened:
+        _close(opened.pop())
+    _current.run = None
+    finished = {
+        "started_at": run["started_at"],
+        "page": page,
+        "total_ms": (time.perf_counter() - run["t0"]) * 1000,
+        "sections": run["sections"],
+    }
+    with _history_lock:
+        _history.append(finished)
+    return finished
+
+
+def history():
+    with _history_lock:
+        return list(_history)
+
+
+def history_json():
+    return json.dumps(history(), indent=2)
+
+
+# {section name: {"runs", "p50_ms", "p95_ms", "max_ms"}} over the history, slowest p95 first
+def section_stats():
+    durations = {}
+    for run in history():
+        for section in run["sections"]:
+            durations.setdefault(section["name"], []).append(section["ms"])
+    stats = {}
+    for name, values in durations.items():
+        values.sort()
+        stats[name] = {
+            "runs": len(values),
+            "p50_ms": _percentile(values, 50),
+            "p95_ms": _percentile(values, 95),
+            "max_ms": values[-1],
+        }
+    return dict(sorted(stats.items(), key=lambda item: item[1]["p95_ms"], reverse=True))
+
+
+# Nearest-rank percentile of sorted values
+def _percentile(values, pct):
+    return values[max(0, math.ceil(pct / 100 * len(values)) - 1)]
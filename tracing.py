@@ -0,0 +1,172 @@
+import hashlib
+import os
+import threading
+import time
+import uuid
+from collections import deque
+
+import plotly.graph_objects as go
+
+import ndjson_codec
+
+
+# Lightweight tracing.
+#
+# A span is a named, timed block with attributes (record counts, a hashed
+# patient id, the model of an API call, ...). Spans opened while another span
+# is open on the same thread become its children, so one rerun of main.py
+# yields a single trace: the "rerun" root with the page sections, analytics,
+# charts and OpenAI calls nested under it. Spans opened with nothing above
+# them (a fragment rerun, the reminder thread) start their own trace.
+#
+# When a trace's root span ends, the whole trace is kept in memory for the
+# admin panel's flame view and, if MEDTRACKER_TRACE_FILE is set, appended to
+# that file as JSON lines (one span per line; see helper_scripts/trace_flame.py).
+
+RECENT_TRACES = 50  # finished traces kept in memory
+TRACE_FILE = os.getenv("MEDTRACKER_TRACE_FILE")
+
+_recent = deque(maxlen=RECENT_TRACES)
+_recent_lock = threading.Lock()
+_export_lock = threading.Lock()
+_current = threading.local()  # .stack of open spans and .finished spans of this thread's trace
+
+
+class Span:
+    def __init__(self, name, attributes):
+        stack = _stack()
+        parent = stack[-1] if stack else None
+        if parent is None:
+            _current.finished = []
+        self.record = {
+            "trace_id": parent.record["trace_id"] if parent else uuid.uuid4().hex,
+            "span_id": uuid.uuid4().hex[:16],
+            "parent_id": parent.record["span_id"] if parent else None,
+            "name": name,
+            "start": time.time(),
+            "duration_ms": None,
+            "thread": threading.current_thread().name,
+            "status": "ok",
+            "attributes": dict(attributes),
+        }
+        self._t0 = time.perf_counter()
+        stack.append(self)
+
+    def set_attributes(self, **attributes):
+        self.record["attributes"].update(attributes)
+
+    # Close this span (and any children left open, e.g. by st.stop()).
+    # Returns the finished trace's spans when this was its root.
+    def end(self, error=None):
+        stack = _stack()
+        if self not in stack:
+            return None
+        while stack:
+            span = stack.pop()
+            span.record["duration_ms"] = (time.perf_counter() - span._t0) * 1000
+            if error is not None:
+                span.record["status"] = "error"
+                span.record["attributes"].setdefault("error", type(error).__name__)
+            _current.finished.append(span.record)
+            if span is self:
+                break
+        if stack:
+            return None
+        spans = sorted(_current.finished, key=lambda record: record["start"])
+        _current.finished = []
+        _export(spans)
+        return spans
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end(exc)
+
+
+def span(name, **attributes):
+    return Span(name, attributes)
+
+
+# Start a new trace on this thread, dropping whatever a previous (interrupted) run left open
+def start_trace(name, **attributes):
+    _current.stack = []
+    return Span(name, attributes)
+
+
+# Add attributes to the innermost open span, if any
+def set_attributes(**attributes):
+    stack = _stack()
+    if stack:
+        stack[-1].set_attributes(**attributes)
+
+
+# Stable, non-reversible patient identifier for span attributes
+def hash_id(value):
+    return hashlib.sha256(str(value).encode()).hexdigest()[:12]
+
+
+def recent_traces():
+    with _recent_lock:
+        return list(_recent)
+
+
+def _stack():
+    stack = getattr(_current, "stack", None)
+    if stack is None:
+        stack = _current.stack = []
+    return stack
+
+
+def _export(spans):
+    with _recent_lock:
+        _recent.append(spans)
+    if not TRACE_FILE:
+        return
+    try:
+        with _export_lock, open(TRACE_FILE, "a") as f:
+            f.write("".join(ndjson_codec.dumps_line(record) for record in spans))
+    except OSError as e:
+        print(f"❌ Failed to export trace to {TRACE_FILE}: {e}")
+
+
+# Flame-style timeline of one trace: a bar per span, offset by its start, one row per nesting depth
+def flame_figure(spans):
+    if not spans:
+        return go.Figure()
+    by_id = {record["span_id"]: record for record in spans}
+    t0 = min(record["start"] for record in spans)
+
+    def depth(record):
+        level = 0
+        while record["parent_id"] in by_id:
+            record = by_id[record["parent_id"]]
+            level += 1
+        return level
+
+    depths = [depth(record) for record in spans]
+    fig = go.Figure(go.Bar(
+        orientation="h",
+        base=[(record["start"] - t0) * 1000 for record in spans],
+        x=[record["duration_ms"] for record in spans],
+        y=depths,
+        text=[record["name"] for record in spans],
+        textposition="inside",
+        insidetextanchor="start",
+        marker_color=["#dc3545" if record["status"] == "error" else "#4a90d9" for record in spans],
+        marker_line=dict(color="white", width=1),
+        customdata=[
+            [record["name"], f"{record['duration_ms']:.1f}", ", ".join(f"{k}={v}" for k, v in record["attributes"].items())]
+            for record in spans
+        ],
+        hovertemplate="%{customdata[0]}<br>%{customdata[1]} ms<br>%{customdata[2]}<extra></extra>",
+    ))
+    fig.update_layout(
+        xaxis_title="ms since trace start",
+        yaxis=dict(autorange="reversed", tickmode="array", tickvals=sorted(set(depths)), title="depth"),
+        bargap=0.05,
+        height=120 + 30 * (max(depths) + 1),
+        margin=dict(l=20, r=20, t=20, b=40),
+        showlegend=False,
+    )
+    return fig